@@ -0,0 +1,329 @@
+"""
+Backfill KPI history for days the scraper did not run, or for newly added tickers.
+
+Only the price-derived columns can be reconstructed from Yahoo Finance price history
+(`previous_close`, `volume`, and `average_volume`); the other columns are left empty.
+The date range is split into chunks that are downloaded in bulk by separate worker
+processes, and each day is written to the same layout as `main.py` (controlled by the
+same `S3_BUCKET`, `PARQUET`, `DATASET`, and `SYMBOL_BUCKETS` environment variables).
+Backfilled rows never replace existing rows: on days that already have data, only the
+symbols missing from that day are added.
+
+Usage
+-----
+python backfill.py --start 2023-01-01 --end 2023-12-31 --symbols SPY VOO --workers 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from logging import Logger
+from typing import Dict, List, Optional, Set, Tuple
+
+import awswrangler as wr
+import pandas as pd
+import yfinance as yf
+
+from src.api import configure_yfinance_cache, etf_tickers
+from src.dataset import existing_symbols
+from src.manifest import parse_daily_file_name
+from src.schema import ColumnBuffers, kpi_columns, pandas_dtypes
+from src.utils import catch_errors, setup_logger, write_to_s3
+
+# Calendar days of history fetched before each chunk, enough for ~63 sessions of average volume
+lookback_days: int = 100
+# Number of sessions Yahoo Finance averages for `averageVolume` (three months)
+average_volume_sessions: int = 63
+# Nullable pandas dtypes of the backfilled columns, so that missing values become nulls rather than NaN
+history_dtypes: Dict[str, pd.api.extensions.ExtensionDtype] = {
+    column.name: pandas_dtypes[column.arrow_type]
+    for column in kpi_columns
+    if column.name in ("symbol", "previous_close", "volume", "average_volume")
+}
+
+
+def date_chunks(start: date, end: date, chunk_days: int) -> List[Tuple[date, date]]:
+    """
+    Split the inclusive range `start` to `end` into consecutive chunks of at most `chunk_days` days.
+
+    Parameters
+    ----------
+    start : date
+        First date of the range
+    end : date
+        Last date of the range
+    chunk_days : int
+        Maximum number of calendar days per chunk
+
+    Returns
+    -------
+    List[Tuple[date, date]]
+        Inclusive first and last date of each chunk
+    """
+    chunks: List[Tuple[date, date]] = []
+    chunk_start: date = start
+    while chunk_start <= end:
+        chunk_end: date = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end + timedelta(days=1)
+    return chunks
+
+
+def fetch_history_chunk(symbols: List[str], start: date, end: date) -> pd.DataFrame:
+    """
+    Download the daily price history of all symbols in one bulk call and derive the KPI columns.
+
+    Runs in a worker process, since `yf.download` keeps module-level state that concurrent
+    calls within one process would clobber.
+
+    Parameters
+    ----------
+    symbols : List[str]
+        Ticker symbols
+    start : date
+        First date of the chunk
+    end : date
+        Last date of the chunk
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per symbol and trading day with `symbol`, `date`, `previous_close`, `volume`,
+        and `average_volume`
+    """
+    configure_yfinance_cache()
+    raw: Optional[pd.DataFrame] = yf.download(
+        tickers=symbols,
+        start=start - timedelta(days=lookback_days),
+        # The end date is exclusive
+        end=end + timedelta(days=1),
+        auto_adjust=False,
+        actions=False,
+        progress=False,
+        multi_level_index=True,
+    )
+    if raw is None or raw.empty:
+        return pd.DataFrame(
+            columns=["symbol", "date", "previous_close", "volume", "average_volume"]
+        )
+
+    history: pd.DataFrame = (
+        raw.stack(level="Ticker", future_stack=True)
+        .reset_index()
+        .rename(columns={"Date": "date", "Ticker": "symbol"})
+        .dropna(subset=["Close"])
+        .sort_values(["symbol", "date"])
+    )
+    grouped = history.groupby("symbol")
+    # On any given day, Yahoo Finance reports the prior session's close and volume average
+    history["previous_close"] = grouped["Close"].shift(1)
+    history["average_volume"] = grouped["Volume"].transform(
+        lambda volume: (
+            volume.shift(1).rolling(average_volume_sessions, min_periods=1).mean()
+        )
+    )
+    history["date"] = history["date"].dt.date
+    in_chunk: pd.Series = (history["date"] >= start) & (history["date"] <= end)
+    return history.loc[
+        in_chunk, ["symbol", "date", "previous_close", "Volume", "average_volume"]
+    ].rename(columns={"Volume": "volume"})
+
+
+def existing_daily_files(s3_bucket: str) -> Dict[date, str]:
+    """
+    Return the standalone `daily-kpis/etf_kpis_YYYY_MM_DD` objects that already exist, by date.
+
+    Objects are found with a listing rather than from the manifest (see `src.manifest`), which
+    misses objects written by other tools, since writing over such an object would lose its rows.
+
+    Parameters
+    ----------
+    s3_bucket : str
+        Name of the bucket
+
+    Returns
+    -------
+    Dict[date, str]
+        Full s3 url of the parquet or csv object of each date
+    """
+    found: Dict[date, str] = {}
+    for path in wr.s3.list_objects(f"s3://{s3_bucket}/daily-kpis/etf_kpis_"):
+        if parsed := parse_daily_file_name(path.rsplit("/", 1)[-1]):
+            found[parsed[0]] = path
+    return found
+
+
+def merge_into_daily_file(frame: pd.DataFrame, path: str) -> int:
+    """
+    Add the rows of symbols missing from an existing daily object and rewrite it in its format.
+
+    Parameters
+    ----------
+    frame : pd.DataFrame
+        Backfilled rows of the object's date
+    path : str
+        Full s3 url of the existing parquet or csv object
+
+    Returns
+    -------
+    int
+        Number of rows added
+    """
+    parquet: bool = path.endswith(".parquet")
+    existing: pd.DataFrame = (
+        wr.s3.read_parquet(path=path, dtype_backend="numpy_nullable")
+        if parquet
+        else wr.s3.read_csv(path=path, index_col=0)
+    )
+    missing: pd.DataFrame = frame[~frame["symbol"].isin(existing["symbol"])]
+    if missing.empty:
+        return 0
+    write_to_s3(
+        data=pd.concat([existing, missing], ignore_index=True),
+        s3_path=path.rsplit(".", 1)[0],
+        parquet=parquet,
+        manifest=True,
+    )
+    return len(missing)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Backfill price-derived KPI columns from Yahoo Finance history"
+    )
+    parser.add_argument("--start", required=True, help="First date as YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="Last date as YYYY-MM-DD")
+    parser.add_argument(
+        "--symbols",
+        nargs="+",
+        default=etf_tickers,
+        help="Symbols to backfill, defaults to the core ETF tickers",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes")
+    parser.add_argument(
+        "--chunk-days", type=int, default=90, help="Calendar days per worker chunk"
+    )
+    return parser.parse_args(argv)
+
+
+@catch_errors
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="ETF KPIs Backfill")
+    start: date = datetime.strptime(args.start, "%Y-%m-%d").date()
+    end: date = datetime.strptime(args.end, "%Y-%m-%d").date()
+    symbols: List[str] = [symbol.upper() for symbol in args.symbols]
+
+    s3_bucket: Optional[str] = os.getenv("S3_BUCKET")
+    if not s3_bucket:
+        logger.error("[ERROR] The S3_BUCKET environment variable is not set")
+        return 1
+    parquet: bool = os.getenv("PARQUET") == "True"
+    dataset: bool = os.getenv("DATASET") == "True"
+    bucket_count: int = int(os.getenv("SYMBOL_BUCKETS", "0"))
+    dataset_root: str = f"s3://{s3_bucket}/kpis-dataset"
+
+    # Symbols already present on each day in dataset mode, and existing objects otherwise
+    present: Dict[date, Set[str]] = {}
+    daily_files: Dict[date, str] = {}
+    if dataset:
+        present = existing_symbols(root=dataset_root, start=start, end=end)
+    else:
+        daily_files = {
+            day: path
+            for day, path in existing_daily_files(s3_bucket=s3_bucket).items()
+            if start <= day <= end
+        }
+    logger.info(
+        f"Found existing data on {len(present) or len(daily_files)} days, only missing symbols are added to them"
+    )
+
+    chunks: List[Tuple[date, date]] = date_chunks(
+        start=start, end=end, chunk_days=args.chunk_days
+    )
+    logger.info(
+        f"Backfilling {len(symbols)} symbols from {start} to {end} in {len(chunks)} chunks with {args.workers} workers"
+    )
+    started: float = time.perf_counter()
+    rows_written: int = 0
+    days_written: int = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures: Dict[Future, Tuple[date, date]] = {
+            executor.submit(fetch_history_chunk, symbols, chunk_start, chunk_end): (
+                chunk_start,
+                chunk_end,
+            )
+            for chunk_start, chunk_end in chunks
+        }
+        for completed, future in enumerate(as_completed(futures), start=1):
+            history: pd.DataFrame = future.result()
+            chunk_rows: int = 0
+            frames: List[pd.DataFrame] = []
+            for day, day_history in history.groupby("date"):
+                if dataset:
+                    day_history = day_history[
+                        ~day_history["symbol"].isin(present.get(day, set()))
+                    ]
+                if day_history.empty:
+                    continue
+                # `to_dict` keeps NaN, which Arrow would write as a value rather than as a null
+                records: pd.DataFrame = (
+                    day_history.drop(columns="date")
+                    .astype(history_dtypes)
+                    .astype(object)
+                )
+                frame: pd.DataFrame = ColumnBuffers.from_rows(
+                    rows=records.where(records.notna(), None).to_dict("records"),
+                    run_date=day,
+                ).to_frame()
+                if dataset:
+                    frames.append(frame)
+                    chunk_rows += len(frame)
+                elif day in daily_files:
+                    added: int = merge_into_daily_file(
+                        frame=frame, path=daily_files[day]
+                    )
+                    chunk_rows += added
+                    days_written += bool(added)
+                else:
+                    write_to_s3(
+                        data=frame,
+                        s3_path=f"s3://{s3_bucket}/daily-kpis/etf_kpis_{day.strftime('%Y_%m_%d')}",
+                        parquet=parquet,
+                        manifest=True,
+                    )
+                    chunk_rows += len(frame)
+                    days_written += 1
+            if frames:
+                # Added next to existing files so that rows already in a partition are kept
+                write_to_s3(
+                    data=pd.concat(frames, ignore_index=True),
+                    s3_path=dataset_root,
+                    dataset=True,
+                    bucket_count=bucket_count,
+                    replace=False,
+                )
+                days_written += len(frames)
+            rows_written += chunk_rows
+
+            elapsed: float = time.perf_counter() - started
+            chunk_start, chunk_end = futures[future]
+            logger.info(
+                f"[{completed}/{len(chunks)}] {chunk_start} to {chunk_end}: {chunk_rows} rows "
+                f"| total {rows_written} rows over {days_written} days, {rows_written / elapsed:,.0f} rows/sec, "
+                f"ETA {elapsed / completed * (len(chunks) - completed):,.0f}s"
+            )
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"[SUCCESS] Backfilled {rows_written} rows over {days_written} days in {elapsed:,.1f}s "
+        f"({rows_written / max(elapsed, 1e-9):,.0f} rows/sec, {days_written / max(elapsed, 1e-9):,.2f} days/sec)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Compare the derived KPI stage against the row-wise pandas code consumers recompute it with.
+
+Approaches
+----------
+rowwise
+    Point-in-time KPIs with `DataFrame.apply(axis=1)` on the day's rows, and rolling changes with
+    `groupby().pct_change()` over the whole history reloaded from the daily outputs.
+vectorized
+    `add_derived_kpis` with NumPy operations on the nullable columns, and rolling changes updated
+    from a `RollingState` warmed up on the previous sessions, which is loaded and saved as part of the run.
+
+Both approaches start from DataFrames in memory, so reading the history from S3 is not even counted
+against the row-wise approach. The results are checked to agree.
+
+Usage
+-----
+python -m benchmarks.derived --symbols 1000 10000 --sessions 61
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.writer import synthetic_infos
+from src.api import rows_to_frame
+from src.derived import RollingState, add_derived_kpis, default_windows
+from src.schema import build_row
+from src.utils import setup_logger
+
+
+def synthetic_history(symbols: int, sessions: int) -> List[pd.DataFrame]:
+    """
+    Generate typed daily outputs with random-walk closes, oldest first.
+
+    Parameters
+    ----------
+    symbols : int
+        Number of symbols per session
+    sessions : int
+        Number of sessions
+
+    Returns
+    -------
+    List[pd.DataFrame]
+        One DataFrame per session
+    """
+    logger: logging.Logger = setup_logger(name="Derived Benchmark")
+    logger.setLevel(logging.WARNING)
+    base: pd.DataFrame = rows_to_frame(
+        logger=logger, rows=[build_row(info) for info in synthetic_infos(symbols)]
+    )
+    generator: np.random.Generator = np.random.default_rng(0)
+    closes: np.ndarray = base["previous_close"].to_numpy(dtype="float64")
+    days: List[pd.DataFrame] = []
+    for session in range(sessions):
+        closes = closes * np.exp(generator.normal(0, 0.01, size=symbols))
+        day: pd.DataFrame = base.copy()
+        day["previous_close"] = pd.array(closes, dtype="Float64")
+        day["volume"] = pd.array(
+            generator.integers(500_000, 1_500_000, size=symbols), dtype="Float64"
+        )
+        day["date"] = pd.Timestamp(
+            date.today() - timedelta(days=sessions - 1 - session)
+        )
+        days.append(day)
+    return days
+
+
+def rowwise(history: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Compute the derived KPIs of the last session the way consumers did, row by row over reloaded history.
+    """
+    today: pd.DataFrame = history[-1].copy()
+
+    def point_kpis(row: pd.Series) -> pd.Series:
+        spread = (
+            (row["ask"] - row["bid"]) / ((row["ask"] + row["bid"]) / 2)
+            if pd.notna(row["bid"]) and row["bid"] > 0 and row["ask"] >= row["bid"]
+            else np.nan
+        )
+        relative_volume = (
+            row["volume"] / row["average_volume"]
+            if pd.notna(row["average_volume"]) and row["average_volume"] > 0
+            else np.nan
+        )
+        premium = (
+            row["previous_close"] / row["nav_price"] - 1
+            if pd.notna(row["nav_price"]) and row["nav_price"] > 0
+            else np.nan
+        )
+        return pd.Series([spread, relative_volume, premium])
+
+    today[["bid_ask_spread", "relative_volume", "nav_premium"]] = today.apply(
+        point_kpis, axis=1
+    )
+    everything: pd.DataFrame = pd.concat(history, ignore_index=True).sort_values(
+        ["symbol", "date"]
+    )
+    grouped = everything.groupby("symbol")["previous_close"]
+    for window in default_windows:
+        everything[f"change_{window}d"] = grouped.pct_change(periods=window)
+    latest: pd.DataFrame = everything[everything["date"] == today["date"].iloc[0]]
+    return today.merge(
+        latest[["symbol", *[f"change_{window}d" for window in default_windows]]],
+        on="symbol",
+    )
+
+
+def vectorized(history: List[pd.DataFrame], state_path: Path) -> pd.DataFrame:
+    """
+    Compute the derived KPIs of the last session with the derived stage and a warmed-up rolling state.
+    """
+    logger: logging.Logger = setup_logger(name="Derived Benchmark")
+    state: RollingState = RollingState(logger=logger, path=state_path)
+    state.load()
+    derived: pd.DataFrame = add_derived_kpis(
+        data=history[-1], run_date=history[-1]["date"].iloc[0].date(), state=state
+    )
+    state.save()
+    return derived
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the vectorized derived KPI stage against row-wise pandas"
+    )
+    parser.add_argument("--symbols", nargs="+", type=int, default=[1_000, 10_000])
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=max(default_windows) + 1,
+        help="Sessions of history, the last one is measured",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logging.getLogger("Derived Benchmark").setLevel(logging.WARNING)
+    print(
+        f"{'symbols': >8} {'approach': <11} {'seconds': >9} {'state (KiB)': >12} {'max abs diff': >13}"
+    )
+    for symbols in args.symbols:
+        history: List[pd.DataFrame] = synthetic_history(
+            symbols=symbols, sessions=args.sessions
+        )
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            state_path: Path = Path(tmp_dir) / "rolling_state.npz"
+            # Warm up the state on every session but the last, as previous runs would have
+            warmup: RollingState = RollingState(
+                logger=setup_logger(name="Derived Benchmark"), path=state_path
+            )
+            for day in history[:-1]:
+                add_derived_kpis(
+                    data=day, run_date=day["date"].iloc[0].date(), state=warmup
+                )
+            warmup.save()
+
+            timings: Dict[str, float] = {}
+            started: float = time.perf_counter()
+            expected: pd.DataFrame = rowwise(history)
+            timings["rowwise"] = time.perf_counter() - started
+            started = time.perf_counter()
+            actual: pd.DataFrame = vectorized(history, state_path=state_path)
+            timings["vectorized"] = time.perf_counter() - started
+
+            columns: List[str] = [
+                "bid_ask_spread",
+                "relative_volume",
+                "nav_premium",
+                *[f"change_{window}d" for window in default_windows],
+            ]
+            expected = expected.set_index("symbol").loc[actual["symbol"], columns]
+            difference: float = float(
+                np.nanmax(
+                    np.abs(
+                        expected.to_numpy(dtype="float64", na_value=np.nan)
+                        - actual[columns].to_numpy(dtype="float64", na_value=np.nan)
+                    )
+                )
+            )
+            for approach, seconds in timings.items():
+                print(
+                    f"{symbols: >8} {approach: <11} {seconds: >9.3f} "
+                    f"{state_path.stat().st_size / 1024 if approach == 'vectorized' else 0: >12.1f} {difference: >13.2e}"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Import-time report of the scraper's entry points, to hold the container's startup-time budget.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, so that nothing is
+cached from earlier imports, and the fastest of `--repeat` runs is reported along with the
+heaviest top-level packages it loaded. Heavy dependencies are expected to be imported by the
+stage that needs them, so `main` itself should only load the standard library and `src` modules.
+
+Usage
+-----
+python -m benchmarks.imports main src.api src.utils --repeat 5 --budget-ms 100
+"""
+
+import argparse
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Dependencies that no module should load at import time unless it cannot work without them
+heavy_packages: List[str] = [
+    "awswrangler",
+    "boto3",
+    "curl_cffi",
+    "pandas",
+    "pyarrow",
+    "requests",
+    "yfinance",
+]
+
+
+def import_times(module: Optional[str]) -> Dict[str, float]:
+    """
+    Import a module in a fresh interpreter and return the cumulative import time of everything loaded.
+
+    Parameters
+    ----------
+    module : Optional[str]
+        Dotted module name, importable from the current working directory, or `None` to only
+        start the interpreter
+
+    Returns
+    -------
+    Dict[str, float]
+        Cumulative milliseconds per module, keeping the first (outermost) import of each
+    """
+    child: subprocess.CompletedProcess = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import {module}" if module else "pass",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times: Dict[str, float] = {}
+    # Lines look like `import time:       643 |     493500 |   pandas`, in microseconds
+    for line in child.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.setdefault(name.strip(), int(cumulative) / 1e3)
+    return times
+
+
+def report(module: str, repeat: int, top: int) -> Tuple[float, List[Tuple[str, float]]]:
+    """
+    Measure the import time of a module and the top-level packages that dominate it.
+
+    Parameters
+    ----------
+    module : str
+        Dotted module name
+    repeat : int
+        Number of fresh interpreters to take the fastest import from
+    top : int
+        Number of heaviest top-level packages to return
+
+    Returns
+    -------
+    Tuple[float, List[Tuple[str, float]]]
+        Milliseconds to import the module, and the heaviest top-level packages with their milliseconds
+    """
+    # Modules loaded by interpreter startup (e.g., `site` and `.pth` hooks) are not the module's doing
+    startup: Dict[str, float] = import_times(None)
+    fastest: Dict[str, float] = min(
+        (import_times(module) for _ in range(max(repeat, 1))),
+        key=lambda times: times[module],
+    )
+    packages: List[Tuple[str, float]] = sorted(
+        (
+            (name, milliseconds)
+            for name, milliseconds in fastest.items()
+            if "." not in name and name != module.split(".")[0] and name not in startup
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    return fastest[module], packages[:top]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Report the import time of the scraper's entry points"
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=["main", "src.api", "src.utils", "src.dataset", "backfill"],
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--top", type=int, default=5, help="Number of heaviest packages listed"
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="Exit with status 1 if importing `main`, the container entry point, takes longer",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    print(f"{'module': <14} {'import (ms)': >12}  heaviest top-level packages (ms)")
+    measured: Dict[str, float] = {}
+    for module in args.modules:
+        milliseconds, packages = report(module=module, repeat=args.repeat, top=args.top)
+        measured[module] = milliseconds
+        heaviest: str = ", ".join(
+            f"{name}{' (heavy)' if name in heavy_packages else ''} {package_ms:.0f}"
+            for name, package_ms in packages
+        )
+        print(f"{module: <14} {milliseconds: >12.1f}  {heaviest}")
+
+    if args.budget_ms is not None:
+        entry_ms: float = measured.get("main") or report("main", args.repeat, 0)[0]
+        if entry_ms > args.budget_ms:
+            print(
+                f"Importing main takes {entry_ms:.1f} ms, over the budget of {args.budget_ms:.1f} ms"
+            )
+            return 1
+        print(
+            f"Importing main takes {entry_ms:.1f} ms, within the budget of {args.budget_ms:.1f} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
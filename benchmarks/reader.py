@@ -0,0 +1,216 @@
+"""
+Compare loading a date range and symbol subset with `load_kpis` against the naive concat approach.
+
+Approaches
+----------
+naive
+    Read every daily file of the range whole with `pd.read_parquet` / `pd.read_csv`, concat the
+    frames, then keep the requested symbols and columns.
+reader
+    `src.reader.load_kpis` with column projection, row-group predicate pushdown, and memory-mapped reads.
+
+The synthetic days are written sorted by symbol, like merged shard output, with a configurable
+row group size. Each approach runs in a fresh interpreter so that peak RSS is not polluted by the other.
+
+Usage
+-----
+python -m benchmarks.reader --days 20 --symbols-per-day 10000 --subset 10 --format parquet csv
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.writer import peak_rss_mb, synthetic_infos
+
+queried_columns: List[str] = ["date", "symbol", "previous_close", "volume"]
+
+
+def write_days(
+    root: Path, days: int, symbols_per_day: int, row_group_size: int, parquet: bool
+) -> None:
+    """
+    Write synthetic daily outputs named like the ones of `write_to_s3`.
+
+    Parameters
+    ----------
+    root : Path
+        Directory to write the files to
+    days : int
+        Number of consecutive days, ending today
+    symbols_per_day : int
+        Number of rows per day
+    row_group_size : int
+        Rows per Parquet row group
+    parquet : bool
+        `True` for Parquet files, `False` for csv
+
+    Returns
+    -------
+    None
+    """
+    import logging
+
+    from src.api import rows_to_frame
+    from src.schema import build_row
+    from src.utils import setup_logger
+
+    logger: logging.Logger = setup_logger(name="Reader Benchmark")
+    logger.setLevel(logging.WARNING)
+    rows = rows_to_frame(
+        logger=logger,
+        rows=[build_row(info) for info in synthetic_infos(symbols_per_day)],
+    ).sort_values("symbol", ignore_index=True)
+    for offset in range(days):
+        day: date = date.today() - timedelta(days=offset)
+        rows["date"] = rows["date"].map(lambda _: day).astype(rows["date"].dtype)
+        path: Path = root / f"etf_kpis_{day.strftime('%Y_%m_%d')}"
+        if parquet:
+            rows.to_parquet(
+                path.with_suffix(".parquet"), index=False, row_group_size=row_group_size
+            )
+        else:
+            rows.to_csv(path.with_suffix(".csv"))
+    return None
+
+
+def run_approach(
+    approach: str, root: Path, days: int, symbols: List[str]
+) -> Dict[str, float]:
+    """
+    Load the range with one approach and measure it.
+
+    Parameters
+    ----------
+    approach : str
+        Either `naive` or `reader`
+    root : Path
+        Directory of the daily files
+    days : int
+        Number of days to load, ending today
+    symbols : List[str]
+        Symbols to load
+
+    Returns
+    -------
+    Dict[str, float]
+        Elapsed seconds, rows loaded, and peak RSS before and after the run
+    """
+    import pandas as pd
+
+    start_day: date = date.today() - timedelta(days=days - 1)
+    rss_before: float = peak_rss_mb()
+    start: float = time.perf_counter()
+    if approach == "naive":
+        frames: List[pd.DataFrame] = [
+            pd.read_parquet(path, dtype_backend="numpy_nullable")
+            if path.suffix == ".parquet"
+            else pd.read_csv(path, index_col=0)
+            for path in sorted(root.glob("etf_kpis_*"))
+        ]
+        data: pd.DataFrame = pd.concat(frames, ignore_index=True)
+        data = data.loc[data["symbol"].isin(symbols), queried_columns]
+    else:
+        from src.reader import load_kpis
+
+        data = load_kpis(
+            root=str(root),
+            start=start_day,
+            end=date.today(),
+            symbols=symbols,
+            columns=queried_columns,
+        )
+    elapsed: float = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "rows": len(data),
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the KPI reader against reading and concatenating whole files"
+    )
+    parser.add_argument("--days", type=int, default=20)
+    parser.add_argument("--symbols-per-day", type=int, default=10_000)
+    parser.add_argument(
+        "--subset", type=int, default=10, help="Number of symbols to load"
+    )
+    parser.add_argument("--row-group-size", type=int, default=1_000)
+    parser.add_argument(
+        "--format", nargs="+", choices=["parquet", "csv"], default=["parquet", "csv"]
+    )
+    parser.add_argument(
+        "--approach", choices=["naive", "reader"], help=argparse.SUPPRESS
+    )
+    parser.add_argument("--root", type=Path, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    # Spread over the sorted universe, so that the subset hits several row groups
+    symbols: List[str] = sorted(f"SYM{i}" for i in range(args.symbols_per_day))[
+        :: max(args.symbols_per_day // args.subset, 1)
+    ][: args.subset]
+
+    # Child mode: run a single approach and report the measurements as JSON
+    if args.approach:
+        result: Dict[str, float] = run_approach(
+            approach=args.approach, root=args.root, days=args.days, symbols=symbols
+        )
+        print(json.dumps(result))
+        return 0
+
+    print(
+        f"{'format': <8} {'approach': <9} {'seconds': >9} {'rows': >7} {'peak RSS (MiB)': >15} {'delta (MiB)': >12}"
+    )
+    for file_format in args.format:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root: Path = Path(tmp_dir).resolve()
+            write_days(
+                root=root,
+                days=args.days,
+                symbols_per_day=args.symbols_per_day,
+                row_group_size=args.row_group_size,
+                parquet=file_format == "parquet",
+            )
+            for approach in ("naive", "reader"):
+                child: subprocess.CompletedProcess = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.reader",
+                        "--approach",
+                        approach,
+                        "--root",
+                        str(root),
+                        "--days",
+                        str(args.days),
+                        "--symbols-per-day",
+                        str(args.symbols_per_day),
+                        "--subset",
+                        str(args.subset),
+                    ],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                measured: Dict[str, float] = json.loads(child.stdout.splitlines()[-1])
+                print(
+                    f"{file_format: <8} {approach: <9} {measured['seconds']: >9.3f} {measured['rows']: >7} "
+                    f"{measured['peak_rss_mb']: >15.1f} {measured['peak_rss_mb'] - measured['rss_before_mb']: >12.1f}"
+                )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of converting scraped rows into the typed output DataFrame.
+
+Conversions
+-----------
+legacy
+    The previous hand-maintained path: `pd.DataFrame(rows)`, `dropna`, `pd.to_datetime`,
+    then a whole-frame `astype` with a dtype mapping kept in sync by hand.
+registry
+    `ColumnBuffers` driven by `kpi_columns`, which builds typed Arrow arrays directly and
+    converts them to nullable pandas dtypes without a post-hoc cast.
+
+Usage
+-----
+python -m benchmarks.schema --rows 100 1000 10000 --repeat 5
+"""
+
+import argparse
+import sys
+import timeit
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from benchmarks.writer import synthetic_infos
+from src.schema import ColumnBuffers, build_row, kpi_columns
+
+
+def legacy_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Convert rows the way `query_etf_and_stock_data` did before the schema registry.
+    """
+    data: pd.DataFrame = pd.DataFrame(rows).dropna(how="all", axis=0)
+    data["first_trade_date"] = pd.to_datetime(
+        data["first_trade_date"], unit="ms", errors="coerce"
+    )
+    data["date"] = datetime.today().strftime("%Y-%m-%d")
+    return data.astype(
+        {
+            column.name: (
+                "datetime64[ns]"
+                if column.arrow_type.equals("timestamp[ns]")
+                else pd.StringDtype()
+                if column.arrow_type.equals("string")
+                else pd.Float64Dtype()
+            )
+            for column in kpi_columns
+        }
+    )
+
+
+def registry_frame(rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Convert rows through the typed columnar buffers of the schema registry.
+    """
+    return ColumnBuffers.from_rows(rows=rows, run_date=date.today()).to_frame()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark row to DataFrame conversion of the legacy and registry paths"
+    )
+    parser.add_argument("--rows", nargs="+", type=int, default=[100, 1_000, 10_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    print(f"{'rows': >8} {'legacy (ms)': >12} {'registry (ms)': >14} {'speedup': >8}")
+    for rows in args.rows:
+        built: List[Dict[str, Any]] = [
+            build_row(info) for info in synthetic_infos(rows)
+        ]
+        pd.testing.assert_frame_equal(
+            legacy_frame(built).reset_index(drop=True), registry_frame(built)
+        )
+        # Best of `repeat` runs, as recommended by `timeit` to discount noise
+        legacy: float = min(
+            timeit.repeat(lambda: legacy_frame(built), number=1, repeat=args.repeat)
+        )
+        registry: float = min(
+            timeit.repeat(lambda: registry_frame(built), number=1, repeat=args.repeat)
+        )
+        print(
+            f"{rows: >8} {legacy * 1e3: >12.2f} {registry * 1e3: >14.2f} {legacy / registry: >7.2f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
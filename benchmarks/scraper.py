@@ -0,0 +1,279 @@
+"""
+Offline benchmark of `query_etf_and_stock_data` against the local stub server.
+
+The real code path runs unchanged: Alpha Vantage is pointed at the stub through `src.api.alpha_vantage_url`,
+every Yahoo Finance request of yfinance is routed to the stub by the session injected into `yf.Tickers`,
+and the projected client of the `async` backend is pointed at the stub through the urls of `src.yahoo`.
+yfinance's cookie and crumb are pre-seeded with `src.session.seed_yahoo_crumb`, since fetching them
+would store the stub's cookie in yfinance's persistent cookie cache. Each universe size runs in a fresh
+interpreter so that peak RSS is not polluted by earlier runs, while the stub is served from this process.
+
+Reported per universe size
+--------------------------
+wall time, HTTP requests and requests per second, time spent building the DataFrame versus
+fetching (everything else), Yahoo Finance KiB received and client-side parse time per requested
+ticker, and peak RSS of the scraper process. Parse time is measured by the projected client itself,
+and estimated for `Ticker.info` as the time spent per ticker outside of HTTP requests.
+
+Usage
+-----
+python -m benchmarks.scraper --universe 10 100 1000 --latency 0.02 --max-workers 16
+python -m benchmarks.scraper --universe 1000 --backend async
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import pandas as pd
+from curl_cffi.requests.session import HttpMethod
+
+import src.api as api
+import src.yahoo as yahoo
+from benchmarks.stub_server import StubConfig, StubServer, start_stub_server
+from benchmarks.writer import peak_rss_mb
+from src.cache import MetadataCache
+from src.governance import RequestGovernor
+from src.metrics import MetricsRecorder
+from src.session import HttpSessions, ReuseCountingSession, seed_yahoo_crumb
+from src.utils import setup_logger
+
+
+class StubRoutedSession(ReuseCountingSession):
+    """
+    Session that sends every request for a `*.yahoo.com` host to the stub server instead.
+
+    Parameters
+    ----------
+    stub_url : str
+        Base url of the stub server
+    **kwargs : Any
+        Keyword arguments of `ReuseCountingSession`
+    """
+
+    def __init__(self, stub_url: str, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.stub: Any = urlsplit(stub_url)
+
+    def request(self, method: HttpMethod, url: str, *args: Any, **kwargs: Any) -> Any:
+        parts = urlsplit(url)
+        if parts.hostname and parts.hostname.endswith("yahoo.com"):
+            url = urlunsplit(
+                (self.stub.scheme, self.stub.netloc, parts.path, parts.query, "")
+            )
+        return super().request(method, url, *args, **kwargs)
+
+
+def run_scraper(
+    stub_url: str, max_workers: int, batch_size: int, rate: float, backend: str
+) -> Dict[str, float]:
+    """
+    Run `query_etf_and_stock_data` against the stub and measure it.
+
+    Parameters
+    ----------
+    stub_url : str
+        Base url of the stub server
+    max_workers : int
+        Maximum number of `info` requests in flight
+    batch_size : int
+        Number of symbols per batched quote request, `0` disables batching, a cold local
+        metadata cache is used otherwise since batching requires one
+    rate : float
+        Requests per second allowed by the request governor
+    backend : str
+        `yfinance` or `async`, see `query_etf_and_stock_data`
+
+    Returns
+    -------
+    Dict[str, float]
+        Rows, elapsed seconds, requests, DataFrame construction seconds, Yahoo Finance bytes and
+        parse seconds per ticker, and peak RSS
+    """
+    logger: logging.Logger = setup_logger(name="Scraper Benchmark")
+    logger.setLevel(logging.WARNING)
+    os.environ["API_KEY"] = "stub"
+    api.alpha_vantage_url = f"{stub_url}/query"
+    yahoo.quote_url = f"{stub_url}/v7/finance/quote"
+    yahoo.quote_summary_url = f"{stub_url}/v10/finance/quoteSummary"
+    # Recorded metrics are read back below instead of being printed
+    metrics: MetricsRecorder = MetricsRecorder(stream=io.StringIO())
+
+    governor: RequestGovernor = RequestGovernor(
+        logger=logger, rate=rate, burst=max_workers, max_concurrency=max_workers
+    )
+    sessions: HttpSessions = HttpSessions(logger=logger, pool_size=max_workers)
+    sessions.yahoo = StubRoutedSession(
+        stub_url=stub_url, governor=governor, impersonate="chrome"
+    )
+    seed_yahoo_crumb(logger=logger, session=sessions.yahoo, crumb="stubcrumb")
+
+    # Time DataFrame construction separately from fetching
+    frame_seconds: float = 0.0
+    rows_to_frame = api.rows_to_frame
+
+    def timed_rows_to_frame(*args: Any, **kwargs: Any) -> pd.DataFrame:
+        nonlocal frame_seconds
+        start: float = time.perf_counter()
+        frame: pd.DataFrame = rows_to_frame(*args, **kwargs)
+        frame_seconds += time.perf_counter() - start
+        return frame
+
+    api.rows_to_frame = timed_rows_to_frame
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        api.default_snapshot_location = Path(tmp_dir)
+        start: float = time.perf_counter()
+        data: pd.DataFrame = api.query_etf_and_stock_data(
+            logger=logger,
+            env="prod",
+            max_workers=max_workers,
+            batch_size=batch_size,
+            metadata_cache=(
+                MetadataCache(
+                    logger=logger, path=Path(tmp_dir) / "ticker_metadata.json"
+                )
+                if batch_size > 0
+                else None
+            ),
+            refresh_snapshot=True,
+            governor=governor,
+            sessions=sessions,
+            metrics=metrics,
+            backend=backend,
+            async_concurrency=max_workers,
+        )
+        elapsed: float = time.perf_counter() - start
+
+    def total(name: str) -> float:
+        return sum(metrics.values.get(name, []))
+
+    tickers: float = max(total("TickersRequested"), 1)
+    # Time of `info` calls spent outside of HTTP requests, i.e., mostly yfinance's parsing
+    info_parse_seconds: float = max(
+        total("TickerLatency") / 1e3 - sessions.yahoo.request_seconds, 0.0
+    )
+    return {
+        "rows": len(data),
+        "seconds": elapsed,
+        # One Alpha Vantage request plus everything sent to Yahoo Finance
+        "requests": 1 + sessions.yahoo.requests_sent + int(total("ProjectedRequests")),
+        "frame_seconds": frame_seconds,
+        "bytes_per_ticker": (sessions.yahoo.bytes_received + total("ProjectedBytes"))
+        / tickers,
+        "parse_seconds_per_ticker": (
+            info_parse_seconds + total("ProjectedParseTime") / 1e3
+        )
+        / tickers,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the scraper end to end against a local stub server"
+    )
+    parser.add_argument(
+        "--universe",
+        nargs="+",
+        type=int,
+        default=[10, 100, 1_000],
+        help="Numbers of top gainer symbols, the core ETFs are added on top",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="Seconds per stub response"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=0)
+    parser.add_argument(
+        "--backend",
+        choices=["yfinance", "async"],
+        default="yfinance",
+        help="Fetch backend of per-symbol fields, `async` sends up to --max-workers requests at once",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=10_000.0,
+        help="Requests per second allowed by the request governor",
+    )
+    parser.add_argument("--stub-url", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+
+    # Child mode: run the scraper once and report the measurements as JSON
+    if args.stub_url:
+        result: Dict[str, float] = run_scraper(
+            stub_url=args.stub_url,
+            max_workers=args.max_workers,
+            batch_size=args.batch_size,
+            rate=args.rate,
+            backend=args.backend,
+        )
+        print(json.dumps(result))
+        return 0
+
+    print(
+        f"{'universe': >8} {'rows': >7} {'seconds': >9} {'requests': >9} {'req/sec': >9} "
+        f"{'frame (ms)': >11} {'fetch (s)': >10} {'KiB/ticker': >11} {'parse (ms)/ticker': >18} "
+        f"{'peak RSS (MiB)': >15}"
+    )
+    for universe in args.universe:
+        server: StubServer = start_stub_server(
+            StubConfig(
+                universe=universe,
+                latency=args.latency,
+                error_rate=args.error_rate,
+                throttle_rate=args.throttle_rate,
+            )
+        )
+        try:
+            child: subprocess.CompletedProcess = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.scraper",
+                    "--stub-url",
+                    server.url,
+                    "--max-workers",
+                    str(args.max_workers),
+                    "--batch-size",
+                    str(args.batch_size),
+                    "--rate",
+                    str(args.rate),
+                    "--backend",
+                    args.backend,
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+        measured: Dict[str, float] = json.loads(child.stdout.splitlines()[-1])
+        print(
+            f"{universe: >8} {measured['rows']: >7} {measured['seconds']: >9.2f} {measured['requests']: >9} "
+            f"{measured['requests'] / measured['seconds']: >9,.0f} {measured['frame_seconds'] * 1e3: >11.1f} "
+            f"{measured['seconds'] - measured['frame_seconds']: >10.2f} {measured['bytes_per_ticker'] / 1024: >11.1f} "
+            f"{measured['parse_seconds_per_ticker'] * 1e3: >18.3f} {measured['peak_rss_mb']: >15.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,394 @@
+"""
+Local stub of the Alpha Vantage and Yahoo Finance endpoints the scraper calls, serving
+deterministic synthetic payloads with configurable latency and error rates.
+
+Endpoints
+---------
+/query?function=TOP_GAINERS_LOSERS
+    Alpha Vantage top gainers, losers, and most actively traded tickers, with `universe` gainers
+/v10/finance/quoteSummary/<symbol>?modules=<modules>
+    Yahoo Finance quote summary, with only the requested modules of those `info` requests
+/v7/finance/quote?symbols=<symbols>&fields=<fields>
+    Yahoo Finance quotes of one or many symbols, carrying every field of `info` and of the batched quote
+    path along with others the scraper does not read, or only `fields` if given
+/ws/fundamentals-timeseries/v1/finance/timeseries/<symbol>
+    Yahoo Finance fundamentals time series requested by `info` for the trailing PEG ratio
+
+Usage
+-----
+python -m benchmarks.stub_server --universe 1000 --latency 0.02 --error-rate 0.01 --port 8080
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, ClassVar, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+@dataclass(frozen=True)
+class StubConfig(object):
+    """
+    Behavior of the stub server.
+
+    Parameters
+    ----------
+    universe : int
+        Number of top gainer symbols served by Alpha Vantage, the scraper adds its ETFs on top
+    latency : float
+        Seconds each response is delayed by
+    error_rate : float
+        Fraction of Yahoo Finance requests answered with HTTP 500
+    throttle_rate : float
+        Fraction of Yahoo Finance requests answered with HTTP 429
+    seed : int
+        Seed of the error injection
+    """
+
+    universe: int = 100
+    latency: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    seed: int = 0
+
+
+def gainer_symbols(universe: int) -> List[str]:
+    """
+    Return the synthetic top gainer symbols of a universe.
+    """
+    return [f"G{i:05d}" for i in range(universe)]
+
+
+def synthetic_quote(symbol: str) -> Dict[str, Any]:
+    """
+    Return the quote of a symbol, derived from a hash of the symbol so that it is stable across runs.
+
+    Parameters
+    ----------
+    symbol : str
+        Ticker symbol
+
+    Returns
+    -------
+    Dict[str, Any]
+        Quote keyed by both the `info` keys and the batched quote keys the scraper reads
+    """
+    seed: int = zlib.crc32(symbol.encode())
+    price: float = 10 + seed % 49_000 / 100
+    volume: int = 100_000 + seed % 9_900_000
+    return {
+        "symbol": symbol,
+        "firstTradeDateMilliseconds": 946_684_800_000 + seed % 7_000 * 86_400_000,
+        "previousClose": price,
+        "regularMarketPreviousClose": price,
+        "navPrice": round(price * 0.999, 2),
+        "dividendYield": seed % 400 / 100,
+        "netExpenseRatio": seed % 90 / 100,
+        "trailingPE": 5 + seed % 4_500 / 100,
+        "volume": volume,
+        "regularMarketVolume": volume,
+        "averageVolume": volume * 0.9,
+        "averageDailyVolume3Month": volume * 0.9,
+        "bid": round(price - 0.01, 2),
+        "bidSize": seed % 40 * 100,
+        "ask": round(price + 0.01, 2),
+        "askSize": seed % 30 * 100,
+        "category": "Technology",
+        "beta3Year": seed % 200 / 100,
+        "ytdReturn": seed % 60 / 100,
+        "threeYearAverageReturn": seed % 30 / 100,
+        "fiveYearAverageReturn": seed % 25 / 100,
+    }
+
+
+def synthetic_quote_response(symbol: str) -> Dict[str, Any]:
+    """
+    Return the unprojected quote of a symbol, which like Yahoo's carries many fields the scraper does not read.
+    """
+    quote: Dict[str, Any] = synthetic_quote(symbol)
+    price: float = quote["previousClose"]
+    return {
+        **quote,
+        "language": "en-US",
+        "region": "US",
+        "quoteType": "ETF",
+        "typeDisp": "ETF",
+        "quoteSourceName": "Delayed Quote",
+        "currency": "USD",
+        "exchange": "PCX",
+        "shortName": f"{symbol} Synthetic ETF",
+        "longName": f"{symbol} Synthetic Exchange Traded Fund",
+        "fullExchangeName": "NYSEArca",
+        "exchangeTimezoneName": "America/New_York",
+        "marketState": "REGULAR",
+        "regularMarketPrice": price,
+        "regularMarketDayHigh": round(price * 1.01, 2),
+        "regularMarketDayLow": round(price * 0.99, 2),
+        "regularMarketOpen": price,
+        "regularMarketChange": 0.0,
+        "regularMarketChangePercent": 0.0,
+        "fiftyTwoWeekLow": round(price * 0.8, 2),
+        "fiftyTwoWeekHigh": round(price * 1.2, 2),
+        "fiftyTwoWeekRange": f"{price * 0.8:.2f} - {price * 1.2:.2f}",
+        "fiftyDayAverage": price,
+        "twoHundredDayAverage": price,
+        "averageDailyVolume10Day": quote["volume"],
+        "trailingAnnualDividendRate": 0.0,
+        "trailingAnnualDividendYield": 0.0,
+        "epsTrailingTwelveMonths": round(price / quote["trailingPE"], 2),
+        "sharesOutstanding": 1_000_000,
+        "bookValue": price,
+        "priceToBook": 1.0,
+        "marketCap": price * 1_000_000,
+        "tradeable": False,
+        "cryptoTradeable": False,
+        "exchangeDataDelayedBy": 0,
+        "sourceInterval": 15,
+    }
+
+
+def synthetic_summary_modules(symbol: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the quote summary modules `info` requests for a symbol, derived from its synthetic quote.
+    """
+    quote: Dict[str, Any] = synthetic_quote(symbol)
+    return {
+        "assetProfile": {
+            "longBusinessSummary": f"{symbol} seeks to track an index. " * 10,
+            "companyOfficers": [],
+            "maxAge": 86400,
+        },
+        "defaultKeyStatistics": {
+            "category": quote["category"],
+            "beta3Year": quote["beta3Year"],
+            "ytdReturn": quote["ytdReturn"],
+            "threeYearAverageReturn": quote["threeYearAverageReturn"],
+            "fiveYearAverageReturn": quote["fiveYearAverageReturn"],
+            "fundFamily": "Synthetic",
+            "legalType": "Exchange Traded Fund",
+            "totalAssets": 1_000_000_000,
+            "fundInceptionDate": quote["firstTradeDateMilliseconds"] // 1000,
+            "lastDividendValue": 0.5,
+            "maxAge": 1,
+        },
+        "summaryDetail": {
+            "previousClose": quote["previousClose"],
+            "navPrice": quote["navPrice"],
+            "dividendYield": quote["dividendYield"],
+            "trailingPE": quote["trailingPE"],
+            "volume": quote["volume"],
+            "averageVolume": quote["averageVolume"],
+            "bid": quote["bid"],
+            "bidSize": quote["bidSize"],
+            "ask": quote["ask"],
+            "askSize": quote["askSize"],
+            "yield": quote["dividendYield"],
+            "currency": "USD",
+            "maxAge": 1,
+        },
+        "financialData": {"financialCurrency": "USD", "maxAge": 86400},
+        "quoteType": {"symbol": symbol, "quoteType": "ETF", "exchange": "PCX"},
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler serving the stubbed endpoints, configured through `server.config`.
+    """
+
+    # Keep connections alive like the real hosts do, and send headers and body without waiting
+    # for delayed acknowledgements, which would otherwise add ~40 ms to every response
+    protocol_version: str = "HTTP/1.1"
+    disable_nagle_algorithm: ClassVar[bool] = True
+    server: "StubServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        return None
+
+    def send_json(self, payload: Any, status: int = 200) -> None:
+        body: bytes = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def injected_error(self) -> Optional[int]:
+        """
+        Draw whether this request should fail, and with which status code.
+        """
+        config: StubConfig = self.server.config
+        with self.server.lock:
+            draw: float = self.server.random.random()
+        if draw < config.throttle_rate:
+            return 429
+        if draw < config.throttle_rate + config.error_rate:
+            return 500
+        return None
+
+    def do_GET(self) -> None:
+        config: StubConfig = self.server.config
+        if config.latency > 0:
+            time.sleep(config.latency)
+        parsed = urlparse(self.path)
+        params: Dict[str, List[str]] = parse_qs(parsed.query)
+        path: str = parsed.path
+
+        if path == "/query":
+            entry: Dict[str, str] = {
+                "price": "10.00",
+                "change_amount": "1.00",
+                "change_percentage": "10.0%",
+                "volume": "1000000",
+            }
+            self.send_json(
+                {
+                    "metadata": "Top gainers, losers, and most actively traded US tickers",
+                    "last_updated": time.strftime("%Y-%m-%d %H:%M:%S US/Eastern"),
+                    "top_gainers": [
+                        {"ticker": symbol, **entry}
+                        for symbol in gainer_symbols(config.universe)
+                    ],
+                    "top_losers": [{"ticker": "LOSER", **entry}],
+                    "most_actively_traded": [{"ticker": "ACTIVE", **entry}],
+                }
+            )
+            return
+
+        status: Optional[int] = self.injected_error()
+        if status is not None:
+            self.send_json({"finance": {"result": None, "error": "stub"}}, status)
+        elif path.startswith("/v10/finance/quoteSummary/"):
+            symbol: str = path.rsplit("/", 1)[-1]
+            modules: List[str] = params.get("modules", [""])[0].split(",")
+            self.send_json(
+                {
+                    "quoteSummary": {
+                        "result": [
+                            {
+                                module: payload
+                                for module, payload in synthetic_summary_modules(
+                                    symbol
+                                ).items()
+                                if module in modules
+                            }
+                        ],
+                        "error": None,
+                    }
+                }
+            )
+        elif path == "/v7/finance/quote":
+            symbols: List[str] = params.get("symbols", [""])[0].split(",")
+            fields: Optional[List[str]] = (
+                params["fields"][0].split(",") if "fields" in params else None
+            )
+            quotes: List[Dict[str, Any]] = [
+                synthetic_quote_response(symbol) for symbol in symbols
+            ]
+            if fields is not None:
+                # Like Yahoo, the symbol is always returned
+                quotes = [
+                    {
+                        key: value
+                        for key, value in quote.items()
+                        if key in fields or key == "symbol"
+                    }
+                    for quote in quotes
+                ]
+            self.send_json({"quoteResponse": {"result": quotes, "error": None}})
+        elif path.startswith("/ws/fundamentals-timeseries/"):
+            self.send_json(
+                {
+                    "timeseries": {
+                        "result": [
+                            {"trailingPegRatio": [{"reportedValue": {"raw": 1.5}}]}
+                        ],
+                        "error": None,
+                    }
+                }
+            )
+        else:
+            self.send_json({"error": f"Unknown path {path}"}, 404)
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the stub configuration and a seeded source of injected errors.
+    """
+
+    daemon_threads: bool = True
+    request_queue_size: int = 256
+
+    def __init__(self, config: StubConfig, port: int = 0) -> None:
+        super().__init__(("127.0.0.1", port), StubHandler)
+        self.config: StubConfig = config
+        self.random: random.Random = random.Random(config.seed)
+        self.lock: threading.Lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+def start_stub_server(config: StubConfig, port: int = 0) -> StubServer:
+    """
+    Start a stub server in a daemon thread.
+
+    Parameters
+    ----------
+    config : StubConfig
+        Behavior of the stub
+    port : int, optional
+        Port to listen on, `0` picks a free one
+
+    Returns
+    -------
+    StubServer
+        Running server, stop it with `shutdown`
+    """
+    server: StubServer = StubServer(config=config, port=port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Serve synthetic Alpha Vantage and Yahoo Finance payloads locally"
+    )
+    parser.add_argument("--universe", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8080)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    server: StubServer = StubServer(
+        config=StubConfig(
+            universe=args.universe,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            throttle_rate=args.throttle_rate,
+            seed=args.seed,
+        ),
+        port=args.port,
+    )
+    print(f"Serving stub market data on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Compare peak memory and throughput of the two output paths for a synthetic universe.
+
+Paths
+-----
+frame
+    Collect rows, build the DataFrame with `rows_to_frame` (dropna, to_datetime, astype),
+    then serialize it to Parquet.
+stream
+    Append rows to a `ParquetStreamWriter`, which flushes one row group at a time.
+
+Each path runs in a fresh interpreter so that peak RSS is not polluted by the other path.
+
+Usage
+-----
+python -m benchmarks.writer --rows 1000 10000 100000
+"""
+
+import argparse
+import json
+import logging
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.api import rows_to_frame
+from src.schema import build_row
+from src.utils import setup_logger
+from src.writer import ParquetStreamWriter
+
+
+def synthetic_infos(rows: int) -> Iterator[Dict[str, Any]]:
+    """
+    Generate `info` dictionaries shaped like the ones returned by Yahoo Finance.
+
+    Parameters
+    ----------
+    rows : int
+        Number of dictionaries to generate
+
+    Yields
+    ------
+    Dict[str, Any]
+        Synthetic `info` dictionary
+    """
+    for i in range(rows):
+        yield {
+            "symbol": f"SYM{i}",
+            "firstTradeDateMilliseconds": 946684800000 + (i % 5_000) * 86_400_000,
+            "longBusinessSummary": "The fund seeks to track an index. " * 20,
+            "previousClose": 100.0 + i % 50,
+            "navPrice": 99.5 + i % 50,
+            "dividendYield": 0.012,
+            "netExpenseRatio": 0.03,
+            "trailingPE": 25.0,
+            "volume": 1_000_000 + i,
+            "averageVolume": 900_000 + i,
+            "bid": 99.9,
+            "bidSize": 800,
+            "askSize": 900,
+            "ask": 100.1,
+            "category": "Technology",
+            "beta3Year": 1.1,
+            "ytdReturn": 0.12,
+            "threeYearAverageReturn": 0.2,
+            "fiveYearAverageReturn": 0.3,
+        }
+
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of the current process in MiB (Linux reports KiB).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_path(path: str, rows: int, output: Path) -> Dict[str, float]:
+    """
+    Run one output path and measure it.
+
+    Parameters
+    ----------
+    path : str
+        Either `frame` or `stream`
+    rows : int
+        Number of synthetic rows
+    output : Path
+        Parquet file to write
+
+    Returns
+    -------
+    Dict[str, float]
+        Elapsed seconds, rows per second, and peak RSS before and after the run
+    """
+    logger: logging.Logger = setup_logger(name="Writer Benchmark")
+    logger.setLevel(logging.WARNING)
+    rss_before: float = peak_rss_mb()
+    start: float = time.perf_counter()
+    if path == "frame":
+        collected: List[Dict[str, Any]] = [
+            build_row(info) for info in synthetic_infos(rows)
+        ]
+        rows_to_frame(logger=logger, rows=collected).to_parquet(output, index=False)
+    else:
+        with ParquetStreamWriter(path=str(output), run_date=date.today()) as writer:
+            for info in synthetic_infos(rows):
+                writer.append(build_row(info))
+    elapsed: float = time.perf_counter() - start
+    return {
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed,
+        "rss_before_mb": rss_before,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the DataFrame and streaming Parquet output paths"
+    )
+    parser.add_argument("--rows", nargs="+", type=int, default=[1_000, 10_000, 100_000])
+    parser.add_argument("--path", choices=["frame", "stream"], help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+
+    # Child mode: run a single path and report the measurements as JSON
+    if args.path:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result: Dict[str, float] = run_path(
+                path=args.path,
+                rows=args.rows[0],
+                output=Path(tmp_dir).resolve() / "etf_kpis.parquet",
+            )
+        print(json.dumps(result))
+        return 0
+
+    print(
+        f"{'rows': >8} {'path': <7} {'seconds': >9} {'rows/sec': >11} {'peak RSS (MiB)': >15} {'delta (MiB)': >12}"
+    )
+    for rows in args.rows:
+        for path in ("frame", "stream"):
+            child: subprocess.CompletedProcess = subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.writer",
+                    "--path",
+                    path,
+                    "--rows",
+                    str(rows),
+                ],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            measured: Dict[str, float] = json.loads(child.stdout.splitlines()[-1])
+            print(
+                f"{rows: >8} {path: <7} {measured['seconds']: >9.3f} {measured['rows_per_second']: >11,.0f} "
+                f"{measured['peak_rss_mb']: >15.1f} {measured['peak_rss_mb'] - measured['rss_before_mb']: >12.1f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,16 @@
 #!/bin/sh
 set -eu
 
+# The daemon runs until DAEMON_UNTIL, DAEMON_MAX_TICKS, or the SIGTERM of ECS, so it is not timed out
+if [ "${DAEMON:-}" = "True" ]; then
+    echo "Running main.py as a daemon without a timeout"
+    exec .venv/bin/python3 main.py
+fi
+
 # Default to 45 min (2,700 s) if not overridden
 TIMEOUT_SECONDS="${TIMEOUT_SECONDS:-2700}"
+# Exported so that main.py can stop early enough to write what it fetched before being killed
+export TIMEOUT_SECONDS
 
 echo "Running main.py with a ${TIMEOUT_SECONDS}s timeout"
 # Use the python interpreter and packages from the virtual environment directly (without poetry run)
@@ -1,6 +1,6 @@
 import logging
 import os
-from typing import Any, Dict, List, Literal, cast
+from typing import Any, Dict, List, Literal, Optional, cast
 
 import boto3
 import botocore
@@ -10,7 +10,7 @@ from mypy_boto3_ecs.type_defs import (
     NetworkConfigurationTypeDef,
     RunTaskResponseTypeDef,
 )
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 ecs_client: ECSClient = boto3.client("ecs")
 logger: logging.Logger = logging.getLogger(name="Trigger ECS Fargate Task")
@@ -31,6 +31,7 @@ class EnvironmentConfig(BaseModel):
     security_group: str
     assign_public_ip: ASSIGN_PUBLIC_IP_OPTIONS
     env: str
+    shard_count: int = Field(default=1, ge=1)
 
     model_config = ConfigDict(
         frozen=True,
@@ -62,11 +63,12 @@ def environment_config() -> EnvironmentConfig:
             security_group=os.getenv("SECURITY_GROUP", ""),
             assign_public_ip=assign_public_ip,
             env=os.getenv("env", "prod"),
+            shard_count=int(os.getenv("SHARD_COUNT", "1")),
         )
         empty_fields: List[str] = [
             field
             for field, value in env_config.model_dump().items()
-            if field not in ["env", "assign_public_ip"] and not value
+            if field not in ["env", "assign_public_ip", "shard_count"] and not value
         ]
         if empty_fields:
             raise ValueError(
@@ -80,43 +82,164 @@ def environment_config() -> EnvironmentConfig:
         raise
 
 
-def lambda_handler(event: Dict[str, str], context: Any) -> None:
-    try:
-        env_config: EnvironmentConfig = environment_config()
+def parse_shard_indices(shards: Any, shard_count: int) -> Optional[List[int]]:
+    """
+    Validate the shards to (re)launch passed in the event, e.g. `{"shards": [3]}`.
 
-        # If 'env' is passed in as part of the event payload, e.g. {"env": "dev"}, use that value
-        env: str = event.get("env", env_config.env)
+    Parameters
+    ----------
+    shards : Any
+        Value of the `shards` event key, `None` if absent
+    shard_count : int
+        Number of shards the symbols are split into
+
+    Returns
+    -------
+    Optional[List[int]]
+        Distinct shard indices in `[0, shard_count)`, or `None` to launch all shards
+
+    Raises
+    ------
+    ValueError
+        If `shard_count` is below 1, or `shards` is not a list of distinct shard indices
+    """
+    if shard_count < 1:
+        raise ValueError(f"The shard count must be at least 1, got {shard_count}")
+    if shards is None:
+        return None
+    if not isinstance(shards, list) or not shards:
+        raise ValueError(
+            f"`shards` must be a non-empty list of shard indices, got {shards!r}"
+        )
+    invalid: List[Any] = [
+        index
+        for index in shards
+        # `bool` is a subclass of `int`, so `True` would pass as shard 1
+        if not isinstance(index, int)
+        or isinstance(index, bool)
+        or not 0 <= index < shard_count
+    ]
+    if invalid:
+        raise ValueError(f"Shard indices {invalid} are not in [0, {shard_count})")
+    if len(set(shards)) != len(shards):
+        raise ValueError(f"`shards` lists a shard more than once: {shards}")
+    return shards
+
+
+def launch_shards(
+    client: ECSClient,
+    env_config: EnvironmentConfig,
+    env: str,
+    shard_count: int,
+    shard_indices: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    """
+    Start one Fargate task per shard, each scraping the symbols of its shard (see `src/sharding.py`).
+
+    Every shard is launched with its own `run_task` call, since container overrides apply to all
+    tasks of a call, and a failure to launch one shard does not stop the others.
+
+    Parameters
+    ----------
+    client : ECSClient
+        ECS client, which can be stubbed with `botocore.stub.Stubber` when testing
+    env_config : EnvironmentConfig
+        Environment configuration
+    env : str
+        Environment the tasks run in
+    shard_count : int
+        Number of shards the symbols are split into
+    shard_indices : Optional[List[int]], optional
+        Shards to launch, e.g., to relaunch the ones that failed, all shards if `None`
 
-        # Get the latest revision of the task definition
-        version: int = ecs_client.describe_task_definition(
-            taskDefinition=env_config.task_definition
-        )["taskDefinition"]["revision"]
-
-        # Network configurations
-        network_config: NetworkConfigurationTypeDef = {
-            "awsvpcConfiguration": {
-                "subnets": [env_config.subnet_1, env_config.subnet_2],
-                "securityGroups": [env_config.security_group],
-                "assignPublicIp": env_config.assign_public_ip,
-            }
+    Returns
+    -------
+    Dict[str, Any]
+        `launched` maps each started shard to its task ARN, `failed` maps each shard that could
+        not be started to the reason
+    """
+    # Get the latest revision of the task definition
+    version: int = client.describe_task_definition(
+        taskDefinition=env_config.task_definition
+    )["taskDefinition"]["revision"]
+
+    # Network configurations
+    network_config: NetworkConfigurationTypeDef = {
+        "awsvpcConfiguration": {
+            "subnets": [env_config.subnet_1, env_config.subnet_2],
+            "securityGroups": [env_config.security_group],
+            "assignPublicIp": env_config.assign_public_ip,
         }
+    }
 
+    launched: Dict[int, str] = {}
+    failed: Dict[int, str] = {}
+    for shard_index in (
+        shard_indices if shard_indices is not None else range(shard_count)
+    ):
         # Continer overrides
         container_override: ContainerOverrideTypeDef = {
             "name": env_config.container_name,
-            "environment": [{"name": "ENV", "value": env}],
+            "environment": [
+                {"name": "ENV", "value": env},
+                {"name": "SHARD_INDEX", "value": str(shard_index)},
+                {"name": "SHARD_COUNT", "value": str(shard_count)},
+            ],
         }
+        try:
+            response: RunTaskResponseTypeDef = client.run_task(
+                cluster=env_config.cluster_name,
+                launchType="FARGATE",
+                count=1,
+                taskDefinition=f"{env_config.task_definition}:{version}",
+                networkConfiguration=network_config,
+                overrides={"containerOverrides": [container_override]},
+            )
+        except botocore.exceptions.ClientError as error:
+            failed[shard_index] = str(error)
+            continue
+        # Capacity and placement problems are reported in the response rather than raised
+        if response["failures"] or not response["tasks"]:
+            failed[shard_index] = (
+                "; ".join(
+                    f"{failure.get('arn', '')} {failure.get('reason', '')} {failure.get('detail', '')}".strip()
+                    for failure in response["failures"]
+                )
+                or "No task was started"
+            )
+            continue
+        launched[shard_index] = response["tasks"][0]["taskArn"]
 
-        response: RunTaskResponseTypeDef = ecs_client.run_task(
-            cluster=env_config.cluster_name,
-            launchType="FARGATE",
-            count=1,
-            taskDefinition=f"{env_config.task_definition}:{version}",
-            networkConfiguration=network_config,
-            overrides={"containerOverrides": [container_override]},
+    for shard_index, task_arn in launched.items():
+        logger.info(
+            f"Shard {shard_index} of {shard_count} started with taskArn: {task_arn}"
         )
+    for shard_index, reason in failed.items():
+        logger.error(f"Shard {shard_index} of {shard_count} failed to start: {reason}")
+    return {"launched": launched, "failed": failed}
 
-        logger.info(f"Task started with taskArn: {response}")
+
+def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    try:
+        env_config: EnvironmentConfig = environment_config()
+
+        # If 'env' is passed in as part of the event payload, e.g. {"env": "dev"}, use that value
+        env: str = event.get("env", env_config.env)
+        # Likewise for the number of shards, and for the shards to (re)launch, e.g. {"shards": [3]}
+        shard_count: int = int(event.get("shard_count", env_config.shard_count))
+        shard_indices: Optional[List[int]] = parse_shard_indices(
+            shards=event.get("shards"), shard_count=shard_count
+        )
+
+        result: Dict[str, Any] = launch_shards(
+            client=ecs_client,
+            env_config=env_config,
+            env=env,
+            shard_count=shard_count,
+            shard_indices=shard_indices,
+        )
+        if not result["launched"]:
+            raise RuntimeError(f"No shard could be started: {result['failed']}")
 
     except botocore.exceptions.ClientError as error:
         logger.error(f"An error occurred while starting the task: {error}")
@@ -132,4 +255,4 @@ def lambda_handler(event: Dict[str, str], context: Any) -> None:
         logger.error(f"An unknown error occurred: {error}")
         raise error
 
-    return None
+    return result
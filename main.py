@@ -1,37 +1,436 @@
+import atexit
 import os
+import random
+import signal
 import sys
+import time
 from datetime import datetime
 from logging import Logger
-from typing import Optional
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 
-import pandas as pd
+from src.cache import MetadataCache
+from src.checkpoint import RunJournal
+from src.metrics import MetricsRecorder
+from src.sharding import commit_shards, mark_shard_done, part_path
+from src.utils import catch_errors, setup_logger, trading_day, write_to_s3
 
-from src.api import query_etf_and_stock_data
-from src.utils import catch_errors, setup_logger, write_to_s3
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from src.cassette import Cassette
+    from src.deadline import Deadline
+    from src.derived import RollingState
 
 
 @catch_errors
 def main() -> int:
+    start: float = time.perf_counter()
     logger: Logger = setup_logger(name="ETF KPIs Scraper")
     logger.info("Starting ETF KPIs scraper")
     ENV: str = os.getenv("ENV", "dev")
     logger.info(f"Running the task in {ENV} mode")
 
-    market_data: pd.DataFrame = query_etf_and_stock_data(logger=logger, env=ENV)
-    if market_data.isna().to_numpy().all():
-        logger.error("[ERROR] Market data is completely filled with missing values")
-        return 1
+    metrics: MetricsRecorder = MetricsRecorder(
+        dimensions={"Environment": ENV}, enabled=os.getenv("METRICS") == "True"
+    )
+
+    # Flush at exit so that failed and interrupted runs still report the stages they got through
+    @atexit.register
+    def flush_metrics() -> None:
+        metrics.observe("RunDuration", (time.perf_counter() - start) * 1e3)
+        metrics.flush()
+
+    # `timeout` and ECS send SIGTERM, which would otherwise end the process without running cleanup,
+    # so exit through `SystemExit` to let the journal push its last records and the `atexit`
+    # handlers flush the metrics and close the cassette; the daemon replaces it to stop between ticks
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    max_workers: int = int(os.getenv("MAX_WORKERS", "8"))
+    batch_size: int = int(os.getenv("QUOTE_BATCH_SIZE", "0"))
 
     s3_bucket: Optional[str] = os.getenv("S3_BUCKET")
     if not s3_bucket:
         logger.error("[ERROR] The S3_BUCKET environment variable is not set")
         return 1
+
+    # Modules pulling in requests, curl_cffi, pandas, yfinance, or pyarrow are imported once the
+    # configuration is known to be valid, see `python -m benchmarks.imports` for their cost
+    with metrics.stage("Imports"):
+        from src.api import iter_etf_and_stock_rows, query_etf_and_stock_data
+        from src.governance import RequestGovernor
+        from src.session import HttpSessions
+
+    # Every HTTP request counts against the rate, so it has to exceed `MAX_WORKERS` divided by the
+    # typical latency for the workers to be kept busy
+    request_rate: float = float(os.getenv("REQUEST_RATE", "20"))
+    max_retries: int = int(os.getenv("MAX_RETRIES", "4"))
+    governor: RequestGovernor = RequestGovernor(
+        logger=logger,
+        rate=request_rate,
+        max_concurrency=max_workers,
+        max_retries=max_retries,
+    )
+
+    # Tasks of a sharded run (see `src.sharding`) run at once, so each keeps its own metadata cache
+    # and journal, which only ever hold the symbols of its shard
+    shard_index: int = int(os.getenv("SHARD_INDEX", "0"))
+    shard_count: int = int(os.getenv("SHARD_COUNT", "1"))
+    shard_name: str = (
+        f"shard_{shard_index:03d}_of_{shard_count:03d}" if shard_count > 1 else ""
+    )
+
+    # Every upstream exchange of the run is archived so that it can be replayed offline with `src.cassette`
+    cassette: Optional["Cassette"] = None
+    if os.getenv("RECORD_CASSETTE") == "True":
+        from src.cassette import Cassette
+
+        cassette = Cassette(
+            logger=logger,
+            location=f"s3://{s3_bucket}/cassettes/etf_kpis_{datetime.today().strftime('%Y_%m_%d')}{'_' + shard_name if shard_name else ''}.jsonl.gz",
+        )
+        atexit.register(cassette.close)
+
+    # Keep at least one pooled connection per worker thread so that none has to reconnect
+    sessions: HttpSessions = HttpSessions(
+        logger=logger,
+        pool_size=int(os.getenv("HTTP_POOL_SIZE", str(max(max_workers, 10)))),
+        keep_alive=os.getenv("HTTP_KEEP_ALIVE", "True") == "True",
+        compression=os.getenv("HTTP_COMPRESSION", "True") == "True",
+        cassette=cassette,
+        governor=governor,
+    )
+
+    metadata_cache: Optional[MetadataCache] = None
+    if os.getenv("METADATA_CACHE") == "True":
+        metadata_cache = MetadataCache(
+            logger=logger,
+            s3_path=f"s3://{s3_bucket}/cache/ticker_metadata{'_' + shard_name if shard_name else ''}.json",
+            force_refresh=os.getenv("FORCE_REFRESH") == "True",
+        )
+        metadata_cache.load()
+
+    # Close history of each symbol, from which the rolling derived KPIs are updated without reloading outputs
+    derived: bool = os.getenv("DERIVED_KPIS") == "True"
+    rolling_state: Optional["RollingState"] = None
+    if derived:
+        from src.derived import RollingState
+
+        rolling_state = RollingState(
+            logger=logger,
+            s3_path=f"s3://{s3_bucket}/cache/rolling_state{'_' + shard_name if shard_name else ''}.npz",
+        )
+        rolling_state.load()
+
+    universe: Optional[List[str]] = None
+    if os.getenv("UNIVERSE") == "True":
+        from src.universe import UniverseFilter, discover_universe
+
+        listing_file: Optional[str] = os.getenv("UNIVERSE_LISTING_FILE")
+        with metrics.stage("Universe"):
+            universe = discover_universe(
+                logger=logger,
+                universe_filter=UniverseFilter(
+                    exchanges=tuple(
+                        exchange.strip()
+                        for exchange in os.getenv("UNIVERSE_EXCHANGES", "").split(",")
+                        if exchange.strip()
+                    ),
+                    pattern=os.getenv("UNIVERSE_PATTERN"),
+                    limit=int(os.getenv("UNIVERSE_LIMIT", "0")),
+                ),
+                s3_prefix=f"s3://{s3_bucket}/universe",
+                listing_file=Path(listing_file) if listing_file else None,
+                governor=governor,
+                session=sessions.http,
+            )
+        logger.info(f"Discovered {len(universe)} ETFs to scrape")
+
+    if os.getenv("DAEMON") == "True":
+        import threading
+
+        from src.api import etf_tickers
+        from src.daemon import QuotePoller, run_daemon
+        from src.sharding import select_shard
+
+        # Stop after the tick in flight on SIGTERM, which ECS sends when stopping the task
+        stop: threading.Event = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: stop.set())
+        until: Optional[str] = os.getenv("DAEMON_UNTIL")
+        run_daemon(
+            logger=logger,
+            poller=QuotePoller(
+                logger=logger,
+                governor=governor,
+                symbols=select_shard(
+                    symbols=list(dict.fromkeys(etf_tickers + (universe or []))),
+                    shard_index=shard_index,
+                    shard_count=shard_count,
+                ),
+                session=sessions.yahoo,
+                concurrency=int(os.getenv("ASYNC_CONCURRENCY", "32")),
+                batch_size=batch_size or 100,
+            ),
+            output_root=f"s3://{s3_bucket}/intraday",
+            interval=float(os.getenv("POLL_INTERVAL", "60")),
+            stop=stop,
+            metrics=metrics,
+            max_ticks=int(os.getenv("DAEMON_MAX_TICKS", "0")),
+            until=datetime.strptime(until, "%H:%M").time() if until else None,
+            name_suffix=f"_{shard_name}" if shard_name else "",
+        )
+        return 0
+
+    journal: Optional[RunJournal] = None
+    if os.getenv("CHECKPOINT") == "True":
+        journal = RunJournal(
+            logger=logger,
+            # Keyed by trading day, so that a restart past midnight UTC still resumes the same day
+            run_date=trading_day(),
+            s3_prefix=f"s3://{s3_bucket}/checkpoints{'/' + shard_name if shard_name else ''}",
+            checkpoint_every=int(os.getenv("CHECKPOINT_EVERY", "25")),
+        )
+        journal.load()
+
     parquet: bool = os.getenv("PARQUET") == "True"
+    dataset: bool = os.getenv("DATASET") == "True"
     s3_path: str = (
-        f"s3://{s3_bucket}/daily-kpis/etf_kpis_{datetime.today().strftime('%Y_%m_%d')}"
+        f"s3://{s3_bucket}/kpis-dataset"
+        if dataset
+        else f"s3://{s3_bucket}/daily-kpis/etf_kpis_{datetime.today().strftime('%Y_%m_%d')}"
+    )
+    bucket_count: int = int(os.getenv("SYMBOL_BUCKETS", "0"))
+    # Static attributes are moved out of the day's output into a table updated only when they change
+    dimension_path: Optional[str] = (
+        f"s3://{s3_bucket}/dimensions/symbol_attributes.parquet"
+        if os.getenv("DIMENSION_TABLE") == "True"
+        else None
+    )
+    # Only the changes since the previous run are written, with a full snapshot every few days
+    cdc_root: Optional[str] = (
+        f"s3://{s3_bucket}/cdc" if os.getenv("CDC") == "True" else None
+    )
+    snapshot_every: int = int(os.getenv("CDC_SNAPSHOT_EVERY", "7"))
+    # Each shard writes a part file, which is always Parquet unless the day's output is csv
+    output_path: str = (
+        part_path(
+            s3_bucket=s3_bucket,
+            run_date=datetime.today().date(),
+            shard_index=shard_index,
+            shard_count=shard_count,
+        )
+        if shard_count > 1
+        else s3_path
+    )
+
+    def commit_if_last_shard() -> None:
+        if shard_count > 1:
+            mark_shard_done(
+                s3_bucket=s3_bucket,
+                run_date=datetime.today().date(),
+                shard_index=shard_index,
+                shard_count=shard_count,
+            )
+            with metrics.stage("ShardCommit"):
+                commit_shards(
+                    logger=logger,
+                    s3_bucket=s3_bucket,
+                    run_date=datetime.today().date(),
+                    shard_count=shard_count,
+                    s3_path=s3_path,
+                    parquet=parquet or dataset,
+                    dataset=dataset,
+                    bucket_count=bucket_count,
+                    dimension_path=dimension_path,
+                    cdc_root=cdc_root,
+                    snapshot_every=snapshot_every,
+                )
+
+    # Drawn here rather than in the sample itself so that a recorded run can replay the same sample
+    sample_seed_env: Optional[str] = os.getenv("SAMPLE_SEED")
+    sample_seed: Optional[int] = (
+        int(sample_seed_env)
+        if sample_seed_env
+        else random.randrange(2**32)
+        if cassette
+        else None
+    )
+    # `docker_entrypoint.sh` kills the task at `TIMEOUT_SECONDS`, so the run stops fetching early
+    # enough to write what it has, and marks whether its output is complete
+    deadline: Optional["Deadline"] = None
+    completeness_path: str = f"s3://{s3_bucket}/completeness/etf_kpis_{datetime.today().strftime('%Y_%m_%d')}{'_' + shard_name if shard_name else ''}.json"
+    timeout_seconds: Optional[str] = os.getenv("TIMEOUT_SECONDS")
+    if timeout_seconds:
+        from src.deadline import Deadline
+
+        deadline = Deadline(
+            logger=logger,
+            budget=float(timeout_seconds),
+            reserve=float(os.getenv("DEADLINE_RESERVE", "180")),
+            started=start,
+        )
+
+    query_kwargs: Dict[str, Any] = {
+        "logger": logger,
+        "env": ENV,
+        "max_workers": max_workers,
+        "batch_size": batch_size,
+        "metadata_cache": metadata_cache,
+        "snapshot_s3_prefix": f"s3://{s3_bucket}/alpha-vantage",
+        # A reused snapshot would leave the Alpha Vantage exchange out of the cassette
+        "refresh_snapshot": os.getenv("REFRESH_SNAPSHOT") == "True"
+        or cassette is not None,
+        "journal": journal,
+        "governor": governor,
+        "sessions": sessions,
+        "metrics": metrics,
+        "universe": universe,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "backend": os.getenv("YAHOO_BACKEND", "yfinance"),
+        "async_concurrency": int(os.getenv("ASYNC_CONCURRENCY", "32")),
+        "sample_seed": sample_seed,
+        "deadline": deadline,
+        "gainers_losers": None,
+    }
+    if shard_count > 1:
+        from src.api import fetch_top_gainers_losers
+        from src.sharding import shared_gainers_losers
+
+        # Every shard scrapes the gainers of the one snapshot requested by the designated shard
+        with metrics.stage("AlphaVantage"):
+            query_kwargs["gainers_losers"] = shared_gainers_losers(
+                logger=logger,
+                s3_bucket=s3_bucket,
+                run_date=datetime.today().date(),
+                shard_index=shard_index,
+                fetch=lambda: fetch_top_gainers_losers(
+                    logger=logger,
+                    snapshot_s3_prefix=query_kwargs["snapshot_s3_prefix"],
+                    refresh_snapshot=query_kwargs["refresh_snapshot"],
+                    governor=governor,
+                    session=sessions.http,
+                ),
+                timeout=float(os.getenv("SNAPSHOT_WAIT_SECONDS", "600")),
+            )
+    if cassette:
+        cassette.annotate(
+            run_date=datetime.today().date().isoformat(),
+            request_rate=request_rate,
+            max_retries=max_retries,
+            metadata={"recorded_at": time.time(), "entries": metadata_cache.entries}
+            if metadata_cache
+            else None,
+            **{
+                key: query_kwargs[key]
+                for key in (
+                    "env",
+                    "max_workers",
+                    "batch_size",
+                    "universe",
+                    "shard_index",
+                    "shard_count",
+                    "backend",
+                    "async_concurrency",
+                    "sample_seed",
+                    # Shards other than the designated one read it from S3 rather than Alpha Vantage
+                    "gainers_losers",
+                )
+            },
+        )
+
+    if parquet and not dataset and os.getenv("STREAMING") == "True":
+        from src.writer import ParquetStreamWriter
+
+        logger.info("Streaming scraper data to s3")
+        if (dimension_path or cdc_root) and shard_count == 1:
+            logger.warning(
+                "Streamed output is written in full, the dimension table and CDC are only applied to DataFrame and sharded output"
+            )
+        if derived:
+            logger.warning("Derived KPIs are only added to DataFrame output")
+        with ParquetStreamWriter(
+            path=f"{output_path}.parquet", run_date=datetime.today().date()
+        ) as writer:
+            for row in iter_etf_and_stock_rows(**query_kwargs):
+                writer.append(row)
+        if metadata_cache:
+            metadata_cache.save()
+        # An empty shard is still marked done below so that the day can be committed
+        if writer.rows_written == 0 and shard_count == 1:
+            logger.error("[ERROR] No market data was returned for any ticker")
+            return 1
+        metrics.count("BytesWritten", writer.bytes_written, unit="Bytes")
+        if shard_count == 1:
+            from src.manifest import record_file
+
+            record_file(path=f"{output_path}.parquet")
+        if deadline:
+            deadline.write_marker(s3_path=completeness_path, rows=writer.rows_written)
+        # A partial run keeps its journal, so that a rerun only fetches the skipped symbols
+        if journal and (deadline is None or deadline.complete):
+            journal.complete()
+        commit_if_last_shard()
+        logger.info(f"[SUCCESS] Successfully streamed {writer.rows_written} rows to s3")
+        return 0
+
+    market_data: pd.DataFrame = query_etf_and_stock_data(
+        **query_kwargs, derived=derived, rolling_state=rolling_state
     )
-    logger.info("Writing scraper data to s3")
-    write_to_s3(data=market_data, s3_path=s3_path, parquet=parquet)
+    if metadata_cache:
+        metadata_cache.save()
+    if shard_count > 1 and market_data.empty:
+        # An empty shard writes no part but is still marked done so that the day can be committed
+        logger.info(f"Shard {shard_index} of {shard_count} has no rows to write")
+    elif market_data.isna().to_numpy().all():
+        logger.error("[ERROR] Market data is completely filled with missing values")
+        return 1
+    else:
+        if dimension_path and shard_count == 1:
+            from src.dimension import extract_dimension
+
+            with metrics.stage("DimensionUpdate"):
+                market_data, bytes_saved = extract_dimension(
+                    logger=logger,
+                    data=market_data,
+                    dimension_path=dimension_path,
+                    run_date=datetime.today().date(),
+                    parquet=parquet or dataset,
+                )
+            metrics.count("DimensionBytesSaved", bytes_saved, unit="Bytes")
+        logger.info("Writing scraper data to s3")
+        bytes_written: int
+        with metrics.stage("S3Write"):
+            if cdc_root and shard_count == 1:
+                from src.cdc import write_cdc
+
+                _, bytes_written = write_cdc(
+                    logger=logger,
+                    data=market_data,
+                    root=cdc_root,
+                    run_date=datetime.today().date(),
+                    snapshot_every=snapshot_every,
+                )
+            else:
+                bytes_written = write_to_s3(
+                    data=market_data,
+                    s3_path=output_path,
+                    parquet=parquet or (dataset and shard_count > 1),
+                    dataset=dataset and shard_count == 1,
+                    bucket_count=bucket_count,
+                    manifest=shard_count == 1,
+                )
+        metrics.count("BytesWritten", bytes_written, unit="Bytes")
+        # Saved once the day is written so that a failed write does not advance the windows
+        if rolling_state:
+            rolling_state.save()
+    if deadline:
+        deadline.write_marker(s3_path=completeness_path, rows=len(market_data))
+    # A partial run keeps its journal, so that a rerun only fetches the skipped symbols
+    if journal and (deadline is None or deadline.complete):
+        journal.complete()
+    commit_if_last_shard()
     logger.info(f"[SUCCESS] Successfully written data to s3")
 
     return 0
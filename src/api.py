@@ -1,18 +1,41 @@
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from logging import Logger
 from pathlib import Path
-from random import choices
-from typing import Any, Dict, List, Optional, Set, Union
+from random import Random
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Type
 
 import pandas as pd
 import requests
 import yfinance as yf
+from curl_cffi.requests import exceptions as curl_exceptions
 
-apikey: Optional[str] = os.getenv("API_KEY")
-url: str = (
-    f"https://www.alphavantage.co/query?function=TOP_GAINERS_LOSERS&apikey={apikey}"
+from src.cache import MetadataCache
+from src.checkpoint import RunJournal
+from src.deadline import Deadline, prioritize
+from src.derived import RollingState, add_derived_kpis
+from src.governance import (
+    CircuitOpenError,
+    RequestGovernor,
+    retryable_status_codes,
+    status_code_of,
 )
+from src.metrics import MetricsRecorder
+from src.schema import ColumnBuffers, build_row, kpi_columns
+from src.session import (
+    HttpSessions,
+    ReuseCountingSession,
+    govern_yahoo_call,
+)
+from src.sharding import select_shard
+from src.utils import download_from_s3, trading_day, upload_to_s3
+from src.yahoo import fetch_projected_infos
+
+alpha_vantage_url: str = "https://www.alphavantage.co/query"
 pd.set_option("mode.copy_on_write", True)
 etf_tickers: List[str] = [
     "SPY",
@@ -28,42 +51,431 @@ etf_tickers: List[str] = [
     "XSD",
 ]
 
-# Set the cache location for yfinance
 default_cache_location: Path = Path.cwd() / ".cache" / "py-yfinance"
-default_cache_location.mkdir(parents=True, exist_ok=True)
-yf.set_tz_cache_location(default_cache_location)
 
 skippable_http_status_codes: Set[int] = {404, 408}
+# yfinance raises `curl_cffi`'s `HTTPError`, which is not a subclass of the `requests` one
+http_errors: Tuple[Type[Exception], ...] = (
+    requests.exceptions.HTTPError,
+    curl_exceptions.HTTPError,
+)
+# Host the request governor keeps the limits of Alpha Vantage under, see `src.session.yahoo_host`
+alpha_vantage_host: str = "www.alphavantage.co"
+default_snapshot_location: Path = Path.cwd() / ".cache" / "alpha-vantage"
 
+# Multi-symbol quote endpoint, the same one yfinance uses to supplement `info`
+yahoo_quote_url: str = "https://query1.finance.yahoo.com/v7/finance/quote"
+# Maps the `info` keys used for each row to the keys of the batched quote endpoint that supply them
+batch_quote_fields: Dict[str, str] = {
+    "symbol": "symbol",
+    "previousClose": "regularMarketPreviousClose",
+    "navPrice": "navPrice",
+    "dividendYield": "dividendYield",
+    "trailingPE": "trailingPE",
+    "ytdReturn": "ytdReturn",
+    "volume": "regularMarketVolume",
+    "averageVolume": "averageDailyVolume3Month",
+    "bid": "bid",
+    "bidSize": "bidSize",
+    "ask": "ask",
+    "askSize": "askSize",
+}
+# The `info` keys that only a per-symbol `info` request can supply
+info_only_fields: Set[str] = {
+    column.source for column in kpi_columns if column.source is not None
+} - batch_quote_fields.keys()
 
-def query_etf_and_stock_data(logger: Logger, env: str) -> pd.DataFrame:
+
+def configure_yfinance_cache(location: Path = default_cache_location) -> None:
     """
-    Query ETFs and top 20 biggest gainer stock data from the Alpha Vantage API and Yahoo Finance API.
+    Point yfinance's timezone and cookie caches at a directory, creating it if needed.
+
+    Parameters
+    ----------
+    location : Path, optional
+        Cache directory
+
+    Returns
+    -------
+    None
+    """
+    location.mkdir(parents=True, exist_ok=True)
+    yf.set_tz_cache_location(str(location))
+    return None
+
+
+def fetch_ticker_info(
+    ticker: yf.Ticker,
+    logger: Logger,
+    governor: RequestGovernor,
+    metrics: Optional[MetricsRecorder] = None,
+    deadline: Optional[Deadline] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Fetch the `info` dictionary of a single ticker from Yahoo Finance.
 
     Parameters
     ----------
+    ticker : yf.Ticker
+        Ticker whose `info` should be fetched
     logger : Logger
         Logger instance to log information
-    env : str
-        Environment variable to determine how many requests to make
+    governor : RequestGovernor
+        Governor that rate limits and retries the request, unless the ticker's session already
+        sends each of its requests through one (see `ReuseCountingSession`)
+    metrics : Optional[MetricsRecorder], optional
+        Recorder of the fetch latency (`TickerLatency`), errors (`TickerErrors`), and tickers
+        given up on after retries (`TickersDropped`)
+    deadline : Optional[Deadline], optional
+        Budget of the run, the request is not sent once it would not complete in time
 
     Returns
     -------
-    pd.DataFrame
-        DataFrame containing ETF and stock data
+    Optional[Dict[str, Any]]
+        The `info` dictionary, an empty dictionary if the ticker was skipped, or `None` if the
+        request kept being throttled or failing after all retries, or was not sent because of the
+        deadline, so that a later run may retry it
+
+    Raises
+    ------
+    requests.exceptions.HTTPError or curl_cffi.requests.exceptions.HTTPError
+        If the request fails with a status code that is neither in `skippable_http_status_codes`
+        nor retryable
     """
+    metrics = metrics or MetricsRecorder(enabled=False)
+    if deadline is not None and deadline.exhausted():
+        metrics.count("TickersSkipped")
+        deadline.skip(ticker.ticker)
+        return None
+    start: float = time.perf_counter()
+    try:
+        return govern_yahoo_call(
+            governor=governor, session=ticker.session, request=lambda: ticker.info
+        )
+    except CircuitOpenError as circuit_error:
+        metrics.count("TickerErrors")
+        metrics.count("TickersDropped")
+        logger.warning(f"Skipping ticker {ticker.ticker!r}: {circuit_error}")
+        return None
+    except http_errors as http_error:
+        metrics.count("TickerErrors")
+        status_code: Optional[int] = status_code_of(http_error)
+        if status_code in skippable_http_status_codes:
+            logger.warning(
+                f"HTTP {status_code} when attempting to access `info` for ticker {ticker.ticker!r}"
+            )
+        elif status_code in retryable_status_codes:
+            metrics.count("TickersDropped")
+            logger.warning(
+                f"Giving up on ticker {ticker.ticker!r} after retries: {http_error!r}"
+            )
+            return None
+        else:
+            raise http_error
+    except Exception as unexpected_error:
+        metrics.count("TickerErrors")
+        if status_code_of(unexpected_error) is not None:
+            # Throttled or failing upstream even after retries
+            metrics.count("TickersDropped")
+            logger.warning(
+                f"Giving up on ticker {ticker.ticker!r} after retries: {unexpected_error!r}"
+            )
+            return None
+        # Catch anything else (parsing, attribute errors, etc.)
+        logger.warning(
+            f"Unexpected error for ticker {ticker.ticker!r}: {unexpected_error!r}"
+        )
+    finally:
+        latency: float = time.perf_counter() - start
+        metrics.observe("TickerLatency", latency * 1e3)
+        if deadline is not None:
+            deadline.observe(latency)
+    return {}
+
+
+def fetch_batch_quotes(
+    tickers: yf.Tickers,
+    logger: Logger,
+    batch_size: int,
+    governor: RequestGovernor,
+    session: Optional[ReuseCountingSession] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch the volatile quote fields of many symbols per request from the batched quote endpoint.
+
+    Parameters
+    ----------
+    tickers : yf.Tickers
+        Tickers whose quotes should be fetched
+    logger : Logger
+        Logger instance to log information
+    batch_size : int
+        Number of symbols to request per call
+    governor : RequestGovernor
+        Governor that rate limits and retries the requests, unless `session` already sends each
+        of its requests through one
+    session : Optional[ReuseCountingSession], optional
+        Session shared with `tickers`, yfinance's default session is used if `None`
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        Mapping of symbol to the quote fields keyed by their `info` keys; symbols whose
+        chunk failed or that were missing from the response are left out
+    """
+    from yfinance.data import YfData
+
+    symbols: List[str] = list(tickers.tickers)
+    fields: str = ",".join(batch_quote_fields.values())
+    # `YfData` is yfinance's process-wide data client, whose public `get_raw_json` adds the
+    # cookie and crumb that `tickers` uses
+    yf_data: YfData = YfData(session=session)
+    quotes: Dict[str, Dict[str, Any]] = {}
+    for start in range(0, len(symbols), batch_size):
+        chunk: List[str] = symbols[start : start + batch_size]
+        try:
+            result: Dict[str, Any] = govern_yahoo_call(
+                governor=governor,
+                session=session,
+                request=lambda: yf_data.get_raw_json(
+                    yahoo_quote_url,
+                    params={
+                        "symbols": ",".join(chunk),
+                        "fields": fields,
+                        "formatted": "false",
+                    },
+                ),
+            )
+        except Exception as batch_error:
+            logger.warning(
+                f"Batched quote request failed for {len(chunk)} symbols starting at {chunk[0]!r}: {batch_error!r}"
+            )
+            continue
+        for quote in result.get("quoteResponse", {}).get("result", []):
+            quotes[quote["symbol"]] = {
+                info_key: quote[quote_key]
+                for info_key, quote_key in batch_quote_fields.items()
+                if quote.get(quote_key) is not None
+            }
+    return quotes
+
+
+def fetch_top_gainers_losers(
+    logger: Logger,
+    snapshot_s3_prefix: Optional[str] = None,
+    refresh_snapshot: bool = False,
+    governor: Optional[RequestGovernor] = None,
+    session: Optional[requests.Session] = None,
+) -> Dict[str, Any]:
+    """
+    Return the Alpha Vantage top gainers, losers, and most actively traded tickers of the
+    current trading day, requesting them only if no snapshot of that day exists yet.
+
+    The full parsed response is persisted as `top_gainers_losers_YYYY_MM_DD.json` under
+    `default_snapshot_location` (and `snapshot_s3_prefix` when set), so that reruns on the
+    same day reuse it instead of spending an API call and getting a different gainer list.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    snapshot_s3_prefix : Optional[str], optional
+        Full s3 url of the prefix snapshots are synced with, or `None` to keep them local
+    refresh_snapshot : bool, optional
+        `True` to request the data even if a snapshot of the trading day exists
+    governor : Optional[RequestGovernor], optional
+        Governor that rate limits and retries the request, a default one is used if `None`
+    session : Optional[requests.Session], optional
+        Pooled session to send the request with, a one-off connection is used if `None`
+
+    Returns
+    -------
+    Dict[str, Any]
+        The parsed response with `trading_day` and `fetched_at` keys added
+    """
+    file_name: str = f"top_gainers_losers_{trading_day().strftime('%Y_%m_%d')}.json"
+    snapshot_path: Path = default_snapshot_location / file_name
+    snapshot_s3_path: Optional[str] = (
+        f"{snapshot_s3_prefix}/{file_name}" if snapshot_s3_prefix else None
+    )
+
+    if not refresh_snapshot and (
+        snapshot_path.exists()
+        or (
+            snapshot_s3_path
+            and download_from_s3(s3_path=snapshot_s3_path, local_path=snapshot_path)
+        )
+    ):
+        logger.info(f"Reusing Alpha Vantage snapshot {file_name}")
+        with snapshot_path.open("r") as snapshot_file:
+            return json.load(snapshot_file)
+
+    # Read at call time rather than import time so that importing this module has no side effects
+    apikey: Optional[str] = os.getenv("API_KEY")
     if not apikey:
         logger.error("[ERROR] API_KEY environment variable is not set")
         raise ValueError("API_KEY environment variable is required")
 
+    url: str = f"{alpha_vantage_url}?function=TOP_GAINERS_LOSERS&apikey={apikey}"
     logger.info("Making request to Alpha Vantage API for top gainers data")
-    response: requests.Response = requests.get(url)
+    governor = governor or RequestGovernor(logger=logger)
+    response: requests.Response = governor.call(
+        host=alpha_vantage_host,
+        request=lambda: (session or requests).get(url, timeout=30),
+    )
     if response.status_code != 200:
         logger.error(f"Request to {url} failed with status code {response.status_code}")
         raise requests.exceptions.RequestException(
             f"Request to {url} failed with status code {response.status_code}"
         )
-    response_data: Dict[str, Union[str, List[Dict[str, str]]]] = response.json()
+    response_data: Dict[str, Any] = response.json()
+    if "top_gainers" not in response_data:
+        # Rate limit and invalid key notices come back with status code 200
+        raise requests.exceptions.RequestException(
+            f"Unexpected response from Alpha Vantage: {response_data}"
+        )
+    response_data["trading_day"] = trading_day().isoformat()
+    response_data["fetched_at"] = datetime.now().isoformat(timespec="seconds")
+
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    with snapshot_path.open("w") as snapshot_file:
+        json.dump(response_data, snapshot_file)
+    if snapshot_s3_path:
+        upload_to_s3(local_path=snapshot_path, s3_path=snapshot_s3_path)
+    logger.info(f"Saved Alpha Vantage snapshot {file_name}")
+    return response_data
+
+
+def rows_to_frame(
+    logger: Logger,
+    rows: List[Dict[str, Any]],
+    metrics: Optional[MetricsRecorder] = None,
+) -> pd.DataFrame:
+    """
+    Build the typed output DataFrame from the rows produced by `build_row`.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    rows : List[Dict[str, Any]]
+        Rows keyed by output column
+    metrics : Optional[MetricsRecorder], optional
+        Recorder of the buffering (`FrameBuild`) and typing (`TypeMapping`) stages and row counts
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame containing ETF and stock data
+    """
+    metrics = metrics or MetricsRecorder(enabled=False)
+    logger.info("Completed requesting data from Yahoo Finance, creating DataFrame")
+    with metrics.stage("FrameBuild"):
+        buffers: ColumnBuffers = ColumnBuffers.from_rows(
+            rows=rows, run_date=datetime.today().date()
+        )
+    if buffers.dropped:
+        logger.warning(f"Dropped {buffers.dropped} rows missing required columns")
+    metrics.count("Rows", len(buffers))
+    metrics.count("DroppedRows", buffers.dropped)
+    with metrics.stage("TypeMapping"):
+        return buffers.to_frame()
+
+
+def iter_etf_and_stock_rows(
+    logger: Logger,
+    env: str,
+    max_workers: int = 8,
+    batch_size: int = 0,
+    metadata_cache: Optional[MetadataCache] = None,
+    snapshot_s3_prefix: Optional[str] = None,
+    refresh_snapshot: bool = False,
+    journal: Optional[RunJournal] = None,
+    governor: Optional[RequestGovernor] = None,
+    sessions: Optional[HttpSessions] = None,
+    metrics: Optional[MetricsRecorder] = None,
+    universe: Optional[List[str]] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    backend: str = "yfinance",
+    async_concurrency: int = 32,
+    sample_seed: Optional[int] = None,
+    deadline: Optional[Deadline] = None,
+    gainers_losers: Optional[Dict[str, Any]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Query ETFs and top 20 biggest gainer stock data from the Alpha Vantage API and Yahoo Finance API,
+    yielding one row per ticker as soon as its data arrives.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    env : str
+        Environment variable to determine how many requests to make
+    max_workers : int, optional
+        Maximum number of `info` requests to Yahoo Finance in flight at once
+    batch_size : int, optional
+        Number of symbols per batched quote request, `0` disables batching so that every
+        field comes from the per-symbol `info` requests; ignored without a `metadata_cache`
+    metadata_cache : Optional[MetadataCache], optional
+        Cache of slow-changing fields, which are then only requested once they expire
+    snapshot_s3_prefix : Optional[str], optional
+        Full s3 url of the prefix Alpha Vantage snapshots are synced with
+    refresh_snapshot : bool, optional
+        `True` to bypass the Alpha Vantage snapshot of the current trading day
+    journal : Optional[RunJournal], optional
+        Journal of completed tickers, whose rows are replayed instead of refetched and to which
+        newly completed tickers are recorded
+    governor : Optional[RequestGovernor], optional
+        Governor shared by all upstream requests, a default one allowing `max_workers` concurrent
+        requests per host is used if `None`
+    sessions : Optional[HttpSessions], optional
+        Pooled keep-alive sessions for Alpha Vantage and Yahoo Finance, yfinance's default session
+        is used if `None`
+    metrics : Optional[MetricsRecorder], optional
+        Recorder of stage durations, per-ticker latency, and counts, nothing is recorded if `None`
+    universe : Optional[List[str]], optional
+        Discovered ETF symbols (see `src.universe`) to scrape in addition to the gainers and `etf_tickers`
+    shard_index : int, optional
+        Index of the shard of symbols to scrape (see `src.sharding`)
+    shard_count : int, optional
+        Number of shards the symbols are split into, `1` scrapes every symbol
+    backend : str, optional
+        `yfinance` to fetch per-symbol fields with `Ticker.info` on `max_workers` threads, or `async`
+        to fetch only the fields used with the projected client of `src.yahoo`, falling back to
+        `Ticker.info` for the tickers it could not fetch
+    async_concurrency : int, optional
+        Maximum number of requests in flight with the `async` backend
+    sample_seed : Optional[int], optional
+        Seed of the tickers sampled outside of `prod`, so that a run can be reproduced, a random
+        sample is drawn if `None`
+    deadline : Optional[Deadline], optional
+        Budget of the run, per-symbol requests that would no longer complete in time are skipped
+        and recorded to it, so that what was fetched can still be written
+    gainers_losers : Optional[Dict[str, Any]], optional
+        Alpha Vantage snapshot to scrape the gainers of instead of requesting it, e.g., the one
+        shared by the shards of a run (see `src.sharding.shared_gainers_losers`)
+
+    Yields
+    ------
+    Dict[str, Any]
+        Rows keyed by output column (see `build_row`) in ticker order, tickers without any data are left out
+    """
+    governor = governor or RequestGovernor(logger=logger, max_concurrency=max_workers)
+    metrics = metrics or MetricsRecorder(enabled=False)
+    response_data: Dict[str, Any]
+    if gainers_losers is not None:
+        response_data = gainers_losers
+    else:
+        with metrics.stage("AlphaVantage"):
+            response_data = fetch_top_gainers_losers(
+                logger=logger,
+                snapshot_s3_prefix=snapshot_s3_prefix,
+                refresh_snapshot=refresh_snapshot,
+                governor=governor,
+                session=sessions.http if sessions else None,
+            )
     top_gainers: pd.DataFrame = pd.DataFrame(response_data["top_gainers"])
     top_gainers_tickers: List[str] = top_gainers["ticker"].to_list()
     gains: Dict[str, str] = dict(
@@ -74,94 +486,305 @@ def query_etf_and_stock_data(logger: Logger, env: str) -> pd.DataFrame:
         "Top 20 Gainer Stocks:\n"
         + "\n".join([f"   {ticker: <8} {pct: >10}" for ticker, pct in gains.items()])
     )
-    tickers: yf.Tickers
+    configure_yfinance_cache()
+    yahoo_session: Optional[ReuseCountingSession] = sessions.yahoo if sessions else None
+    requested: List[str]
     if env == "prod":
-        tickers = yf.Tickers(tickers=top_gainers_tickers + etf_tickers)
+        # Core ETFs first, then the gainers, then the long tail, so that the symbols that matter
+        # most are fetched if the deadline cuts the run short
+        requested = prioritize(
+            core=etf_tickers, gainers=top_gainers_tickers, rest=universe or []
+        )
     else:
+        sampler: Random = Random(sample_seed)
+        requested = sampler.choices(
+            population=universe or etf_tickers, k=3
+        ) + sampler.choices(population=top_gainers_tickers, k=3)
+    if shard_count > 1:
+        requested = select_shard(
+            symbols=requested, shard_index=shard_index, shard_count=shard_count
+        )
+        logger.info(
+            f"Scraping shard {shard_index} of {shard_count} with {len(requested)} tickers"
+        )
+    tickers: yf.Tickers = yf.Tickers(tickers=requested, session=yahoo_session)
+
+    symbols: List[str] = list(tickers.tickers)
+    if journal is not None and journal.rows:
+        # Only tickers a previous run for the same date did not complete are fetched again
         tickers = yf.Tickers(
-            tickers=choices(population=etf_tickers, k=3)
-            + choices(population=top_gainers_tickers, k=3)
+            tickers=[symbol for symbol in symbols if symbol not in journal],
+            session=yahoo_session,
+        )
+        logger.info(
+            f"Skipping {len(symbols) - len(tickers.tickers)} tickers completed by a previous run"
         )
 
+    quotes: Dict[str, Dict[str, Any]] = {}
+    if batch_size > 0 and metadata_cache is None:
+        # The fields of `info_only_fields` then need an `info` request for every symbol, which
+        # returns the quote fields too, so batched quotes would only add requests
+        logger.warning(
+            "Batched quotes are only requested with a metadata cache, fetching every field with per-symbol requests"
+        )
+    elif batch_size > 0 and tickers.tickers:
+        logger.info(
+            f"Fetching quotes for {len(tickers.tickers)} tickers from Yahoo Finance in batches of {batch_size}"
+        )
+        with metrics.stage("BatchQuotes"):
+            quotes = fetch_batch_quotes(
+                tickers=tickers,
+                logger=logger,
+                batch_size=batch_size,
+                governor=governor,
+                session=yahoo_session,
+            )
+
+    cached: Dict[str, Dict[str, Any]] = {
+        symbol: metadata_cache.get(symbol) if metadata_cache else {}
+        for symbol in tickers.tickers
+    }
+    # Only symbols with fields that neither the batch path nor the cache supply need a per-symbol `info` request
+    info_tickers: List[yf.Ticker] = [
+        ticker
+        for symbol, ticker in tickers.tickers.items()
+        if symbol not in quotes
+        or not info_only_fields.issubset(quotes[symbol].keys() | cached[symbol].keys())
+    ]
+    metrics.count("TickersRequested", len(info_tickers))
+    projected: Dict[str, Optional[Dict[str, Any]]] = {}
+    if backend == "async" and info_tickers:
+        logger.info(
+            f"Fetching projected fields of {len(info_tickers)} tickers from Yahoo Finance with up to {async_concurrency} requests in flight"
+        )
+        # Symbols with a batched quote only need the fields quotes do not carry, while those
+        # without one, e.g., of a failed quote chunk, need every field
+        projected_groups: List[Tuple[List[str], Set[str]]] = [
+            (
+                [ticker.ticker for ticker in info_tickers if ticker.ticker in quotes],
+                info_only_fields,
+            ),
+            (
+                [
+                    ticker.ticker
+                    for ticker in info_tickers
+                    if ticker.ticker not in quotes
+                ],
+                {column.source for column in kpi_columns if column.source is not None},
+            ),
+        ]
+        with metrics.stage("ProjectedFetch"):
+            for group_symbols, fields in projected_groups:
+                if not group_symbols:
+                    continue
+                projected.update(
+                    fetch_projected_infos(
+                        symbols=group_symbols,
+                        fields=fields,
+                        logger=logger,
+                        governor=governor,
+                        session=yahoo_session,
+                        concurrency=async_concurrency,
+                        batch_size=batch_size or 100,
+                        metrics=metrics,
+                        deadline=deadline,
+                    )
+                )
+        info_tickers = [
+            ticker for ticker in info_tickers if projected[ticker.ticker] is None
+        ]
+        if info_tickers:
+            logger.info(
+                f"Falling back to yfinance for {len(info_tickers)} tickers the projected requests did not return"
+            )
     logger.info(
-        f"Sending GET requests to Yahoo Finance for data on {len(tickers.tickers)} tickers (ETFs and stocks)"
+        f"Sending GET requests to Yahoo Finance for data on {len(info_tickers)} tickers (ETFs and stocks) with up to {max_workers} requests in flight"
     )
-    yf_data: List[Dict[str, Any]] = []
-    info: Dict[str, Any] = {}
-    for ticker in tickers.tickers.values():
+    info_symbols: Set[str] = {ticker.ticker for ticker in info_tickers}
+    # Symbols given up on after retries, which are left out of the output
+    dropped: List[str] = []
+    if deadline is not None:
+        deadline.schedule(requests=len(info_tickers), concurrency=max_workers)
+    # `map` yields results lazily in submission order, so rows keep the order of `symbols`
+    with (
+        metrics.stage("TickerFetch"),
+        ThreadPoolExecutor(max_workers=max_workers) as executor,
+    ):
+        # `None` for tickers dropped after retries or skipped at the deadline
+        fetched_infos: Iterator[Optional[Dict[str, Any]]] = executor.map(
+            partial(
+                fetch_ticker_info,
+                logger=logger,
+                governor=governor,
+                metrics=metrics,
+                deadline=deadline,
+            ),
+            info_tickers,
+        )
         try:
-            info = ticker.info
-        except requests.exceptions.HTTPError as http_error:
-            if (
-                response := http_error.response
-            ) and response.status_code in skippable_http_status_codes:
+            for symbol in symbols:
+                if symbol not in tickers.tickers:
+                    # Only symbols completed by a previous run are left out of `tickers`
+                    assert journal is not None
+                    journaled: Optional[Dict[str, Any]] = journal.rows[symbol]
+                    if journaled is not None:
+                        yield journaled
+                    continue
+
+                fetched: Optional[Dict[str, Any]] = (
+                    next(fetched_infos)
+                    if symbol in info_symbols
+                    else projected.get(symbol, {})
+                )
+                if (
+                    fetched is None
+                    and symbol in info_symbols
+                    and (deadline is None or symbol not in deadline.skipped)
+                ):
+                    dropped.append(symbol)
+                info: Dict[str, Any] = fetched or {}
+                if metadata_cache and info:
+                    metadata_cache.update(symbol=symbol, info=info)
+
+                # Batched quote fields are fresher than those embedded in `info`, and fetched `info`
+                # is fresher than the cache, so later sources take precedence
+                row: Dict[str, Any] = build_row(
+                    {**cached[symbol], **info, **quotes.get(symbol, {})}
+                )
+                has_data: bool = any(value is not None for value in row.values())
+                # Tickers that failed upstream are left out of the journal so that a resumed run retries them
+                if journal is not None and fetched is not None:
+                    journal.record(symbol=symbol, row=row if has_data else None)
+                if has_data:
+                    metrics.count("TickersWithData")
+                    yield row
+        finally:
+            # Push what has been completed so far even when the run is interrupted
+            if journal is not None:
+                journal.sync()
+            if dropped:
                 logger.warning(
-                    f"HTTP {response.status_code} when attempting to access `info` for ticker {ticker.ticker!r}"
+                    f"Dropped {len(dropped)} tickers that kept failing after retries: {', '.join(dropped)}"
                 )
-            else:
-                raise http_error
-        except Exception as unexpected_error:
-            # Catch anything else (parsing, attribute errors, etc.)
-            logger.warning(
-                f"Unexpected error for ticker {ticker.ticker!r}: {unexpected_error!r}"
-            )
+            governor.log_stats()
+            if sessions is not None:
+                sessions.log_stats()
 
-        yf_data.append(
-            {
-                "symbol": info.get("symbol", pd.NA),
-                "first_trade_date": info.get("firstTradeDateMilliseconds", pd.NA),
-                "business_summary": info.get("longBusinessSummary", pd.NA),
-                "previous_close": info.get("previousClose", pd.NA),
-                "nav_price": info.get("navPrice", pd.NA),
-                "dividend_yield": info.get("dividendYield", pd.NA),
-                "net_expense_ratio": info.get("netExpenseRatio", pd.NA),
-                "trailing_pe": info.get("trailingPE", pd.NA),
-                "volume": info.get("volume", pd.NA),
-                "average_volume": info.get("averageVolume", pd.NA),
-                "bid": info.get("bid", pd.NA),
-                "bid_size": info.get("bidSize", pd.NA),
-                "ask_size": info.get("askSize", pd.NA),
-                "ask": info.get("ask", pd.NA),
-                "category": info.get("category", pd.NA),
-                "beta_three_year": info.get("beta3Year", pd.NA),
-                "ytd_return": info.get("ytdReturn", pd.NA),
-                "three_year_avg_return": info.get("threeYearAverageReturn", pd.NA),
-                "five_year_avg_return": info.get("fiveYearAverageReturn", pd.NA),
-            }
-        )
-    logger.info("Completed requesting data from Yahoo Finance, creating DataFrame")
-    data: pd.DataFrame = pd.DataFrame(yf_data).dropna(how="all", axis=0)
 
-    logger.info("Converting first_trade_date to datetime format and adding date column")
-    data["first_trade_date"] = pd.to_datetime(
-        data["first_trade_date"], unit="ms", errors="coerce"
-    )
-    data["date"] = datetime.today().strftime("%Y-%m-%d")
-
-    logger.info("Mapping data types")
-    data = data.astype(
-        {
-            "symbol": pd.StringDtype(),
-            "date": "datetime64[ns]",
-            "first_trade_date": "datetime64[ns]",
-            "previous_close": pd.Float64Dtype(),
-            "nav_price": pd.Float64Dtype(),
-            "dividend_yield": pd.Float64Dtype(),
-            "net_expense_ratio": pd.Float64Dtype(),
-            "trailing_pe": pd.Float64Dtype(),
-            "volume": pd.Float64Dtype(),
-            "average_volume": pd.Float64Dtype(),
-            "bid": pd.Float64Dtype(),
-            "bid_size": pd.Float64Dtype(),
-            "ask_size": pd.Float64Dtype(),
-            "ask": pd.Float64Dtype(),
-            "category": pd.StringDtype(),
-            "beta_three_year": pd.Float64Dtype(),
-            "ytd_return": pd.Float64Dtype(),
-            "three_year_avg_return": pd.Float64Dtype(),
-            "five_year_avg_return": pd.Float64Dtype(),
-            "business_summary": pd.StringDtype(),
-        }
-    )
+def query_etf_and_stock_data(
+    logger: Logger,
+    env: str,
+    max_workers: int = 8,
+    batch_size: int = 0,
+    metadata_cache: Optional[MetadataCache] = None,
+    snapshot_s3_prefix: Optional[str] = None,
+    refresh_snapshot: bool = False,
+    journal: Optional[RunJournal] = None,
+    governor: Optional[RequestGovernor] = None,
+    sessions: Optional[HttpSessions] = None,
+    metrics: Optional[MetricsRecorder] = None,
+    universe: Optional[List[str]] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    backend: str = "yfinance",
+    async_concurrency: int = 32,
+    sample_seed: Optional[int] = None,
+    deadline: Optional[Deadline] = None,
+    gainers_losers: Optional[Dict[str, Any]] = None,
+    derived: bool = False,
+    rolling_state: Optional[RollingState] = None,
+) -> pd.DataFrame:
+    """
+    Query ETFs and top 20 biggest gainer stock data from the Alpha Vantage API and Yahoo Finance API.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    env : str
+        Environment variable to determine how many requests to make
+    max_workers : int, optional
+        Maximum number of `info` requests to Yahoo Finance in flight at once
+    batch_size : int, optional
+        Number of symbols per batched quote request, `0` disables batching so that every
+        field comes from the per-symbol `info` requests; ignored without a `metadata_cache`
+    metadata_cache : Optional[MetadataCache], optional
+        Cache of slow-changing fields, which are then only requested once they expire
+    snapshot_s3_prefix : Optional[str], optional
+        Full s3 url of the prefix Alpha Vantage snapshots are synced with
+    refresh_snapshot : bool, optional
+        `True` to bypass the Alpha Vantage snapshot of the current trading day
+    journal : Optional[RunJournal], optional
+        Journal of completed tickers, whose rows are replayed instead of refetched and to which
+        newly completed tickers are recorded
+    governor : Optional[RequestGovernor], optional
+        Governor shared by all upstream requests, a default one allowing `max_workers` concurrent
+        requests per host is used if `None`
+    sessions : Optional[HttpSessions], optional
+        Pooled keep-alive sessions for Alpha Vantage and Yahoo Finance, yfinance's default session
+        is used if `None`
+    metrics : Optional[MetricsRecorder], optional
+        Recorder of stage durations, per-ticker latency, and counts, nothing is recorded if `None`
+    universe : Optional[List[str]], optional
+        Discovered ETF symbols (see `src.universe`) to scrape in addition to the gainers and `etf_tickers`
+    shard_index : int, optional
+        Index of the shard of symbols to scrape (see `src.sharding`)
+    shard_count : int, optional
+        Number of shards the symbols are split into, `1` scrapes every symbol
+    backend : str, optional
+        `yfinance` to fetch per-symbol fields with `Ticker.info` on `max_workers` threads, or `async`
+        to fetch only the fields used with the projected client of `src.yahoo`, falling back to
+        `Ticker.info` for the tickers it could not fetch
+    async_concurrency : int, optional
+        Maximum number of requests in flight with the `async` backend
+    sample_seed : Optional[int], optional
+        Seed of the tickers sampled outside of `prod`, so that a run can be reproduced, a random
+        sample is drawn if `None`
+    deadline : Optional[Deadline], optional
+        Budget of the run, per-symbol requests that would no longer complete in time are skipped
+        and recorded to it, so that what was fetched can still be written
+    gainers_losers : Optional[Dict[str, Any]], optional
+        Alpha Vantage snapshot to scrape the gainers of instead of requesting it, e.g., the one
+        shared by the shards of a run (see `src.sharding.shared_gainers_losers`)
+    derived : bool, optional
+        `True` to append the derived KPI columns of `src.derived` to the typed DataFrame
+    rolling_state : Optional[RollingState], optional
+        Per-symbol close history the rolling changes of the derived KPIs are updated from, only the
+        point-in-time derived KPIs are added if `None`
 
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame containing ETF and stock data
+    """
+    rows: List[Dict[str, Any]] = list(
+        iter_etf_and_stock_rows(
+            logger=logger,
+            env=env,
+            max_workers=max_workers,
+            batch_size=batch_size,
+            metadata_cache=metadata_cache,
+            snapshot_s3_prefix=snapshot_s3_prefix,
+            refresh_snapshot=refresh_snapshot,
+            journal=journal,
+            governor=governor,
+            sessions=sessions,
+            metrics=metrics,
+            universe=universe,
+            shard_index=shard_index,
+            shard_count=shard_count,
+            backend=backend,
+            async_concurrency=async_concurrency,
+            sample_seed=sample_seed,
+            deadline=deadline,
+            gainers_losers=gainers_losers,
+        )
+    )
+    data: pd.DataFrame = rows_to_frame(logger=logger, rows=rows, metrics=metrics)
+    if derived:
+        metrics = metrics or MetricsRecorder(enabled=False)
+        with metrics.stage("DerivedKPIs"):
+            data = add_derived_kpis(
+                data=data, run_date=datetime.today().date(), state=rolling_state
+            )
     return data
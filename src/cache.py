@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from datetime import timedelta
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.utils import download_from_s3, upload_to_s3
+
+# Time-to-live of each slow-changing `info` field; fields without an entry are never cached
+default_field_ttls: Dict[str, timedelta] = {
+    "firstTradeDateMilliseconds": timedelta(days=90),
+    "longBusinessSummary": timedelta(days=30),
+    "category": timedelta(days=30),
+    "netExpenseRatio": timedelta(days=7),
+    "beta3Year": timedelta(days=7),
+    "threeYearAverageReturn": timedelta(days=7),
+    "fiveYearAverageReturn": timedelta(days=7),
+}
+default_metadata_cache_path: Path = (
+    Path.cwd() / ".cache" / "metadata" / "ticker_metadata.json"
+)
+
+
+class MetadataCache(object):
+    """
+    Field-level cache of slow-changing ticker metadata with a time-to-live per field.
+
+    Entries are stored in a local JSON file as `{symbol: {"last_used": ..., "fields": {key: [value, fetched_at]}}}`,
+    which can be synced to and from S3 so that the cache survives across Fargate tasks.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    path : Path, optional
+        Local JSON file backing the cache
+    s3_path : Optional[str], optional
+        Full s3 url the local file is synced with, or `None` to keep the cache local
+    field_ttls : Optional[Dict[str, timedelta]], optional
+        Time-to-live of each cached field, defaults to `default_field_ttls`
+    max_symbols : int, optional
+        Maximum number of symbols to keep, the least recently used are evicted first
+    force_refresh : bool, optional
+        `True` to treat every lookup as a miss so that all fields are refetched and rewritten
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        path: Path = default_metadata_cache_path,
+        s3_path: Optional[str] = None,
+        field_ttls: Optional[Dict[str, timedelta]] = None,
+        max_symbols: int = 20_000,
+        force_refresh: bool = False,
+    ) -> None:
+        self.logger: Logger = logger
+        self.path: Path = path
+        self.s3_path: Optional[str] = s3_path
+        self.field_ttls: Dict[str, timedelta] = field_ttls or default_field_ttls
+        self.max_symbols: int = max_symbols
+        self.force_refresh: bool = force_refresh
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def load(self) -> None:
+        """
+        Load the cache from the local file, pulling it from S3 first when `s3_path` is set.
+        """
+        if self.s3_path and not download_from_s3(
+            s3_path=self.s3_path, local_path=self.path
+        ):
+            self.logger.info(f"No metadata cache found at {self.s3_path}")
+        if self.path.exists():
+            with self.path.open("r") as cache_file:
+                self.entries = json.load(cache_file)
+        self.logger.info(f"Loaded metadata cache with {len(self.entries)} symbols")
+
+    def save(self) -> None:
+        """
+        Evict stale entries, write the cache to the local file and push it to S3 when `s3_path` is set.
+        """
+        self.evict()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that a crash never leaves a truncated cache behind
+        tmp_path: Path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w") as cache_file:
+            json.dump(self.entries, cache_file, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+        if self.s3_path:
+            upload_to_s3(local_path=self.path, s3_path=self.s3_path)
+        self.logger.info(
+            f"Metadata cache stats: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, {len(self.entries)} symbols"
+        )
+
+    def get(self, symbol: str) -> Dict[str, Any]:
+        """
+        Return the cached fields of a symbol that have not expired.
+
+        Parameters
+        ----------
+        symbol : str
+            Ticker symbol
+
+        Returns
+        -------
+        Dict[str, Any]
+            Mapping of `info` key to cached value, a cached `None` means the field is absent upstream
+        """
+        now: float = time.time()
+        entry: Optional[Dict[str, Any]] = self.entries.get(symbol)
+        fresh: Dict[str, Any] = {}
+        if entry is not None and not self.force_refresh:
+            entry["last_used"] = now
+            for key, (value, fetched_at) in entry["fields"].items():
+                ttl: Optional[timedelta] = self.field_ttls.get(key)
+                if ttl is not None and now - fetched_at < ttl.total_seconds():
+                    fresh[key] = value
+        self.hits += len(fresh)
+        self.misses += len(self.field_ttls) - len(fresh)
+        return fresh
+
+    def update(self, symbol: str, info: Dict[str, Any]) -> None:
+        """
+        Store the cacheable fields of a freshly fetched `info` dictionary.
+
+        Parameters
+        ----------
+        symbol : str
+            Ticker symbol
+        info : Dict[str, Any]
+            The `info` dictionary, fields missing from it are cached as `None`
+        """
+        now: float = time.time()
+        entry: Dict[str, Any] = self.entries.setdefault(
+            symbol, {"last_used": now, "fields": {}}
+        )
+        entry["last_used"] = now
+        for key in self.field_ttls:
+            entry["fields"][key] = [info.get(key), now]
+
+    def evict(self) -> None:
+        """
+        Drop expired fields, symbols left without fields, and the least recently used
+        symbols beyond `max_symbols`.
+        """
+        now: float = time.time()
+        for symbol in list(self.entries):
+            fields: Dict[str, Any] = self.entries[symbol]["fields"]
+            for key in list(fields):
+                ttl: Optional[timedelta] = self.field_ttls.get(key)
+                if ttl is None or now - fields[key][1] >= ttl.total_seconds():
+                    del fields[key]
+            if not fields:
+                del self.entries[symbol]
+                self.evictions += 1
+        if len(self.entries) > self.max_symbols:
+            by_last_used: List[str] = sorted(
+                self.entries, key=lambda symbol: self.entries[symbol]["last_used"]
+            )
+            for symbol in by_last_used[: len(self.entries) - self.max_symbols]:
+                del self.entries[symbol]
+                self.evictions += 1
@@ -0,0 +1,682 @@
+"""
+Record and replay of every upstream HTTP exchange of a run, so that any run can be re-run offline.
+
+A cassette is a gzipped JSON lines archive, `<name>.jsonl.gz`, holding
+
+* a header line with the format version and when the run was recorded,
+* `context` lines with what the run was configured with and everything else it depended on besides
+  the upstream responses: the settings of `query_etf_and_stock_data`, the discovered universe, the
+  seed of the dev sample, and the metadata cache entries it started from,
+* one line per exchange with the normalized request (`key`), the status code, content type, and
+  body of the response (or the connection error or timeout it failed with), and its latency.
+
+Alpha Vantage exchanges are captured by a transport adapter mounted on the `requests` session, and
+Yahoo Finance exchanges by the `curl_cffi` sessions of yfinance and of the projected client, see
+`HttpSessions`. Requests are keyed without the crumb and the API key, which are never stored.
+
+On replay, each request is answered with the next recorded response of its key, so that retries
+see the same failures they saw originally, whatever order concurrent requests arrive in; once a
+key's responses run out, the last one is repeated. Requests the run never sent are answered with a
+404 and counted as misses. With `--latency 1`, responses are delayed by their original latency, so
+that the fetch stages can be profiled as they ran; the default `0` replays as fast as possible.
+
+Replays are exact as long as no response depends on which worker got it. After a request fails
+with an error other than a throttle, yfinance refetches the crumb all workers share, so the
+handshake's responses may go to other workers on replay. A run resumed from a journal only
+recorded the tickers it fetched itself.
+
+Usage
+-----
+python -m src.cassette --cassette s3://bucket/cassettes/etf_kpis_2024_06_28.jsonl.gz --output replay.parquet
+python -m src.cassette --cassette .cache/cassettes/etf_kpis_2024_06_28.jsonl.gz --latency 1 --metrics
+"""
+
+import argparse
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from functools import partial
+from logging import Logger
+from pathlib import Path
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from curl_cffi import CurlInfo
+from curl_cffi import requests as curl_requests
+from curl_cffi.requests import exceptions as curl_exceptions
+from curl_cffi.requests.session import HttpMethod
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from src.metrics import MetricsRecorder
+from src.utils import download_from_s3, setup_logger, upload_to_s3
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+R = TypeVar("R")
+
+cassette_format: int = 1
+default_cassette_location: Path = Path.cwd() / ".cache" / "cassettes"
+# Query parameters that differ between runs or are secret, left out of the recorded requests
+volatile_params: FrozenSet[str] = frozenset({"crumb", "apikey"})
+timeout_errors: Tuple[type, ...] = (
+    requests.exceptions.Timeout,
+    curl_exceptions.Timeout,
+)
+connection_errors: Tuple[type, ...] = (
+    requests.exceptions.ConnectionError,
+    curl_exceptions.ConnectionError,
+)
+
+
+def exchange_key(method: str, url: str, params: Any = None, body: Any = None) -> str:
+    """
+    Return the normalized request an exchange is recorded and replayed under.
+
+    Parameters
+    ----------
+    method : str
+        HTTP method
+    url : str
+        Full url, possibly with a query string
+    params : Any, optional
+        Query parameters sent in addition to the query string, as a mapping or pairs
+    body : Any, optional
+        Request body, hashed into the key if any
+
+    Returns
+    -------
+    str
+        Method and url with the query parameters sorted and `volatile_params` left out, followed
+        by a hash of the body if any
+    """
+    parts = urlsplit(url)
+    pairs: List[Tuple[str, str]] = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        pairs += [
+            (str(name), str(value))
+            for name, value in (params.items() if isinstance(params, dict) else params)
+        ]
+    query: str = urlencode(
+        sorted((name, value) for name, value in pairs if name not in volatile_params)
+    )
+    key: str = f"{method.upper()} {parts.scheme}://{parts.netloc}{parts.path}"
+    if query:
+        key += f"?{query}"
+    if body:
+        if not isinstance(body, (bytes, str)):
+            body = json.dumps(body, sort_keys=True)
+        digest: str = hashlib.sha1(
+            body.encode() if isinstance(body, str) else body
+        ).hexdigest()
+        key += f" #{digest[:12]}"
+    return key
+
+
+def describe_response(response: Any, elapsed: float) -> Dict[str, Any]:
+    """
+    Return the recorded form of a `requests` or `curl_cffi` response.
+    """
+    content: bytes = response.content
+    exchange: Dict[str, Any] = {
+        "status": response.status_code,
+        "type": response.headers.get("content-type"),
+        "elapsed": round(elapsed, 4),
+        # Bytes as received, i.e., before decompression, when the session reports them
+        "size": getattr(response, "infos", {}).get(
+            CurlInfo.SIZE_DOWNLOAD_T, len(content)
+        ),
+    }
+    try:
+        exchange["body"] = content.decode("utf-8")
+    except UnicodeDecodeError:
+        exchange["body64"] = base64.b64encode(content).decode("ascii")
+    return exchange
+
+
+def recorded_content(exchange: Dict[str, Any]) -> bytes:
+    """
+    Return the body of a recorded response.
+    """
+    if "body64" in exchange:
+        return base64.b64decode(exchange["body64"])
+    return exchange.get("body", "").encode("utf-8")
+
+
+def build_requests_response(
+    exchange: Dict[str, Any], request: requests.PreparedRequest
+) -> requests.Response:
+    """
+    Rebuild a `requests` response from its recorded form, raising the error a failed exchange raised.
+    """
+    if exchange.get("error") == "timeout":
+        raise requests.exceptions.Timeout(exchange["message"], request=request)
+    if exchange.get("error") == "connection":
+        raise requests.exceptions.ConnectionError(exchange["message"], request=request)
+    response: requests.Response = requests.Response()
+    response.status_code = exchange["status"]
+    response.reason = "Replayed"
+    response.headers = CaseInsensitiveDict(
+        {"content-type": exchange["type"]} if exchange.get("type") else {}
+    )
+    response._content = recorded_content(exchange)
+    response.url = request.url or ""
+    response.request = request
+    return response
+
+
+def build_curl_response(exchange: Dict[str, Any], url: str) -> curl_requests.Response:
+    """
+    Rebuild a `curl_cffi` response from its recorded form, raising the error a failed exchange raised.
+    """
+    if exchange.get("error") == "timeout":
+        raise curl_exceptions.Timeout(exchange["message"])
+    if exchange.get("error") == "connection":
+        raise curl_exceptions.ConnectionError(exchange["message"])
+    response: curl_requests.Response = curl_requests.Response()
+    response.url = url
+    response.status_code = exchange["status"]
+    response.ok = exchange["status"] < 400
+    response.reason = "Replayed"
+    if exchange.get("type"):
+        response.headers["content-type"] = exchange["type"]
+    response.content = recorded_content(exchange)
+    response.elapsed = timedelta(seconds=exchange.get("elapsed", 0.0))
+    # Keyed by `CurlInfo` as `curl_cffi` does at runtime, although it annotates the keys as `str`
+    infos: Dict[Any, Any] = {
+        CurlInfo.NUM_CONNECTS: 0,
+        CurlInfo.SIZE_DOWNLOAD_T: exchange.get("size", len(response.content)),
+    }
+    response.infos = infos
+    return response
+
+
+class Cassette(object):
+    """
+    Archive of the upstream HTTP exchanges of a run, which is either being recorded or replayed.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    location : str
+        Full s3 url or local path of the `.jsonl.gz` archive; s3 archives are kept locally under
+        `default_cassette_location` while recorded or replayed
+    mode : str, optional
+        `record` to capture the exchanges sent through the cassette, or `replay` to answer them from the archive
+    latency_scale : float, optional
+        Fraction of the recorded latency replayed responses are delayed by, `0` to not delay them
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        location: str,
+        mode: str = "record",
+        latency_scale: float = 0.0,
+    ) -> None:
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode {mode}")
+        self.logger: Logger = logger
+        self.mode: str = mode
+        self.s3_path: Optional[str] = location if location.startswith("s3://") else None
+        self.path: Path = (
+            default_cassette_location / location.rsplit("/", 1)[-1]
+            if self.s3_path
+            else Path(location)
+        )
+        self.latency_scale: float = latency_scale
+        self.context: Dict[str, Any] = {}
+        self.exchanges: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self.file: Optional[IO[str]] = None
+        self.lock: threading.Lock = threading.Lock()
+        self.recorded: int = 0
+        self.recorded_bytes: int = 0
+        self.replayed: int = 0
+        self.misses: int = 0
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    def write_line(self, line: Dict[str, Any]) -> None:
+        """
+        Append a line to the archive being recorded, opening it on the first line.
+        """
+        with self.lock:
+            if self.file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.file = gzip.open(self.path, "wt", encoding="utf-8")
+                self.file.write(
+                    json.dumps(
+                        {
+                            "format": cassette_format,
+                            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+                        }
+                    )
+                    + "\n"
+                )
+            self.file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    def annotate(self, **context: Any) -> None:
+        """
+        Record what the run depends on besides the upstream responses, see `replay_run`.
+
+        Parameters
+        ----------
+        **context : Any
+            JSON-serializable values, merged with those of earlier calls on replay
+        """
+        self.context.update(context)
+        if self.recording:
+            self.write_line({"context": context})
+
+    def record(self, key: str, exchange: Dict[str, Any]) -> None:
+        """
+        Append an exchange to the archive being recorded.
+
+        Parameters
+        ----------
+        key : str
+            Normalized request, see `exchange_key`
+        exchange : Dict[str, Any]
+            Recorded form of the response, see `describe_response`
+        """
+        self.write_line({"key": key, **exchange})
+        with self.lock:
+            self.recorded += 1
+            self.recorded_bytes += exchange.get("size", 0)
+
+    def load(self) -> Dict[str, Any]:
+        """
+        Read the archive to replay, pulling it from S3 first when it is an s3 url.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The recorded context of the run
+        """
+        if self.s3_path and not download_from_s3(
+            s3_path=self.s3_path, local_path=self.path
+        ):
+            raise FileNotFoundError(f"No cassette found at {self.s3_path}")
+        with gzip.open(self.path, "rt", encoding="utf-8") as cassette_file:
+            header: Dict[str, Any] = json.loads(cassette_file.readline())
+            if header.get("format") != cassette_format:
+                raise ValueError(
+                    f"Unsupported cassette format {header.get('format')} in {self.path}"
+                )
+            self.context["recorded_at"] = header["recorded_at"]
+            for line in cassette_file:
+                entry: Dict[str, Any] = json.loads(line)
+                if "context" in entry:
+                    self.context.update(entry["context"])
+                else:
+                    self.exchanges[entry.pop("key")].append(entry)
+        self.logger.info(
+            f"Loaded {sum(len(queue) for queue in self.exchanges.values())} exchanges of {len(self.exchanges)} "
+            f"requests recorded at {self.context['recorded_at']} from {self.path}"
+        )
+        return self.context
+
+    def play(self, key: str) -> Dict[str, Any]:
+        """
+        Return the next recorded response to a request, or a 404 if the run never sent it.
+        """
+        with self.lock:
+            queue: Optional[Deque[Dict[str, Any]]] = self.exchanges.get(key)
+            if not queue:
+                self.misses += 1
+            else:
+                self.replayed += 1
+                # The last response of a key keeps answering once the others are used up
+                return queue.popleft() if len(queue) > 1 else queue[0]
+        self.logger.warning(f"Request not in the cassette: {key}")
+        return {"status": 404, "type": "text/plain", "body": "Not in the cassette"}
+
+    def send(
+        self, key: str, send: Callable[[], R], build: Callable[[Dict[str, Any]], R]
+    ) -> R:
+        """
+        Send a request and record its exchange, or answer it from the archive on replay.
+
+        Parameters
+        ----------
+        key : str
+            Normalized request, see `exchange_key`
+        send : Callable[[], R]
+            Sends the request and returns its response
+        build : Callable[[Dict[str, Any]], R]
+            Rebuilds a response of the type `send` returns from its recorded form
+
+        Returns
+        -------
+        R
+            The live or replayed response
+        """
+        if not self.recording:
+            exchange: Dict[str, Any] = self.play(key)
+            if self.latency_scale > 0:
+                time.sleep(exchange.get("elapsed", 0.0) * self.latency_scale)
+            return build(exchange)
+        start: float = time.perf_counter()
+        try:
+            response: R = send()
+        except Exception as request_error:
+            self.record_error(key, request_error, time.perf_counter() - start)
+            raise
+        self.record(key, describe_response(response, time.perf_counter() - start))
+        return response
+
+    async def send_async(
+        self,
+        key: str,
+        send: Callable[[], Awaitable[R]],
+        build: Callable[[Dict[str, Any]], R],
+    ) -> R:
+        """
+        Coroutine version of `send`, which does not block the event loop while delaying responses.
+        """
+        if not self.recording:
+            exchange: Dict[str, Any] = self.play(key)
+            if self.latency_scale > 0:
+                await asyncio.sleep(exchange.get("elapsed", 0.0) * self.latency_scale)
+            return build(exchange)
+        start: float = time.perf_counter()
+        try:
+            response: R = await send()
+        except Exception as request_error:
+            self.record_error(key, request_error, time.perf_counter() - start)
+            raise
+        self.record(key, describe_response(response, time.perf_counter() - start))
+        return response
+
+    def record_error(self, key: str, error: Exception, elapsed: float) -> None:
+        """
+        Record a request that failed with a timeout or connection error, which replay raises again.
+        """
+        kind: Optional[str] = (
+            "timeout"
+            if isinstance(error, timeout_errors)
+            else "connection"
+            if isinstance(error, connection_errors)
+            else None
+        )
+        if kind is not None:
+            self.record(
+                key,
+                {"error": kind, "message": str(error), "elapsed": round(elapsed, 4)},
+            )
+
+    def close(self) -> None:
+        """
+        Finish the archive being recorded and push it to S3 when it is an s3 url, or log the replay stats.
+        """
+        if not self.recording:
+            self.logger.info(
+                f"Replayed {self.replayed} exchanges, {self.misses} requests were not in the cassette"
+            )
+            return
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.close()
+            self.file = None
+        self.logger.info(
+            f"Recorded {self.recorded} exchanges ({self.recorded_bytes / 1024:,.0f} KiB received) "
+            f"into {self.path} ({self.path.stat().st_size / 1024:,.0f} KiB)"
+        )
+        if self.s3_path:
+            upload_to_s3(local_path=self.path, s3_path=self.s3_path)
+
+
+class CassetteAdapter(BaseAdapter):
+    """
+    Transport adapter of the `requests` session that records or replays its exchanges.
+
+    Parameters
+    ----------
+    cassette : Cassette
+        Cassette being recorded or replayed
+    adapter : HTTPAdapter
+        Adapter the requests are sent with while recording
+    """
+
+    def __init__(self, cassette: Cassette, adapter: HTTPAdapter) -> None:
+        super().__init__()
+        self.cassette: Cassette = cassette
+        self.adapter: HTTPAdapter = adapter
+
+    def send(
+        self,
+        request: requests.PreparedRequest,
+        stream: bool = False,
+        timeout: Union[None, float, Tuple[Optional[float], Optional[float]]] = None,
+        verify: Union[bool, str] = True,
+        cert: Union[None, str, Tuple[str, str]] = None,
+        proxies: Optional[Dict[str, str]] = None,
+    ) -> requests.Response:
+        return self.cassette.send(
+            key=exchange_key(
+                method=request.method or "GET", url=request.url or "", body=request.body
+            ),
+            send=partial(
+                self.adapter.send,
+                request,
+                stream=stream,
+                timeout=timeout,
+                verify=verify,
+                cert=cert,
+                proxies=proxies,
+            ),
+            build=partial(build_requests_response, request=request),
+        )
+
+    def close(self) -> None:
+        self.adapter.close()
+
+
+class CassetteAsyncSession(curl_requests.AsyncSession):
+    """
+    `curl_cffi` async session that records or replays its exchanges.
+
+    Parameters
+    ----------
+    cassette : Cassette
+        Cassette being recorded or replayed
+    **kwargs : Any
+        Keyword arguments of `curl_cffi.requests.AsyncSession`
+    """
+
+    def __init__(self, cassette: Cassette, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.cassette: Cassette = cassette
+
+    # Keyword arguments are passed through as is rather than repeating the parent's long signature
+    async def request(  # type: ignore[override]
+        self, method: HttpMethod, url: str, **kwargs: Any
+    ) -> curl_requests.Response:
+        return await self.cassette.send_async(
+            key=exchange_key(
+                method=method,
+                url=url,
+                params=kwargs.get("params"),
+                body=kwargs.get("json") or kwargs.get("data"),
+            ),
+            send=partial(super().request, method, url, **kwargs),
+            build=partial(build_curl_response, url=url),
+        )
+
+
+def replay_run(
+    logger: Logger,
+    cassette: Cassette,
+    metrics: Optional[MetricsRecorder] = None,
+) -> "pd.DataFrame":
+    """
+    Re-run `query_etf_and_stock_data` with the recorded settings, answering every upstream request from the cassette.
+
+    The metadata cache starts from the recorded entries, aged as they were when the run was
+    recorded, so that the same fields are requested. The Alpha Vantage snapshot is bypassed, and
+    the `date` column is set to the day the run was recorded.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    cassette : Cassette
+        Loaded cassette in `replay` mode
+    metrics : Optional[MetricsRecorder], optional
+        Recorder of the run's stages, nothing is recorded if `None`
+
+    Returns
+    -------
+    pd.DataFrame
+        The DataFrame the recorded run built
+    """
+    import tempfile
+
+    import pandas as pd
+
+    from src.api import query_etf_and_stock_data
+    from src.cache import MetadataCache
+    from src.governance import RequestGovernor
+    from src.session import HttpSessions, seed_yahoo_crumb
+
+    context: Dict[str, Any] = cassette.context
+    max_workers: int = context.get("max_workers", 8)
+    governor: RequestGovernor = RequestGovernor(
+        logger=logger,
+        rate=context.get("request_rate", 5.0),
+        max_concurrency=max_workers,
+        max_retries=context.get("max_retries", 4),
+    )
+    sessions: HttpSessions = HttpSessions(
+        logger=logger, pool_size=max_workers, cassette=cassette, governor=governor
+    )
+    # Requests are replayed whatever the crumb, so a placeholder saves replaying the cookie handshake,
+    # which would also store a cookie in yfinance's persistent cookie cache
+    seed_yahoo_crumb(logger=logger, session=sessions.yahoo, crumb="replay")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        metadata_cache: Optional[MetadataCache] = None
+        if context.get("metadata") is not None:
+            metadata_cache = MetadataCache(
+                logger=logger, path=Path(tmp_dir) / "ticker_metadata.json"
+            )
+            age: float = time.time() - context["metadata"]["recorded_at"]
+            metadata_cache.entries = {
+                symbol: {
+                    "last_used": entry["last_used"] + age,
+                    "fields": {
+                        key: [value, fetched_at + age]
+                        for key, (value, fetched_at) in entry["fields"].items()
+                    },
+                }
+                for symbol, entry in context["metadata"]["entries"].items()
+            }
+        try:
+            data: pd.DataFrame = query_etf_and_stock_data(
+                logger=logger,
+                env=context.get("env", "dev"),
+                max_workers=max_workers,
+                batch_size=context.get("batch_size", 0),
+                metadata_cache=metadata_cache,
+                refresh_snapshot=True,
+                governor=governor,
+                sessions=sessions,
+                metrics=metrics,
+                universe=context.get("universe"),
+                shard_index=context.get("shard_index", 0),
+                shard_count=context.get("shard_count", 1),
+                backend=context.get("backend", "yfinance"),
+                async_concurrency=context.get("async_concurrency", 32),
+                sample_seed=context.get("sample_seed"),
+                gainers_losers=context.get("gainers_losers"),
+            )
+        finally:
+            sessions.close()
+            cassette.close()
+    if "run_date" in context and not data.empty:
+        run_date: pd.Timestamp = pd.Timestamp(context["run_date"])
+        data["date"] = (
+            data["date"].map(lambda _: run_date.date()).astype(data["date"].dtype)
+        )
+    return data
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Re-run a recorded scraper run offline from its cassette"
+    )
+    parser.add_argument(
+        "--cassette", required=True, help="Full s3 url or local path of the cassette"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Fraction of the recorded latency to delay responses by, 1 replays it as it was",
+    )
+    parser.add_argument(
+        "--output", type=Path, help="Parquet or csv file to write the DataFrame to"
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Print the stage metrics of the replayed run",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="Cassette Replay")
+    cassette: Cassette = Cassette(
+        logger=logger, location=args.cassette, mode="replay", latency_scale=args.latency
+    )
+    cassette.load()
+    # The API key is not recorded, and any value is answered from the cassette
+    os.environ.setdefault("API_KEY", "replay")
+    metrics: MetricsRecorder = MetricsRecorder(enabled=args.metrics)
+    start: float = time.perf_counter()
+    data: "pd.DataFrame" = replay_run(logger=logger, cassette=cassette, metrics=metrics)
+    logger.info(
+        f"Replayed the run in {time.perf_counter() - start:.2f}s: {len(data)} rows"
+    )
+    metrics.flush()
+    if args.output:
+        if args.output.suffix == ".parquet":
+            data.to_parquet(args.output, index=False)
+        else:
+            data.to_csv(args.output)
+        logger.info(f"Wrote the replayed DataFrame to {args.output}")
+    return 0 if cassette.misses == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
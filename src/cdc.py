@@ -0,0 +1,364 @@
+"""
+Change-data-capture (CDC) output of the daily KPIs.
+
+Most KPIs of most symbols are identical from one day to the next, so instead of a full snapshot per
+day, CDC mode writes a full snapshot every `snapshot_every` days and, in between, only the changes
+since the previous run, found with a vectorized diff keyed by symbol. `reconstruct` rebuilds the full
+view of any day from the latest snapshot up to it and the change sets after it.
+
+Layout
+------
+`<root>/snapshots/etf_kpis_YYYY_MM_DD.parquet` holds every row of a snapshot day, and
+`<root>/changes/etf_kpis_YYYY_MM_DD.parquet` one row per changed symbol with
+
+* `op`: `I` for symbols that are new since the previous run, `U` for changed ones, and `D` for
+  symbols that are gone,
+* `changed_columns`: names of the columns whose values changed, every column for inserts,
+* the new values of the changed columns, with the other columns left null.
+
+The root may be an s3 url or a local path, which stands in for s3 when testing.
+
+Usage
+-----
+python -m src.cdc reconstruct --root s3://bucket/cdc --date 2024-06-28 --output etf_kpis_2024_06_28.parquet
+"""
+
+import argparse
+import sys
+from datetime import date, datetime
+from logging import Logger
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from src.dataset import resolve_filesystem
+from src.dimension import encoded_size
+from src.schema import pandas_dtypes
+from src.utils import setup_logger
+
+key_columns: List[str] = ["symbol", "date"]
+change_columns: List[str] = ["op", "changed_columns"]
+
+
+def cdc_file_path(base: str, kind: str, day: date) -> str:
+    """
+    Return the path of the snapshot or change set of a day.
+
+    Parameters
+    ----------
+    base : str
+        Root path within the filesystem
+    kind : str
+        `snapshots` or `changes`
+    day : date
+        Date of the file
+
+    Returns
+    -------
+    str
+        Path of the file
+    """
+    return f"{base}/{kind}/etf_kpis_{day.strftime('%Y_%m_%d')}.parquet"
+
+
+def list_cdc_files(root: str, kind: str) -> Dict[date, str]:
+    """
+    Return the snapshots or change sets under a root by date.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the CDC root
+    kind : str
+        `snapshots` or `changes`
+
+    Returns
+    -------
+    Dict[date, str]
+        Path of each day's file, in date order
+    """
+    filesystem, base = resolve_filesystem(root)
+    files: Dict[date, str] = {}
+    for info in filesystem.get_file_info(
+        pafs.FileSelector(f"{base}/{kind}", allow_not_found=True)
+    ):
+        if info.type != pafs.FileType.File or not info.base_name.startswith(
+            "etf_kpis_"
+        ):
+            continue
+        day: date = datetime.strptime(
+            info.base_name.removeprefix("etf_kpis_").removesuffix(".parquet"),
+            "%Y_%m_%d",
+        ).date()
+        files[day] = info.path
+    return dict(sorted(files.items()))
+
+
+def diff_frames(
+    previous: pd.DataFrame, current: pd.DataFrame, run_date: date
+) -> pd.DataFrame:
+    """
+    Compute the change set that turns the previous full view into the current one.
+
+    Parameters
+    ----------
+    previous : pd.DataFrame
+        Full view of the previous run
+    current : pd.DataFrame
+        Full view of this run, with the same columns
+    run_date : date
+        Date of this run, recorded in the `date` column of the change set
+
+    Returns
+    -------
+    pd.DataFrame
+        Change set with the `op` and `changed_columns` columns followed by those of `current`
+    """
+    value_columns: List[str] = [
+        column for column in current.columns if column not in key_columns
+    ]
+    before: pd.DataFrame = previous.set_index("symbol")[value_columns]
+    after: pd.DataFrame = current.set_index("symbol")[value_columns]
+    common: pd.Index = after.index.intersection(before.index)
+
+    # Nulls compare as unknown, so a pair of nulls is equal and a null against a value is a change
+    old: pd.DataFrame = before.loc[common]
+    new: pd.DataFrame = after.loc[common]
+    changed: pd.DataFrame = ~(
+        (new == old).fillna(False).astype(bool) | (new.isna() & old.isna())
+    )
+    updated: pd.Index = changed.index[changed.any(axis=1)]
+    updates: pd.DataFrame = new.loc[updated].where(changed.loc[updated])
+    updates["op"] = "U"
+    updates["changed_columns"] = [
+        [column for column, flag in zip(value_columns, flags) if flag]
+        for flags in changed.loc[updated].itertuples(index=False, name=None)
+    ]
+
+    inserts: pd.DataFrame = after.loc[after.index.difference(before.index)]
+    inserts["op"] = "I"
+    inserts["changed_columns"] = [list(value_columns)] * len(inserts)
+
+    deletes: pd.DataFrame = pd.DataFrame(
+        index=before.index.difference(after.index), columns=after.columns
+    ).astype(after.dtypes.to_dict())
+    deletes["op"] = "D"
+    deletes["changed_columns"] = [[] for _ in range(len(deletes))]
+
+    changes: pd.DataFrame = pd.concat(
+        [frame for frame in (inserts, updates, deletes) if len(frame)] or [updates],
+        axis=0,
+    )
+    changes.index.name = "symbol"
+    changes = changes.reset_index().sort_values("symbol", ignore_index=True)
+    changes["date"] = pd.Series(
+        pd.Timestamp(run_date), index=changes.index, dtype=current["date"].dtype
+    )
+    return changes[["symbol", *change_columns, *current.columns.drop("symbol")]]
+
+
+def apply_changes(view: pd.DataFrame, changes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply a change set to a full view.
+
+    Parameters
+    ----------
+    view : pd.DataFrame
+        Full view of the day before the change set
+    changes : pd.DataFrame
+        Change set, as returned by `diff_frames`
+
+    Returns
+    -------
+    pd.DataFrame
+        Full view of the day of the change set, sorted by symbol
+    """
+    value_columns: List[str] = [
+        column for column in view.columns if column not in key_columns
+    ]
+    result: pd.DataFrame = view.set_index("symbol")
+    changes = changes.set_index("symbol")
+    result = result.drop(index=changes.index[changes["op"] == "D"], errors="ignore")
+
+    updates: pd.DataFrame = changes[changes["op"] == "U"]
+    if len(updates):
+        # One boolean column per value column telling which symbols changed it
+        exploded: pd.Series = updates["changed_columns"].explode().dropna()
+        flags: pd.DataFrame = (
+            pd.crosstab(exploded.index, exploded)
+            .reindex(index=updates.index, columns=value_columns, fill_value=0)
+            .astype(bool)
+        )
+        for column in value_columns:
+            symbols: pd.Index = flags.index[flags[column]]
+            if len(symbols):
+                result.loc[symbols, column] = updates.loc[symbols, column]
+
+    inserts: pd.DataFrame = changes.loc[changes["op"] == "I", result.columns]
+    if len(inserts):
+        result = pd.concat([result, inserts]) if len(result) else inserts
+    result = result.reset_index().sort_values("symbol", ignore_index=True)
+    if len(changes):
+        result["date"] = pd.Series(
+            changes["date"].iloc[0], index=result.index, dtype=view["date"].dtype
+        )
+    return result[view.columns]
+
+
+def read_cdc_file(root: str, path: str) -> pd.DataFrame:
+    """
+    Read a snapshot or change set with the nullable dtypes of the schema registry.
+    """
+    filesystem, _ = resolve_filesystem(root)
+    return pq.read_table(path, filesystem=filesystem).to_pandas(
+        types_mapper=pandas_dtypes.get
+    )
+
+
+def reconstruct(root: str, day: date) -> Optional[pd.DataFrame]:
+    """
+    Rebuild the full view of a day from the latest snapshot up to it and the change sets after it.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the CDC root
+    day : date
+        Day to rebuild
+
+    Returns
+    -------
+    Optional[pd.DataFrame]
+        Full view of the day as of its last run, sorted by symbol, or `None` if no snapshot precedes it
+    """
+    snapshots: Dict[date, str] = list_cdc_files(root=root, kind="snapshots")
+    start: Optional[date] = max(
+        (snapshot_day for snapshot_day in snapshots if snapshot_day <= day),
+        default=None,
+    )
+    if start is None:
+        return None
+    view: pd.DataFrame = read_cdc_file(root=root, path=snapshots[start])
+    view = view.sort_values("symbol", ignore_index=True)
+    for change_day, path in list_cdc_files(root=root, kind="changes").items():
+        if start < change_day <= day:
+            view = apply_changes(view=view, changes=read_cdc_file(root=root, path=path))
+    return view
+
+
+def write_cdc(
+    logger: Logger,
+    data: pd.DataFrame,
+    root: str,
+    run_date: date,
+    snapshot_every: int = 7,
+) -> Tuple[str, int]:
+    """
+    Write a run's rows as a full snapshot if one is due, or as the change set since the previous run.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    data : pd.DataFrame
+        Full view of the run, with a `symbol` column
+    root : str
+        Full s3 url or local path of the CDC root
+    run_date : date
+        Date of the run; a rerun on the same day replaces that day's file
+    snapshot_every : int, optional
+        Days between full snapshots, which bounds how many change sets `reconstruct` applies
+
+    Returns
+    -------
+    Tuple[str, int]
+        Path of the written file and its size in bytes
+    """
+    filesystem, base = resolve_filesystem(root)
+    snapshots: Dict[date, str] = list_cdc_files(root=root, kind="snapshots")
+    changes: Dict[date, str] = list_cdc_files(root=root, kind="changes")
+    last_snapshot: Optional[date] = max(
+        (day for day in snapshots if day <= run_date), default=None
+    )
+    previous_day: Optional[date] = max(
+        (day for day in [*snapshots, *changes] if day < run_date), default=None
+    )
+
+    output: pd.DataFrame = data
+    kind: str = "snapshots"
+    if (
+        last_snapshot is not None
+        and last_snapshot != run_date
+        and previous_day is not None
+        and (run_date - last_snapshot).days < snapshot_every
+    ):
+        previous: Optional[pd.DataFrame] = reconstruct(root=root, day=previous_day)
+        if previous is not None and list(previous.columns) == list(data.columns):
+            output = diff_frames(previous=previous, current=data, run_date=run_date)
+            kind = "changes"
+            counts: Dict[str, int] = output["op"].value_counts().to_dict()
+            logger.info(
+                f"{len(output)} of {len(data)} symbols changed since {previous_day}: "
+                f"{counts.get('I', 0)} inserted, {counts.get('U', 0)} updated, {counts.get('D', 0)} deleted"
+            )
+        else:
+            logger.info(
+                f"Columns changed since {previous_day}, writing a full snapshot instead of changes"
+            )
+    # A day keeps one file, so a rerun that switches kind replaces the other one
+    stale: Optional[str] = (changes if kind == "snapshots" else snapshots).get(run_date)
+    if stale is not None:
+        filesystem.delete_file(stale)
+
+    path: str = cdc_file_path(base=base, kind=kind, day=run_date)
+    filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    pq.write_table(
+        pa.Table.from_pandas(output, preserve_index=False), path, filesystem=filesystem
+    )
+    size: int = filesystem.get_file_info(path).size
+    logger.info(f"Wrote {kind} file {path} with {len(output)} rows ({size:,} bytes)")
+    if kind == "changes":
+        full_size: int = encoded_size(data)
+        logger.info(
+            f"The change set takes {size / full_size:.0%} of the {full_size:,} bytes of a full snapshot"
+        )
+    return path, size
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Read the CDC output of the KPIs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser(
+        "reconstruct", help="Rebuild the full view of a day as a Parquet file"
+    )
+    rebuild.add_argument(
+        "--root", required=True, help="s3 url or local path of the CDC root"
+    )
+    rebuild.add_argument("--date", required=True, help="Day to rebuild as YYYY-MM-DD")
+    rebuild.add_argument(
+        "--output", required=True, help="s3 url or local path of the Parquet file"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="KPI CDC")
+    day: date = datetime.strptime(args.date, "%Y-%m-%d").date()
+    view: Optional[pd.DataFrame] = reconstruct(root=args.root, day=day)
+    if view is None:
+        logger.error(f"[ERROR] No snapshot under {args.root} precedes {day}")
+        return 1
+    filesystem, path = resolve_filesystem(args.output)
+    pq.write_table(
+        pa.Table.from_pandas(view, preserve_index=False), path, filesystem=filesystem
+    )
+    logger.info(f"Rebuilt {len(view)} rows of {day} into {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
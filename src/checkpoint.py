@@ -0,0 +1,124 @@
+import json
+from datetime import date
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.utils import delete_from_s3, download_from_s3, upload_to_s3
+
+default_journal_location: Path = Path.cwd() / ".cache" / "checkpoints"
+
+
+class RunJournal(object):
+    """
+    Append-only journal of the tickers completed by a scrape run, so that a restarted run for the
+    same date only fetches the remainder.
+
+    Each line of the local JSONL file is `{"symbol": ..., "row": {...}}`, where `row` is `null` for
+    tickers that returned no data. The file is pushed to S3 every `checkpoint_every` records, so a
+    run that is killed loses at most that many tickers.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    run_date : date
+        Trading day of the run (see `src.utils.trading_day`), which keys the journal
+    location : Path, optional
+        Local directory holding the journal file
+    s3_prefix : Optional[str], optional
+        Full s3 url of the prefix the journal is synced with, or `None` to keep it local
+    checkpoint_every : int, optional
+        Number of records between two syncs to S3
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        run_date: date,
+        location: Path = default_journal_location,
+        s3_prefix: Optional[str] = None,
+        checkpoint_every: int = 25,
+    ) -> None:
+        file_name: str = f"run_journal_{run_date.strftime('%Y_%m_%d')}.jsonl"
+        self.logger: Logger = logger
+        self.path: Path = location / file_name
+        self.s3_path: Optional[str] = f"{s3_prefix}/{file_name}" if s3_prefix else None
+        self.checkpoint_every: int = checkpoint_every
+        self.rows: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.pending: int = 0
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.rows
+
+    def load(self) -> None:
+        """
+        Load the records of an earlier run for the same date, pulling the journal from S3 first when `s3_prefix` is set.
+        """
+        if self.s3_path and not download_from_s3(
+            s3_path=self.s3_path, local_path=self.path
+        ):
+            self.logger.info(f"No run journal found at {self.s3_path}")
+        if self.path.exists():
+            lines: List[str] = self.path.read_text().splitlines(keepends=True)
+            complete: List[str] = []
+            for line in lines:
+                # The last line may be truncated if the process was killed mid-write
+                try:
+                    record: Dict[str, Any] = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not line.endswith("\n"):
+                    continue
+                self.rows[record["symbol"]] = record["row"]
+                complete.append(line)
+            # Cut a truncated line off, otherwise the next record would be appended onto it
+            if len(complete) < len(lines):
+                self.logger.warning(
+                    f"Dropping {len(lines) - len(complete)} truncated lines of run journal {self.path.name}"
+                )
+                self.path.write_text("".join(complete))
+        if self.rows:
+            self.logger.info(
+                f"Resuming from run journal {self.path.name} with {len(self.rows)} completed tickers"
+            )
+
+    def record(self, symbol: str, row: Optional[Dict[str, Any]]) -> None:
+        """
+        Append a completed ticker to the journal, syncing to S3 every `checkpoint_every` records.
+
+        Parameters
+        ----------
+        symbol : str
+            Ticker symbol
+        row : Optional[Dict[str, Any]]
+            Row keyed by output column, or `None` if the ticker returned no data
+        """
+        self.rows[symbol] = row
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a") as journal_file:
+            journal_file.write(json.dumps({"symbol": symbol, "row": row}) + "\n")
+        self.pending += 1
+        if self.pending >= self.checkpoint_every:
+            self.sync()
+
+    def sync(self) -> None:
+        """
+        Push the journal to S3 when `s3_prefix` is set and there are unsynced records.
+        """
+        if self.s3_path and self.pending and self.path.exists():
+            upload_to_s3(local_path=self.path, s3_path=self.s3_path)
+            self.logger.info(
+                f"Checkpointed {len(self.rows)} completed tickers to {self.s3_path}"
+            )
+        self.pending = 0
+
+    def complete(self) -> None:
+        """
+        Delete the journal once the run's output has been written, so that later runs start fresh.
+        """
+        self.path.unlink(missing_ok=True)
+        if self.s3_path:
+            delete_from_s3(s3_path=self.s3_path)
+        self.rows.clear()
+        self.pending = 0
@@ -0,0 +1,400 @@
+"""
+Intraday polling daemon, which stays resident and snapshots the volatile quote columns of the universe.
+
+The daily run pays a container cold start, imports, and fresh connections for every snapshot. In
+daemon mode, `main.py` sets up once and then polls every `interval` seconds with
+
+* one event loop and one keep-alive `AsyncSession` for the whole day, carrying yfinance's cookie
+  and crumb, which are only refetched after a tick in which every request failed,
+* projected quote requests (see `src.yahoo`) for `tick_columns` only, batched `batch_size` symbols
+  per request, since the static attributes do not change intraday.
+
+Layout
+------
+Each tick is written to `<root>/date=YYYY-MM-DD/quotes_HHMMSS_ffffff.parquet` (with the shard name
+appended to the file name in sharded runs), so that readers can load a day with its `polled_at` timestamps.
+
+SIGTERM (sent by ECS when stopping a task) and SIGINT end the daemon after the tick in flight is
+written; sleeps between ticks are interrupted right away.
+"""
+
+import asyncio
+import statistics
+import threading
+import time
+from datetime import datetime
+from datetime import time as clock_time
+from logging import Logger
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from curl_cffi import CurlInfo
+from curl_cffi import requests as curl_requests
+
+from src.dataset import resolve_filesystem
+from src.governance import RequestGovernor
+from src.metrics import MetricsRecorder
+from src.schema import Column, column_array, kpi_columns
+from src.session import ReuseCountingSession, yahoo_crumb
+from src.yahoo import ProjectedYahooClient, quote_fields
+
+# Registered columns that change during the session, the others are left to the daily run
+volatile_column_names: List[str] = [
+    "symbol",
+    "volume",
+    "bid",
+    "bid_size",
+    "ask",
+    "ask_size",
+]
+tick_columns: List[Column] = [
+    *[column for column in kpi_columns if column.name in volatile_column_names],
+    Column("price", "regularMarketPrice", pa.float64()),
+    Column(
+        "quote_time",
+        "regularMarketTime",
+        pa.timestamp("ns"),
+        source_type=pa.timestamp("s"),
+    ),
+    Column("polled_at", None, pa.timestamp("ns"), nullable=False),
+]
+tick_schema: pa.Schema = pa.schema(
+    [
+        pa.field(column.name, column.arrow_type, column.nullable)
+        for column in tick_columns
+    ]
+)
+# Maps the `info` keys of the tick columns to the keys of the quote endpoint that supply them
+tick_quote_fields: Dict[str, str] = {
+    column.source: quote_fields.get(column.source, column.source)
+    for column in tick_columns
+    if column.source is not None
+}
+
+
+def quotes_to_table(quotes: Dict[str, Dict[str, Any]], polled_at: datetime) -> pa.Table:
+    """
+    Convert the quotes of a tick to an Arrow table with `tick_schema`.
+
+    Parameters
+    ----------
+    quotes : Dict[str, Dict[str, Any]]
+        Mapping of symbol to its fields keyed by `info` key
+    polled_at : datetime
+        Start of the tick, the value of the `polled_at` column
+
+    Returns
+    -------
+    pa.Table
+        One row per symbol
+    """
+    arrays: List[pa.Array] = []
+    for column in tick_columns:
+        if column.source is None:
+            arrays.append(pa.array([polled_at] * len(quotes), type=column.arrow_type))
+            continue
+        arrays.append(
+            column_array(
+                [fields.get(column.source) for fields in quotes.values()], column
+            )
+        )
+    return pa.Table.from_arrays(arrays, schema=tick_schema)
+
+
+def write_tick(
+    table: pa.Table, root: str, polled_at: datetime, name_suffix: str = ""
+) -> Tuple[str, int]:
+    """
+    Write the table of a tick under its date partition.
+
+    Parameters
+    ----------
+    table : pa.Table
+        Quotes of the tick
+    root : str
+        Full s3 url or local path of the intraday root
+    polled_at : datetime
+        Start of the tick, which names the file
+    name_suffix : str, optional
+        Appended to the file name, e.g., the shard name
+
+    Returns
+    -------
+    Tuple[str, int]
+        Path of the file within the filesystem and its size in bytes
+    """
+    filesystem, base = resolve_filesystem(root)
+    directory: str = f"{base}/date={polled_at.date().isoformat()}"
+    filesystem.create_dir(directory, recursive=True)
+    path: str = (
+        f"{directory}/quotes_{polled_at.strftime('%H%M%S_%f')}{name_suffix}.parquet"
+    )
+    pq.write_table(table, path, filesystem=filesystem)
+    return path, filesystem.get_file_info(path).size
+
+
+class QuotePoller(object):
+    """
+    Polls the volatile quote fields of a fixed set of symbols over warm connections.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    governor : RequestGovernor
+        Governor that rate limits and retries the requests
+    symbols : List[str]
+        Ticker symbols to poll
+    session : Optional[curl_requests.Session], optional
+        yfinance's session, whose cookie and crumb are reused, yfinance's default session is used if `None`
+    concurrency : int, optional
+        Maximum number of requests in flight
+    batch_size : int, optional
+        Number of symbols per quote request
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        governor: RequestGovernor,
+        symbols: List[str],
+        session: Optional[curl_requests.Session] = None,
+        concurrency: int = 32,
+        batch_size: int = 100,
+    ) -> None:
+        self.logger: Logger = logger
+        self.governor: RequestGovernor = governor
+        self.symbols: List[str] = symbols
+        self.session: Optional[curl_requests.Session] = session
+        self.concurrency: int = concurrency
+        self.batch_size: int = batch_size
+        # One event loop for the lifetime of the daemon, so that the async session stays open
+        self.runner: asyncio.Runner = asyncio.Runner()
+        self.async_session: Optional[curl_requests.AsyncSession] = None
+        self.client: Optional[ProjectedYahooClient] = None
+        self.refresh: bool = False
+
+    def connect(self, refresh: bool = False) -> ProjectedYahooClient:
+        """
+        Get yfinance's cookie and crumb and open the async session the ticks are sent with.
+
+        Parameters
+        ----------
+        refresh : bool, optional
+            `True` to refetch the cookie and crumb instead of reusing the ones yfinance holds
+
+        Returns
+        -------
+        ProjectedYahooClient
+            Client the ticks are sent with, also kept as `client`
+        """
+        self.disconnect()
+        crumb, cookie_session = yahoo_crumb(
+            logger=self.logger,
+            governor=self.governor,
+            session=self.session,
+            refresh=refresh,
+        )
+
+        async def open_session() -> curl_requests.AsyncSession:
+            return (
+                cookie_session.async_session
+                if isinstance(cookie_session, ReuseCountingSession)
+                else curl_requests.AsyncSession
+            )(
+                impersonate="chrome",
+                cookies=cookie_session.cookies,
+                max_clients=self.concurrency,
+                curl_infos=[CurlInfo.SIZE_DOWNLOAD_T],
+            )
+
+        self.async_session = self.runner.run(open_session())
+        self.client = ProjectedYahooClient(
+            logger=self.logger,
+            governor=self.governor,
+            session=self.async_session,
+            crumb=crumb,
+            concurrency=self.concurrency,
+        )
+        return self.client
+
+    def disconnect(self) -> None:
+        """
+        Close the async session if it is open.
+        """
+        if self.async_session is not None:
+            self.runner.run(self.async_session.close())
+        self.async_session, self.client = None, None
+
+    def close(self) -> None:
+        """
+        Close the async session and the event loop.
+        """
+        self.disconnect()
+        self.runner.close()
+
+    def poll(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch the tick fields of every symbol once.
+
+        Returns
+        -------
+        Dict[str, Dict[str, Any]]
+            Mapping of symbol to its fields keyed by `info` key, symbols of failed requests are left out
+        """
+        client: Optional[ProjectedYahooClient] = self.client
+        if client is None:
+            try:
+                client = self.connect(refresh=self.refresh)
+            except Exception as connect_error:
+                # The daemon outlives transient outages, the next tick tries again
+                self.logger.warning(
+                    f"Could not get a Yahoo Finance crumb, skipping the tick: {connect_error!r}"
+                )
+                return {}
+        chunks: List[List[str]] = [
+            self.symbols[start : start + self.batch_size]
+            for start in range(0, len(self.symbols), self.batch_size)
+        ]
+
+        async def fetch() -> List[Optional[Dict[str, Dict[str, Any]]]]:
+            return await asyncio.gather(
+                *(client.fetch_quotes(chunk, tick_quote_fields) for chunk in chunks)
+            )
+
+        results: List[Optional[Dict[str, Dict[str, Any]]]] = self.runner.run(fetch())
+        quotes: Dict[str, Dict[str, Any]] = {}
+        for chunk_quotes in results:
+            quotes.update(chunk_quotes or {})
+        if chunks and all(chunk_quotes is None for chunk_quotes in results):
+            # An expired cookie or crumb fails every request, so get new ones for the next tick
+            self.logger.warning(
+                "Every quote request of the tick failed, reconnecting before the next one"
+            )
+            self.disconnect()
+            self.refresh = True
+        elif quotes:
+            self.refresh = False
+        return quotes
+
+
+def run_daemon(
+    logger: Logger,
+    poller: QuotePoller,
+    output_root: str,
+    interval: float,
+    stop: threading.Event,
+    metrics: Optional[MetricsRecorder] = None,
+    max_ticks: int = 0,
+    until: Optional[clock_time] = None,
+    name_suffix: str = "",
+) -> int:
+    """
+    Poll and write the quotes of the universe every `interval` seconds until stopped.
+
+    Ticks start on a fixed cadence from the first one; a tick that overruns the interval makes the
+    next one start right away, skipping the slots it missed.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    poller : QuotePoller
+        Poller of the universe
+    output_root : str
+        Full s3 url or local path the ticks are written under
+    interval : float
+        Seconds between the starts of consecutive ticks
+    stop : threading.Event
+        Event set to stop the daemon, e.g., by the SIGTERM handler
+    metrics : Optional[MetricsRecorder], optional
+        Recorder of per-tick latency (`TickLatency`, `TickFetch`, `TickWrite`), quote counts, and
+        failed writes (`TickWriteErrors`), flushed after every tick
+    max_ticks : int, optional
+        Number of ticks after which to stop, `0` for no limit
+    until : Optional[clock_time], optional
+        US/Eastern time of day after which to stop, e.g., the market close
+    name_suffix : str, optional
+        Appended to the file name of every tick, e.g., the shard name
+
+    Returns
+    -------
+    int
+        Number of ticks written
+    """
+    metrics = metrics or MetricsRecorder(enabled=False)
+    logger.info(
+        f"Polling {len(poller.symbols)} symbols every {interval:g}s into {output_root}"
+    )
+    latencies: List[float] = []
+    started: float = time.perf_counter()
+    ticks: int = 0
+    write_failures: int = 0
+    try:
+        while not stop.is_set():
+            if until and datetime.now(tz=ZoneInfo("US/Eastern")).time() >= until:
+                logger.info(f"Reached {until.strftime('%H:%M')} US/Eastern, stopping")
+                break
+            tick_start: float = time.perf_counter()
+            polled_at: datetime = datetime.now()
+            quotes: Dict[str, Dict[str, Any]] = poller.poll()
+            fetched: float = time.perf_counter()
+            bytes_written: int = 0
+            if quotes:
+                try:
+                    _, bytes_written = write_tick(
+                        table=quotes_to_table(quotes=quotes, polled_at=polled_at),
+                        root=output_root,
+                        polled_at=polled_at,
+                        name_suffix=name_suffix,
+                    )
+                except Exception as write_error:
+                    # Like a failed poll, a failed write only loses its tick, the next one tries again
+                    write_failures += 1
+                    metrics.count("TickWriteErrors")
+                    logger.warning(
+                        f"Could not write tick {ticks + 1}, skipping it: {write_error!r}"
+                    )
+            finished: float = time.perf_counter()
+            ticks += 1
+            latencies.append((finished - tick_start) * 1e3)
+            metrics.observe("TickLatency", latencies[-1])
+            metrics.observe("TickFetch", (fetched - tick_start) * 1e3)
+            metrics.observe("TickWrite", (finished - fetched) * 1e3)
+            metrics.count("TickQuotes", len(quotes))
+            metrics.count("BytesWritten", bytes_written, unit="Bytes")
+            metrics.flush()
+            logger.info(
+                f"Tick {ticks}: {len(quotes)} of {len(poller.symbols)} quotes in {latencies[-1]:,.0f} ms "
+                f"(fetch {(fetched - tick_start) * 1e3:,.0f} ms, write {(finished - fetched) * 1e3:,.0f} ms, "
+                f"{bytes_written / 1024:,.1f} KiB)"
+            )
+            if max_ticks and ticks >= max_ticks:
+                break
+
+            # Sleep until the next slot on the cadence, waking up at once when stopped
+            elapsed: float = time.perf_counter() - started
+            wait: float = interval - elapsed % interval
+            if finished - tick_start > interval:
+                logger.warning(
+                    f"Tick {ticks} took longer than the {interval:g}s interval, skipping "
+                    f"{int((finished - tick_start) // interval)} slots"
+                )
+            stop.wait(timeout=wait)
+    finally:
+        poller.close()
+    if latencies:
+        p95: float = (
+            statistics.quantiles(latencies, n=20, method="inclusive")[-1]
+            if len(latencies) > 1
+            else latencies[0]
+        )
+        logger.info(
+            f"Stopped after {ticks} ticks, tick latency p50 {statistics.median(latencies):,.0f} ms, "
+            f"p95 {p95:,.0f} ms, max {max(latencies):,.0f} ms"
+        )
+    if write_failures:
+        logger.warning(f"{write_failures} of {ticks} ticks could not be written")
+    return ticks - write_failures
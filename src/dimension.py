@@ -0,0 +1,387 @@
+"""
+Dimension table of the static descriptive attributes of each symbol.
+
+`business_summary` is by far the widest column and, like `category` and `first_trade_date`, it
+almost never changes. When the dimension table is enabled, these columns are split out of the daily
+output into one Parquet file keyed by `symbol` and `attributes_hash`, a hash of their values, and the
+daily (fact) rows only carry the hash. A new version of a symbol's attributes is appended when its
+hash changes, and earlier versions are kept so that older fact files still join.
+
+Layout
+------
+`s3://<bucket>/dimensions/symbol_attributes.parquet` with columns `symbol`, `attributes_hash`, the
+attribute columns, and `first_seen`, the date the version was first written.
+
+Usage
+-----
+python -m src.dimension report --facts s3://bucket/daily-kpis --dimension s3://bucket/dimensions/symbol_attributes.parquet
+"""
+
+import argparse
+import hashlib
+import json
+import sys
+from datetime import date
+from logging import Logger
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from src.dataset import resolve_filesystem
+from src.schema import kpi_columns, pandas_dtypes
+from src.utils import setup_logger
+
+dimension_file_name: str = "symbol_attributes.parquet"
+# Output columns moved to the dimension table, which should rarely change for a symbol
+dimension_columns: List[str] = ["business_summary", "category", "first_trade_date"]
+hash_column: str = "attributes_hash"
+
+
+def attributes_hash(values: List[Any]) -> str:
+    """
+    Return a stable hash of the attribute values of one row.
+
+    Parameters
+    ----------
+    values : List[Any]
+        Values of `dimension_columns`, in order
+
+    Returns
+    -------
+    str
+        16 hex digits
+    """
+    canonical: str = json.dumps(
+        [None if pd.isna(value) else str(value) for value in values]
+    )
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def split_dimension(
+    data: pd.DataFrame, run_date: date
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split KPI rows into fact rows referencing their attributes by hash and the attribute versions.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        KPI rows with the `dimension_columns`
+    run_date : date
+        Date recorded as `first_seen` of versions that turn out to be new
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        Fact rows with `attributes_hash` in place of the attribute columns, and one dimension row per
+        distinct symbol and hash
+    """
+    hashes: pd.Series = pd.Series(
+        [
+            attributes_hash(list(values))
+            for values in data[dimension_columns].itertuples(index=False, name=None)
+        ],
+        index=data.index,
+        dtype=pd.StringDtype(),
+    )
+    facts: pd.DataFrame = data.drop(columns=dimension_columns)
+    facts.insert(1, hash_column, hashes)
+    dimension: pd.DataFrame = (
+        data[["symbol", *dimension_columns]]
+        .assign(**{hash_column: hashes})
+        .drop_duplicates(subset=["symbol", hash_column])
+    )
+    dimension["first_seen"] = pd.Timestamp(run_date)
+    return facts, dimension[["symbol", hash_column, *dimension_columns, "first_seen"]]
+
+
+def read_dimension(path: str) -> pd.DataFrame:
+    """
+    Read the dimension table, or return an empty one if it does not exist yet.
+
+    Parameters
+    ----------
+    path : str
+        Full s3 url or local path of the dimension file
+
+    Returns
+    -------
+    pd.DataFrame
+        Every version of every symbol's attributes
+    """
+    filesystem, file_path = resolve_filesystem(path)
+    if filesystem.get_file_info(file_path).type == pafs.FileType.NotFound:
+        return pd.DataFrame(
+            columns=["symbol", hash_column, *dimension_columns, "first_seen"]
+        )
+    return pq.read_table(file_path, filesystem=filesystem).to_pandas(
+        types_mapper=pandas_dtypes.get
+    )
+
+
+def update_dimension(logger: Logger, dimension: pd.DataFrame, path: str) -> int:
+    """
+    Append the attribute versions missing from the dimension table, rewriting it only if any are.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    dimension : pd.DataFrame
+        Attribute versions of a run, as returned by `split_dimension`
+    path : str
+        Full s3 url or local path of the dimension file
+
+    Returns
+    -------
+    int
+        Number of versions appended
+    """
+    existing: pd.DataFrame = read_dimension(path)
+    known: pd.MultiIndex = pd.MultiIndex.from_frame(existing[["symbol", hash_column]])
+    new: pd.DataFrame = dimension[
+        ~pd.MultiIndex.from_frame(dimension[["symbol", hash_column]]).isin(known)
+    ]
+    if new.empty:
+        logger.info(f"Symbol attributes are unchanged, leaving {path} as is")
+        return 0
+
+    changed: int = int(new["symbol"].isin(existing["symbol"]).sum())
+    combined: pd.DataFrame = (
+        pd.concat([existing, new], ignore_index=True) if len(existing) else new
+    )
+    filesystem, file_path = resolve_filesystem(path)
+    directory: str = file_path.rsplit("/", 1)[0]
+    filesystem.create_dir(directory, recursive=True)
+    # Write next to the table first so that a failure never loses earlier versions
+    tmp_path: str = f"{directory}/_{dimension_file_name}.tmp"
+    pq.write_table(
+        pa.Table.from_pandas(
+            combined.sort_values(["symbol", "first_seen"]), preserve_index=False
+        ),
+        tmp_path,
+        filesystem=filesystem,
+    )
+    filesystem.move(tmp_path, file_path)
+    logger.info(
+        f"Added {len(new)} attribute versions to {path} ({changed} changed, {len(new) - changed} new symbols)"
+    )
+    return len(new)
+
+
+def join_dimension(facts: pd.DataFrame, dimension: pd.DataFrame) -> pd.DataFrame:
+    """
+    Restore the attribute columns of fact rows from the dimension table.
+
+    Rows written before the dimension table was enabled carry their attributes themselves and are
+    returned as they are, so that months mixing both kinds of files can be read at once.
+
+    Parameters
+    ----------
+    facts : pd.DataFrame
+        Fact rows, with or without `attributes_hash`
+    dimension : pd.DataFrame
+        Dimension table, as returned by `read_dimension`
+
+    Returns
+    -------
+    pd.DataFrame
+        KPI rows in the column order of the schema registry
+    """
+    if hash_column not in facts.columns:
+        return facts
+    joined: pd.DataFrame = facts.merge(
+        dimension.drop(columns="first_seen"),
+        on=["symbol", hash_column],
+        how="left",
+        suffixes=("", "_dimension"),
+    )
+    for column in dimension_columns:
+        if f"{column}_dimension" in joined.columns:
+            joined[column] = joined[column].fillna(joined.pop(f"{column}_dimension"))
+    ordered: List[str] = [
+        column.name for column in kpi_columns if column.name in joined.columns
+    ]
+    return joined[
+        ordered
+        + [
+            column
+            for column in joined.columns
+            if column not in ordered and column != hash_column
+        ]
+    ]
+
+
+def read_kpis(path: str, dimension_path: str) -> pd.DataFrame:
+    """
+    Read KPI rows from a fact file or dataset directory and rejoin their attributes.
+
+    Parameters
+    ----------
+    path : str
+        Full s3 url or local path of a Parquet fact file, or of a directory of them, e.g., a dataset partition
+    dimension_path : str
+        Full s3 url or local path of the dimension file
+
+    Returns
+    -------
+    pd.DataFrame
+        KPI rows with every column of the schema registry
+    """
+    filesystem, file_path = resolve_filesystem(path)
+    # Partition keys are encoded in the path only, so they must not become columns
+    facts: pd.DataFrame = pq.read_table(
+        file_path, filesystem=filesystem, partitioning=None
+    ).to_pandas(types_mapper=pandas_dtypes.get)
+    return join_dimension(facts=facts, dimension=read_dimension(dimension_path))
+
+
+def encoded_size(data: pd.DataFrame, parquet: bool = True) -> int:
+    """
+    Return the number of bytes data takes as a Parquet or csv file, without writing it anywhere.
+    """
+    table: pa.Table = pa.Table.from_pandas(data, preserve_index=False)
+    sink: pa.BufferOutputStream = pa.BufferOutputStream()
+    if parquet:
+        pq.write_table(table, sink)
+    else:
+        pacsv.write_csv(table, sink)
+    return sink.tell()
+
+
+def extract_dimension(
+    logger: Logger,
+    data: pd.DataFrame,
+    dimension_path: str,
+    run_date: date,
+    parquet: bool = True,
+) -> Tuple[pd.DataFrame, int]:
+    """
+    Move the attributes of a run's rows to the dimension table and return the fact rows to write.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    data : pd.DataFrame
+        KPI rows of the run
+    dimension_path : str
+        Full s3 url or local path of the dimension file
+    run_date : date
+        Date of the run
+    parquet : bool, optional
+        Format the fact rows are written in, used to measure the bytes saved
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, int]
+        Fact rows, and the number of bytes they take less than the full rows
+    """
+    facts, dimension = split_dimension(data=data, run_date=run_date)
+    update_dimension(logger=logger, dimension=dimension, path=dimension_path)
+    saved: int = encoded_size(data, parquet=parquet) - encoded_size(
+        facts, parquet=parquet
+    )
+    logger.info(
+        f"Moving {', '.join(dimension_columns)} to the dimension table saves {saved / 1024:,.1f} KiB today"
+    )
+    return facts, saved
+
+
+def savings_report(facts_root: str, dimension_path: str) -> List[Dict[str, Any]]:
+    """
+    Measure the bytes saved by every Parquet fact file under a prefix, per day.
+
+    Parameters
+    ----------
+    facts_root : str
+        Full s3 url or local path under which fact files are searched recursively, e.g., the
+        `daily-kpis` prefix or the dataset root
+    dimension_path : str
+        Full s3 url or local path of the dimension file
+
+    Returns
+    -------
+    List[Dict[str, Any]]
+        One entry per day with the bytes of its fact files (`fact_bytes`) and of the same rows with
+        their attributes (`full_bytes`), in date order
+    """
+    filesystem, base = resolve_filesystem(facts_root)
+    dimension: pd.DataFrame = read_dimension(dimension_path)
+    days: Dict[date, Dict[str, Any]] = {}
+    for info in filesystem.get_file_info(
+        pafs.FileSelector(base, recursive=True, allow_not_found=True)
+    ):
+        if info.type != pafs.FileType.File or not info.path.endswith(".parquet"):
+            continue
+        if info.base_name == dimension_file_name:
+            continue
+        facts: pd.DataFrame = pq.read_table(
+            info.path, filesystem=filesystem, partitioning=None
+        ).to_pandas(types_mapper=pandas_dtypes.get)
+        if hash_column not in facts.columns or facts.empty:
+            continue
+        full_bytes: int = encoded_size(join_dimension(facts=facts, dimension=dimension))
+        # Files hold one day, except compacted months, whose bytes are split by rows
+        for day, day_facts in facts.groupby(facts["date"].dt.date):
+            share: float = len(day_facts) / len(facts)
+            entry: Dict[str, Any] = days.setdefault(
+                day, {"date": day, "fact_bytes": 0, "full_bytes": 0}
+            )
+            entry["fact_bytes"] += round(info.size * share)
+            entry["full_bytes"] += round(full_bytes * share)
+    return [days[day] for day in sorted(days)]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Maintain the dimension table of symbol attributes"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser(
+        "report", help="Report the bytes saved by the dimension table per day"
+    )
+    report.add_argument(
+        "--facts",
+        required=True,
+        help="s3 url or local path under which fact files are searched",
+    )
+    report.add_argument(
+        "--dimension", required=True, help="s3 url or local path of the dimension file"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="Symbol Dimension")
+    entries: List[Dict[str, Any]] = savings_report(
+        facts_root=args.facts, dimension_path=args.dimension
+    )
+    if not entries:
+        logger.info(f"No fact files found under {args.facts}")
+        return 0
+    print(
+        f"{'date': <10} {'facts (KiB)': >12} {'full (KiB)': >11} {'saved (KiB)': >12}"
+    )
+    for entry in entries:
+        print(
+            f"{entry['date'].isoformat(): <10} {entry['fact_bytes'] / 1024: >12,.1f} "
+            f"{entry['full_bytes'] / 1024: >11,.1f} {(entry['full_bytes'] - entry['fact_bytes']) / 1024: >12,.1f}"
+        )
+    filesystem, file_path = resolve_filesystem(args.dimension)
+    dimension_bytes: int = filesystem.get_file_info(file_path).size or 0
+    saved: int = sum(entry["full_bytes"] - entry["fact_bytes"] for entry in entries)
+    print(
+        f"Saved {saved / 1024:,.1f} KiB over {len(entries)} days, "
+        f"{(saved - dimension_bytes) / 1024:,.1f} KiB net of the {dimension_bytes / 1024:,.1f} KiB dimension table"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
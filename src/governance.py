@@ -0,0 +1,609 @@
+"""
+Shared governance of upstream HTTP requests.
+
+Every request to an upstream host goes through `RequestGovernor.call` (or `call_async` on an event
+loop), which applies, per host:
+
+* a token bucket that caps the sustained request rate while allowing short bursts,
+* an AIMD concurrency limit that grows by one slot per window of healthy responses and halves
+  on throttling, server errors, or latency above target,
+* a circuit breaker that fails fast once the host keeps failing, probing it again after a cool-down,
+* exponential backoff with full jitter (honoring `Retry-After`) on 429, 5xx, and connection errors,
+
+and counts requests, retries, throttled responses, and failures so that they can be logged per run.
+Requests sent with `call_async` skip the AIMD limit, whose slots block threads; their concurrency is
+capped by the caller instead (see `src.yahoo`).
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from logging import Logger
+from typing import Any, Dict, Optional, Set, Tuple, Type, TypeVar
+
+import requests
+from curl_cffi.requests import exceptions as curl_exceptions
+
+R = TypeVar("R")  # Represents the return type of a governed request
+
+retryable_status_codes: Set[int] = {429, 500, 502, 503, 504}
+# Errors raised before any response arrives, which are worth retrying
+transient_errors: Tuple[Type[Exception], ...] = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    curl_exceptions.ConnectionError,
+    curl_exceptions.Timeout,
+)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to a host whose circuit breaker is open.
+    """
+
+
+def status_code_of(outcome: Any) -> Optional[int]:
+    """
+    Return the HTTP status code carried by a response or by the error a request raised.
+
+    Parameters
+    ----------
+    outcome : Any
+        Response object or exception
+
+    Returns
+    -------
+    Optional[int]
+        Status code, or `None` if the outcome carries none
+    """
+    # Imported here since importing yfinance is slow and only needed once requests are made
+    from yfinance.exceptions import YFRateLimitError
+
+    if isinstance(outcome, YFRateLimitError):
+        return 429
+    if isinstance(outcome, Exception):
+        outcome = getattr(outcome, "response", None)
+    return getattr(outcome, "status_code", None)
+
+
+def retry_after_of(outcome: Any) -> Optional[float]:
+    """
+    Return the delay in seconds requested by the `Retry-After` header of a response, if any.
+
+    Parameters
+    ----------
+    outcome : Any
+        Response object or exception
+
+    Returns
+    -------
+    Optional[float]
+        Requested delay, or `None` if the header is absent or malformed
+    """
+    if isinstance(outcome, Exception):
+        outcome = getattr(outcome, "response", None)
+    value: Optional[str] = (getattr(outcome, "headers", None) or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket that allows `capacity` requests at once and `rate` requests per second sustained.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second
+    capacity : int
+        Maximum number of tokens, i.e., the largest burst
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate: float = rate
+        self.capacity: int = capacity
+        self.tokens: float = float(capacity)
+        self.updated: float = time.monotonic()
+        self.lock: threading.Lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take one token if one is available, without waiting.
+
+        Returns
+        -------
+        float
+            `0.0` if a token was taken, otherwise the seconds until one is available
+        """
+        with self.lock:
+            now: float = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> float:
+        """
+        Take one token, sleeping until one is available.
+
+        Returns
+        -------
+        float
+            Seconds spent waiting
+        """
+        waited: float = 0.0
+        while (delay := self.reserve()) > 0:
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+    async def acquire_async(self) -> float:
+        """
+        Take one token, yielding to the event loop until one is available.
+
+        Returns
+        -------
+        float
+            Seconds spent waiting
+        """
+        waited: float = 0.0
+        while (delay := self.reserve()) > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+        return waited
+
+
+class AimdLimiter(object):
+    """
+    Concurrency limit with additive increase and multiplicative decrease.
+
+    Each healthy response adds `1 / limit` slots, i.e., about one slot per window of `limit`
+    responses. Throttling, server errors, and responses slower than `latency_target` multiply the
+    limit by `decrease_factor`, at most once per `latency_target` so that a burst of failures from
+    requests that were in flight together counts as one congestion signal.
+
+    Parameters
+    ----------
+    initial : int
+        Starting limit
+    maximum : int
+        Upper bound of the limit
+    minimum : int, optional
+        Lower bound of the limit
+    latency_target : float, optional
+        Response time in seconds above which a response counts as congestion
+    decrease_factor : float, optional
+        Factor applied to the limit on congestion
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        maximum: int,
+        minimum: int = 1,
+        latency_target: float = 5.0,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.limit: float = float(min(max(initial, minimum), maximum))
+        self.maximum: int = maximum
+        self.minimum: int = minimum
+        self.latency_target: float = latency_target
+        self.decrease_factor: float = decrease_factor
+        self.in_flight: int = 0
+        self.last_decrease: float = float("-inf")
+        self.condition: threading.Condition = threading.Condition()
+
+    def acquire(self) -> None:
+        """
+        Take a concurrency slot, blocking while the limit is reached.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self, congested: bool, latency: float) -> None:
+        """
+        Return a concurrency slot and adapt the limit to the outcome of the request.
+
+        Parameters
+        ----------
+        congested : bool
+            Whether the request was throttled or failed with a transient error
+        latency : float
+            Response time of the request in seconds
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now: float = time.monotonic()
+            if congested or latency > self.latency_target:
+                if now - self.last_decrease >= self.latency_target:
+                    self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker that opens after `failure_threshold` consecutive failures, rejects requests for
+    `reset_timeout` seconds, then lets a single probe through and closes again if it succeeds.
+
+    Parameters
+    ----------
+    failure_threshold : int, optional
+        Consecutive failures that open the circuit
+    reset_timeout : float, optional
+        Seconds the circuit stays open before a probe is allowed
+    """
+
+    def __init__(
+        self, failure_threshold: int = 10, reset_timeout: float = 30.0
+    ) -> None:
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.failures: int = 0
+        self.opened_at: Optional[float] = None
+        self.probing: bool = False
+        self.lock: threading.Lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Return whether a request may be sent now.
+
+        Returns
+        -------
+        bool
+            `True` when closed, or when open past `reset_timeout` and no other probe is in flight
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if (
+                not self.probing
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.probing = True
+                return True
+            return False
+
+    def record(self, success: bool) -> None:
+        """
+        Record the outcome of a request.
+
+        Parameters
+        ----------
+        success : bool
+            `False` if the request was throttled or failed with a transient error
+        """
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.probing or self.failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+            self.probing = False
+
+
+@dataclass
+class HostStats(object):
+    """
+    Request counters of one host.
+    """
+
+    requests: int = 0
+    retries: int = 0
+    throttled: int = 0
+    failures: int = 0
+    rejected: int = 0
+    throttle_wait: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **increments: float) -> None:
+        """
+        Increment counters by name, safely across threads.
+        """
+        with self.lock:
+            for name, increment in increments.items():
+                setattr(self, name, getattr(self, name) + increment)
+
+
+@dataclass
+class HostState(object):
+    """
+    Rate limiter, concurrency limiter, circuit breaker, and counters of one host.
+    """
+
+    bucket: TokenBucket
+    limiter: AimdLimiter
+    breaker: CircuitBreaker
+    stats: HostStats = field(default_factory=HostStats)
+
+
+class RequestGovernor(object):
+    """
+    Per-host rate limiting, adaptive concurrency, circuit breaking, and retries shared by all upstream requests.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    rate : float, optional
+        Sustained requests per second per host
+    burst : int, optional
+        Largest burst of requests per host
+    max_concurrency : int, optional
+        Upper bound of the adaptive number of requests in flight per host
+    max_retries : int, optional
+        Retries of a request after a 429, 5xx, or connection error
+    base_delay : float, optional
+        Backoff ceiling in seconds of the first retry, doubled on every further retry
+    max_delay : float, optional
+        Upper bound in seconds of any backoff
+    failure_threshold : int, optional
+        Consecutive failures that open the circuit breaker of a host
+    reset_timeout : float, optional
+        Seconds an open circuit breaker rejects requests before probing the host again
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        rate: float = 5.0,
+        burst: int = 10,
+        max_concurrency: int = 8,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        failure_threshold: int = 10,
+        reset_timeout: float = 30.0,
+    ) -> None:
+        self.logger: Logger = logger
+        self.rate: float = rate
+        self.burst: int = burst
+        self.max_concurrency: int = max_concurrency
+        self.max_retries: int = max_retries
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.hosts: Dict[str, HostState] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def host(self, name: str) -> HostState:
+        """
+        Return the state of a host, creating it on first use.
+
+        Parameters
+        ----------
+        name : str
+            Host name
+
+        Returns
+        -------
+        HostState
+            State of the host
+        """
+        with self.lock:
+            if name not in self.hosts:
+                self.hosts[name] = HostState(
+                    bucket=TokenBucket(rate=self.rate, capacity=self.burst),
+                    limiter=AimdLimiter(
+                        initial=self.max_concurrency, maximum=self.max_concurrency
+                    ),
+                    breaker=CircuitBreaker(
+                        failure_threshold=self.failure_threshold,
+                        reset_timeout=self.reset_timeout,
+                    ),
+                )
+            return self.hosts[name]
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """
+        Return the delay before retry number `attempt` (zero-based), with full jitter.
+
+        Parameters
+        ----------
+        attempt : int
+            Zero-based number of the retry
+        retry_after : Optional[float]
+            Delay requested by the host, which is honored up to `max_delay`
+
+        Returns
+        -------
+        float
+            Delay in seconds
+        """
+        delay: float = random.uniform(
+            0, min(self.max_delay, self.base_delay * 2**attempt)
+        )
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def record_outcome(
+        self, state: HostState, attempt: int, result: Any, error: Optional[Exception]
+    ) -> Tuple[bool, Optional[int]]:
+        """
+        Classify the outcome of an attempt and update the circuit breaker and counters of its host.
+
+        Parameters
+        ----------
+        state : HostState
+            State of the host the request went to
+        attempt : int
+            Zero-based number of the attempt
+        result : Any
+            What the request returned, if it did not raise
+        error : Optional[Exception]
+            What the request raised, if anything
+
+        Returns
+        -------
+        Tuple[bool, Optional[int]]
+            Whether the outcome is worth retrying, and its status code
+        """
+        status_code: Optional[int] = status_code_of(
+            error if error is not None else result
+        )
+        transient: bool = status_code in retryable_status_codes or isinstance(
+            error, transient_errors
+        )
+        state.breaker.record(success=not transient)
+        state.stats.add(
+            requests=1,
+            throttled=int(status_code == 429),
+            failures=int(transient and attempt == self.max_retries),
+        )
+        return transient, status_code
+
+    def call(self, host: str, request: Callable[[], R]) -> R:
+        """
+        Send a request through the limits of `host`, retrying throttled and transient failures.
+
+        Parameters
+        ----------
+        host : str
+            Host the request goes to
+        request : Callable[[], R]
+            Function sending the request and returning a response or parsed result
+
+        Returns
+        -------
+        R
+            Result of the last attempt; a response with a retryable status code is returned as is
+            once retries are exhausted
+
+        Raises
+        ------
+        CircuitOpenError
+            If the circuit breaker of the host is open
+        Exception
+            Whatever `request` raised on its last attempt
+        """
+        state: HostState = self.host(host)
+        for attempt in range(self.max_retries + 1):
+            if not state.breaker.allow():
+                state.stats.add(rejected=1)
+                raise CircuitOpenError(f"Circuit breaker for {host} is open")
+            state.stats.add(throttle_wait=state.bucket.acquire())
+            state.limiter.acquire()
+
+            result: Any = None
+            error: Optional[Exception] = None
+            start: float = time.monotonic()
+            try:
+                result = request()
+            except Exception as request_error:
+                error = request_error
+            latency: float = time.monotonic() - start
+
+            transient, status_code = self.record_outcome(
+                state=state, attempt=attempt, result=result, error=error
+            )
+            state.limiter.release(congested=transient, latency=latency)
+
+            if not transient or attempt == self.max_retries:
+                if error is not None:
+                    raise error
+                return result
+
+            delay: float = self.backoff(
+                attempt=attempt,
+                retry_after=retry_after_of(error if error is not None else result),
+            )
+            state.stats.add(retries=1)
+            self.logger.warning(
+                f"Retrying request to {host} in {delay:.2f}s after {status_code or repr(error)} (attempt {attempt + 1} of {self.max_retries})"
+            )
+            time.sleep(delay)
+        # Unreachable, the last attempt always returns or raises
+        raise AssertionError("Retry loop exited without a result")
+
+    async def call_async(self, host: str, request: Callable[[], Awaitable[R]]) -> R:
+        """
+        Send a request from an event loop through the rate limit, circuit breaker, and retries of `host`.
+
+        Parameters
+        ----------
+        host : str
+            Host the request goes to
+        request : Callable[[], Awaitable[R]]
+            Coroutine function sending the request and returning a response or parsed result
+
+        Returns
+        -------
+        R
+            Result of the last attempt; a response with a retryable status code is returned as is
+            once retries are exhausted
+
+        Raises
+        ------
+        CircuitOpenError
+            If the circuit breaker of the host is open
+        Exception
+            Whatever `request` raised on its last attempt
+        """
+        state: HostState = self.host(host)
+        for attempt in range(self.max_retries + 1):
+            if not state.breaker.allow():
+                state.stats.add(rejected=1)
+                raise CircuitOpenError(f"Circuit breaker for {host} is open")
+            state.stats.add(throttle_wait=await state.bucket.acquire_async())
+
+            result: Any = None
+            error: Optional[Exception] = None
+            try:
+                result = await request()
+            except Exception as request_error:
+                error = request_error
+
+            transient, status_code = self.record_outcome(
+                state=state, attempt=attempt, result=result, error=error
+            )
+            if not transient or attempt == self.max_retries:
+                if error is not None:
+                    raise error
+                return result
+
+            delay: float = self.backoff(
+                attempt=attempt,
+                retry_after=retry_after_of(error if error is not None else result),
+            )
+            state.stats.add(retries=1)
+            self.logger.warning(
+                f"Retrying request to {host} in {delay:.2f}s after {status_code or repr(error)} (attempt {attempt + 1} of {self.max_retries})"
+            )
+            await asyncio.sleep(delay)
+        # Unreachable, the last attempt always returns or raises
+        raise AssertionError("Retry loop exited without a result")
+
+    def log_stats(self) -> None:
+        """
+        Log the request counters of every host.
+        """
+        for name, state in self.hosts.items():
+            stats: HostStats = state.stats
+            self.logger.info(
+                f"Request stats for {name}: {stats.requests} requests, {stats.retries} retries, "
+                f"{stats.throttled} throttled, {stats.failures} failures, {stats.rejected} rejected by the circuit breaker, "
+                f"{stats.throttle_wait:.1f}s waiting for the rate limit, concurrency limit {int(state.limiter.limit)}"
+            )
@@ -0,0 +1,482 @@
+"""
+Manifest of the daily KPI objects under the `daily-kpis/` prefix.
+
+Finding which days exist, and in which format, otherwise takes a listing of the whole prefix.
+Instead, every write of a daily object records it in `<root>/_manifest.jsonl.gz`, one JSON line per
+object with
+
+* `date`, `path` (full url), `format` (`parquet` or `csv`), `rows`, and `bytes`,
+* `symbol_count`: the number of distinct symbols of the object,
+* `stats`: `[min, max]` of `symbol` and of every numeric and date column that has values,
+* `written_at`: when the entry was recorded.
+
+Entries stay the same size whatever the number of symbols, since every write rewrites the whole
+manifest; readers prune days by the `symbol` range of `stats` and rely on the row-group statistics
+of the objects for the symbols themselves.
+
+Readers resolve a date range with a single GET of the manifest. Updates are a read-modify-write
+guarded by the object's ETag (S3 conditional writes), retried when another writer got in between,
+so that concurrent writers never drop each other's entries. The first write of a prefix seeds the
+manifest from a listing, so that objects written before the manifest existed are recorded too. The
+root may be an s3 url or a local path, which stands in for s3 when testing. `repair` rebuilds the
+manifest from a listing, e.g., for objects written by other tools.
+
+Usage
+-----
+python -m src.manifest repair --root s3://bucket/daily-kpis
+"""
+
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import date, datetime
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from src.dataset import resolve_filesystem
+from src.schema import pandas_dtypes
+from src.utils import s3_client, setup_logger, split_s3_path
+
+manifest_file_name: str = "_manifest.jsonl.gz"
+daily_file_pattern: re.Pattern = re.compile(
+    r"^etf_kpis_(\d{4})_(\d{2})_(\d{2})\.(parquet|csv)$"
+)
+max_update_attempts: int = 5
+
+
+def parse_daily_file_name(name: str) -> Optional[Tuple[date, str]]:
+    """
+    Return the date and format of a daily object from its file name.
+
+    Parameters
+    ----------
+    name : str
+        Base name of the object, e.g., `etf_kpis_2024_06_28.parquet`
+
+    Returns
+    -------
+    Optional[Tuple[date, str]]
+        Date and `parquet` or `csv`, or `None` if the name is not the one of a daily object
+    """
+    match: Optional[re.Match] = daily_file_pattern.match(name)
+    if not match:
+        return None
+    try:
+        day: date = date(int(match[1]), int(match[2]), int(match[3]))
+    except ValueError:
+        return None
+    return day, match[4]
+
+
+def describe_frame(data: pd.DataFrame, path: str, size: int) -> Dict[str, Any]:
+    """
+    Build the manifest entry of a daily object from the rows written to it.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Rows of the object
+    path : str
+        Full s3 url or local path of the object, including the extension
+    size : int
+        Size of the object in bytes
+
+    Returns
+    -------
+    Dict[str, Any]
+        Manifest entry
+    """
+    parsed: Optional[Tuple[date, str]] = parse_daily_file_name(path.rsplit("/", 1)[-1])
+    if parsed is None:
+        raise ValueError(f"{path} is not named like a daily KPI object")
+    day, file_format = parsed
+    stats: Dict[str, List[Any]] = {}
+    for column in data.columns:
+        values: pd.Series = data[column].dropna()
+        if values.empty:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(values):
+            stats[column] = [
+                values.min().date().isoformat(),
+                values.max().date().isoformat(),
+            ]
+        elif pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(
+            values
+        ):
+            stats[column] = [float(values.min()), float(values.max())]
+        elif column == "symbol":
+            stats[column] = [str(values.min()), str(values.max())]
+    return {
+        "date": day.isoformat(),
+        "path": path,
+        "format": file_format,
+        "rows": len(data),
+        "bytes": size,
+        "symbol_count": int(data["symbol"].nunique())
+        if "symbol" in data.columns
+        else 0,
+        "stats": stats,
+        "written_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def describe_file(path: str) -> Dict[str, Any]:
+    """
+    Build the manifest entry of a daily object by reading it.
+
+    Parameters
+    ----------
+    path : str
+        Full s3 url or local path of the object, including the extension
+
+    Returns
+    -------
+    Dict[str, Any]
+        Manifest entry
+    """
+    # Imported here since `src.reader` resolves files through this module
+    from src.reader import read_csv_file
+
+    filesystem, file_path = resolve_filesystem(path)
+    size: int = filesystem.get_file_info(file_path).size
+    if path.endswith(".parquet"):
+        data: pd.DataFrame = pq.read_table(
+            file_path, filesystem=filesystem, partitioning=None
+        ).to_pandas(types_mapper=pandas_dtypes.get)
+    else:
+        data = read_csv_file(
+            path=file_path, filesystem=filesystem, columns=None, symbols=None
+        ).to_pandas(types_mapper=pandas_dtypes.get)
+    return describe_frame(data=data, path=path, size=size)
+
+
+def list_daily_paths(root: str) -> List[str]:
+    """
+    List the daily objects of a prefix.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the prefix
+
+    Returns
+    -------
+    List[str]
+        Full s3 url or local path of each daily object, in name order
+    """
+    filesystem, base = resolve_filesystem(root)
+    return sorted(
+        f"{root.rstrip('/')}/{info.base_name}"
+        for info in filesystem.get_file_info(
+            pafs.FileSelector(base, allow_not_found=True)
+        )
+        if info.type == pafs.FileType.File and parse_daily_file_name(info.base_name)
+    )
+
+
+def may_hold_symbols(entry: Dict[str, Any], symbols: List[str]) -> bool:
+    """
+    Return whether the object of a manifest entry may hold any of `symbols`.
+
+    Parameters
+    ----------
+    entry : Dict[str, Any]
+        Manifest entry
+    symbols : List[str]
+        Symbols looked for
+
+    Returns
+    -------
+    bool
+        `False` only if none of `symbols` is within the `symbol` range of the object
+    """
+    # Entries recorded before the manifest only kept counts list every symbol, until a repair
+    listed: Optional[List[str]] = entry.get("symbols")
+    if listed is not None:
+        return not set(symbols).isdisjoint(listed)
+    bounds: Optional[List[str]] = entry["stats"].get("symbol")
+    if bounds is None:
+        return False
+    return any(bounds[0] <= symbol <= bounds[1] for symbol in symbols)
+
+
+def load_manifest(root: str) -> Tuple[Dict[str, Dict[str, Any]], Optional[str]]:
+    """
+    Read the manifest of a prefix along with the version it was read at.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the prefix, e.g., `s3://bucket/daily-kpis`
+
+    Returns
+    -------
+    Tuple[Dict[str, Dict[str, Any]], Optional[str]]
+        Entries by object path, and the ETag (or local file version) of the manifest, `None` if
+        there is no manifest yet
+    """
+    body: bytes
+    version: str
+    if root.startswith("s3://"):
+        from botocore.exceptions import ClientError
+
+        bucket, key = split_s3_path(f"{root.rstrip('/')}/{manifest_file_name}")
+        try:
+            response: Dict[str, Any] = s3_client().get_object(Bucket=bucket, Key=key)
+        except ClientError as client_error:
+            if client_error.response["Error"]["Code"] in {"NoSuchKey", "404"}:
+                return {}, None
+            raise
+        body, version = response["Body"].read(), response["ETag"]
+    else:
+        local_path: Path = Path(root) / manifest_file_name
+        if not local_path.exists():
+            return {}, None
+        stat: os.stat_result = local_path.stat()
+        body, version = local_path.read_bytes(), f"{stat.st_mtime_ns}-{stat.st_size}"
+    entries: Dict[str, Dict[str, Any]] = {}
+    for line in gzip.decompress(body).decode("utf-8").splitlines():
+        if line:
+            entry: Dict[str, Any] = json.loads(line)
+            entries[entry["path"]] = entry
+    return entries, version
+
+
+def store_manifest(
+    root: str, entries: Dict[str, Dict[str, Any]], version: Optional[str]
+) -> bool:
+    """
+    Write the manifest of a prefix unless it changed since it was read at `version`.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the prefix
+    entries : Dict[str, Dict[str, Any]]
+        Entries by object path
+    version : Optional[str]
+        Version returned by `load_manifest`, `None` if there was no manifest
+
+    Returns
+    -------
+    bool
+        `True` if the manifest was written, `False` if another writer updated it in between
+    """
+    body: bytes = gzip.compress(
+        "".join(
+            f"{json.dumps(entry, separators=(',', ':'))}\n"
+            for entry in sorted(
+                entries.values(), key=lambda entry: (entry["date"], entry["path"])
+            )
+        ).encode("utf-8")
+    )
+    if root.startswith("s3://"):
+        from botocore.exceptions import ClientError
+
+        bucket, key = split_s3_path(f"{root.rstrip('/')}/{manifest_file_name}")
+        try:
+            # S3 rejects the write with 412 if the object changed or appeared since it was read
+            s3_client().put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=body,
+                **({"IfMatch": version} if version else {"IfNoneMatch": "*"}),
+            )
+        except ClientError as client_error:
+            if client_error.response["Error"]["Code"] in {
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            }:
+                return False
+            raise
+        return True
+
+    local_path: Path = Path(root) / manifest_file_name
+    _, current = load_manifest(root)
+    if current != version:
+        return False
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path: Path = local_path.with_name(f"{manifest_file_name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(body)
+    os.replace(tmp_path, local_path)
+    return True
+
+
+def update_manifest(
+    root: str, entries: List[Dict[str, Any]], replace: bool = False
+) -> int:
+    """
+    Add or replace entries of the manifest of a prefix, retrying if other writers interleave.
+
+    If the prefix has no manifest yet, it is created with an entry for every daily object already
+    there, since readers take the manifest as the full list of objects.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the prefix
+    entries : List[Dict[str, Any]]
+        Entries to record, replacing the ones of the same paths
+    replace : bool, optional
+        `True` to drop every existing entry, as a repair does
+
+    Returns
+    -------
+    int
+        Number of entries in the manifest after the update
+    """
+    # Described once, since a conflicting writer creates the manifest with its own seed anyway
+    seed: Optional[Dict[str, Dict[str, Any]]] = None
+    for _ in range(max_update_attempts):
+        existing, version = load_manifest(root)
+        merged: Dict[str, Dict[str, Any]] = {} if replace else existing
+        if version is None and not replace:
+            if seed is None:
+                recorded: Set[str] = {entry["path"] for entry in entries}
+                seed = {
+                    path: describe_file(path)
+                    for path in list_daily_paths(root)
+                    if path not in recorded
+                }
+            merged.update(seed)
+        merged.update({entry["path"]: entry for entry in entries})
+        if store_manifest(root=root, entries=merged, version=version):
+            return len(merged)
+    raise RuntimeError(
+        f"The manifest of {root} changed during {max_update_attempts} update attempts"
+    )
+
+
+def record_frame(data: pd.DataFrame, path: str, size: int) -> None:
+    """
+    Record a daily object written from a DataFrame in the manifest of its prefix.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Rows written
+    path : str
+        Full s3 url or local path of the object, including the extension
+    size : int
+        Size of the object in bytes
+
+    Returns
+    -------
+    None
+    """
+    update_manifest(
+        root=path.rsplit("/", 1)[0],
+        entries=[describe_frame(data=data, path=path, size=size)],
+    )
+    return None
+
+
+def record_file(path: str) -> None:
+    """
+    Record a daily object in the manifest of its prefix by reading it, e.g., after streaming it.
+
+    Parameters
+    ----------
+    path : str
+        Full s3 url or local path of the object, including the extension
+
+    Returns
+    -------
+    None
+    """
+    update_manifest(root=path.rsplit("/", 1)[0], entries=[describe_file(path)])
+    return None
+
+
+def resolve_days(
+    root: str, start: Optional[date] = None, end: Optional[date] = None
+) -> Optional[Dict[date, Dict[str, Any]]]:
+    """
+    Return the manifest entry of each day of a date range, the Parquet object if a day has both formats.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the prefix
+    start : Optional[date], optional
+        First day to include, the earliest if `None`
+    end : Optional[date], optional
+        Last day to include, the latest if `None`
+
+    Returns
+    -------
+    Optional[Dict[date, Dict[str, Any]]]
+        Entries by date in date order, or `None` if the prefix has no manifest, in which case callers
+        fall back to listing it
+    """
+    entries, version = load_manifest(root)
+    if version is None:
+        return None
+    days: Dict[date, Dict[str, Any]] = {}
+    for entry in entries.values():
+        day: date = date.fromisoformat(entry["date"])
+        if (start and day < start) or (end and day > end):
+            continue
+        if day not in days or entry["format"] == "parquet":
+            days[day] = entry
+    return dict(sorted(days.items()))
+
+
+def repair_manifest(logger: Logger, root: str) -> int:
+    """
+    Rebuild the manifest of a prefix from a listing of its daily objects.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    root : str
+        Full s3 url or local path of the prefix
+
+    Returns
+    -------
+    int
+        Number of entries in the rebuilt manifest
+    """
+    previous, _ = load_manifest(root)
+    entries: List[Dict[str, Any]] = [
+        describe_file(path) for path in list_daily_paths(root)
+    ]
+    recorded: int = update_manifest(root=root, entries=entries, replace=True)
+    found: Set[str] = {entry["path"] for entry in entries}
+    logger.info(
+        f"Rebuilt the manifest of {root} with {recorded} objects "
+        f"({len(found - previous.keys())} were missing, {len(previous.keys() - found)} were stale)"
+    )
+    return recorded
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Maintain the daily KPI manifest")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    repair = subparsers.add_parser(
+        "repair", help="Rebuild the manifest from a listing of the prefix"
+    )
+    repair.add_argument(
+        "--root", required=True, help="s3 url or local path of the daily-kpis prefix"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="KPI Manifest")
+    repair_manifest(logger=logger, root=args.root)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+Run metrics emitted as CloudWatch Embedded Metric Format (EMF) log lines.
+
+Stages are timed with the `stage` context manager or the `timed` decorator, individual observations
+(e.g., per-ticker latency) with `observe`, and counters with `count`. `flush` prints everything
+recorded as JSON lines on stdout, which CloudWatch Logs turns into metrics without any API calls.
+
+Usage
+-----
+python main.py | python -m src.metrics
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, Iterator, List, Optional, ParamSpec, TextIO, TypeVar
+
+P = ParamSpec("P")  # Captures the parameter types of a timed callable
+R = TypeVar("R")  # Represents the return type of a timed callable
+
+# CloudWatch accepts at most 100 values per metric and 100 metrics per EMF line
+max_values_per_metric: int = 100
+max_metrics_per_line: int = 100
+
+
+class MetricsRecorder(object):
+    """
+    Thread-safe recorder of run metrics that flushes them as EMF JSON lines.
+
+    Parameters
+    ----------
+    namespace : str, optional
+        CloudWatch namespace of the metrics
+    dimensions : Optional[Dict[str, str]], optional
+        Dimensions attached to every metric
+    enabled : bool, optional
+        `False` to record nothing and emit nothing, so that instrumented code needs no checks
+    stream : TextIO, optional
+        Stream the EMF lines are written to
+    """
+
+    def __init__(
+        self,
+        namespace: str = "ETFKPIsScraper",
+        dimensions: Optional[Dict[str, str]] = None,
+        enabled: bool = True,
+        stream: TextIO = sys.stdout,
+    ) -> None:
+        self.namespace: str = namespace
+        self.dimensions: Dict[str, str] = dimensions or {}
+        self.enabled: bool = enabled
+        self.stream: TextIO = stream
+        self.values: Dict[str, List[float]] = defaultdict(list)
+        self.units: Dict[str, str] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def observe(self, name: str, value: float, unit: str = "Milliseconds") -> None:
+        """
+        Record one value of a metric, all values of a metric are emitted so CloudWatch can compute percentiles.
+
+        Parameters
+        ----------
+        name : str
+            Metric name
+        value : float
+            Observed value
+        unit : str, optional
+            CloudWatch unit of the metric
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            self.values[name].append(value)
+            self.units[name] = unit
+
+    def count(self, name: str, value: float = 1, unit: str = "Count") -> None:
+        """
+        Add to a counter.
+
+        Parameters
+        ----------
+        name : str
+            Metric name
+        value : float, optional
+            Increment
+        unit : str, optional
+            CloudWatch unit of the metric
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            values: List[float] = self.values[name]
+            if values:
+                values[0] += value
+            else:
+                values.append(value)
+            self.units[name] = unit
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a stage as `<name>Duration`, counting `<name>Errors` if it raises.
+
+        Parameters
+        ----------
+        name : str
+            Stage name in PascalCase
+
+        Yields
+        ------
+        None
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count(f"{name}Errors")
+            raise
+        finally:
+            self.observe(f"{name}Duration", (time.perf_counter() - start) * 1e3)
+
+    def timed(self, name: str) -> Callable[[Callable[P, R]], Callable[P, R]]:
+        """
+        Decorator that times every call of a function as a stage.
+
+        Parameters
+        ----------
+        name : str
+            Stage name in PascalCase
+
+        Returns
+        -------
+        Callable[[Callable[P, R]], Callable[P, R]]
+            Decorator
+        """
+
+        def decorator(function: Callable[P, R]) -> Callable[P, R]:
+            @wraps(function)
+            def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+                with self.stage(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def flush(self) -> None:
+        """
+        Write everything recorded so far as EMF lines and reset the recorder.
+        """
+        if not self.enabled:
+            return
+        with self.lock:
+            values: Dict[str, List[float]] = dict(self.values)
+            self.values.clear()
+        # Metrics with more values than fit one line are spread over several lines
+        chunks: List[Dict[str, Any]] = [{}]
+        for name, observed in values.items():
+            for start in range(0, len(observed), max_values_per_metric):
+                line: Optional[Dict[str, Any]] = next(
+                    (
+                        chunk
+                        for chunk in chunks
+                        if name not in chunk and len(chunk) < max_metrics_per_line
+                    ),
+                    None,
+                )
+                if line is None:
+                    line = {}
+                    chunks.append(line)
+                chunk_values: List[float] = [
+                    round(value, 3)
+                    for value in observed[start : start + max_values_per_metric]
+                ]
+                line[name] = chunk_values[0] if len(chunk_values) == 1 else chunk_values
+        timestamp: int = int(time.time() * 1e3)
+        for chunk in chunks:
+            if not chunk:
+                continue
+            document: Dict[str, Any] = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [list(self.dimensions)],
+                            "Metrics": [
+                                {"Name": name, "Unit": self.units[name]}
+                                for name in chunk
+                            ],
+                        }
+                    ],
+                },
+                **self.dimensions,
+                **chunk,
+            }
+            self.stream.write(json.dumps(document) + "\n")
+        self.stream.flush()
+
+
+def parse_emf_lines(lines: Iterator[str]) -> Dict[str, List[float]]:
+    """
+    Collect the metric values of the EMF lines among arbitrary log lines.
+
+    Parameters
+    ----------
+    lines : Iterator[str]
+        Log lines, e.g., the stdout of a run
+
+    Returns
+    -------
+    Dict[str, List[float]]
+        All values of each metric
+    """
+    collected: Dict[str, List[float]] = defaultdict(list)
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            document: Dict[str, Any] = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        for directive in document.get("_aws", {}).get("CloudWatchMetrics", []):
+            for metric in directive["Metrics"]:
+                value: Any = document.get(metric["Name"])
+                collected[metric["Name"]].extend(
+                    value if isinstance(value, list) else [value]
+                )
+    return collected
+
+
+def main() -> int:
+    collected: Dict[str, List[float]] = parse_emf_lines(sys.stdin)
+    print(f"{'metric': <28} {'count': >7} {'sum': >12} {'p50': >10} {'max': >10}")
+    for name, values in sorted(collected.items()):
+        ordered: List[float] = sorted(values)
+        print(
+            f"{name: <28} {len(ordered): >7} {sum(ordered): >12,.1f} "
+            f"{ordered[len(ordered) // 2]: >10,.1f} {ordered[-1]: >10,.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
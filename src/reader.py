@@ -0,0 +1,331 @@
+"""
+Reader of the daily KPI outputs written by `write_to_s3` under the `daily-kpis/` prefix.
+
+`load_kpis` resolves the `etf_kpis_YYYY_MM_DD` objects of a date range from the manifest of the
+prefix (see `src.manifest`), or from the file names of a listing, so that other days (and, with the
+manifest, days whose symbol range holds no requested symbol) are never opened, and reads them through Arrow with
+
+* column projection, so that unrequested columns (e.g., `business_summary`) are never decoded,
+* predicate pushdown of the symbol subset, so that row groups whose `symbol` statistics exclude
+  every requested symbol are skipped; files sorted by symbol, such as merged shard output, benefit most,
+* memory-mapped reads of local files, optionally after caching s3 objects in a local directory.
+
+Parquet and the legacy csv outputs can be mixed in one range, Parquet winning if a day has both.
+
+Usage
+-----
+python -m src.reader --root s3://bucket/daily-kpis --start 2024-06-01 --end 2024-06-28 --symbols SPY QQQM --columns symbol date previous_close
+"""
+
+import argparse
+import sys
+from datetime import date, datetime
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+from src.dataset import resolve_filesystem
+from src.manifest import may_hold_symbols, parse_daily_file_name, resolve_days
+from src.schema import derived_columns, kpi_columns, pandas_dtypes
+from src.utils import setup_logger
+
+# Arrow type of each registered column, which csv values are parsed as
+csv_column_types: Dict[str, pa.DataType] = {
+    column.name: column.arrow_type for column in [*kpi_columns, *derived_columns]
+}
+
+
+def list_daily_files(
+    root: str, start: date, end: date, symbols: Optional[List[str]] = None
+) -> List[Tuple[date, pafs.FileInfo]]:
+    """
+    Return the daily output files of a date range, one per day.
+
+    Files are resolved from the manifest of the prefix (see `src.manifest`) with a single request,
+    or from a listing if the prefix has no manifest.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the prefix holding the `etf_kpis_YYYY_MM_DD` files
+    start : date
+        First day to include
+    end : date
+        Last day to include
+    symbols : Optional[List[str]], optional
+        Symbols of which a day may hold at least one, judged by the symbol range the manifest
+        records, so only applied to days in the manifest
+
+    Returns
+    -------
+    List[Tuple[date, pafs.FileInfo]]
+        Day and file of each day with output, in date order, the Parquet file if a day has both formats
+    """
+    filesystem, base = resolve_filesystem(root)
+    recorded: Optional[Dict[date, Dict[str, Any]]] = resolve_days(
+        root=root, start=start, end=end
+    )
+    if recorded is not None:
+        return [
+            (
+                day,
+                pafs.FileInfo(
+                    f"{base}/{entry['path'].rsplit('/', 1)[-1]}",
+                    type=pafs.FileType.File,
+                    size=entry["bytes"],
+                ),
+            )
+            for day, entry in recorded.items()
+            if not symbols or may_hold_symbols(entry=entry, symbols=symbols)
+        ]
+
+    files: Dict[date, pafs.FileInfo] = {}
+    for info in filesystem.get_file_info(pafs.FileSelector(base, allow_not_found=True)):
+        parsed: Optional[Tuple[date, str]] = parse_daily_file_name(info.base_name)
+        if info.type != pafs.FileType.File or parsed is None:
+            continue
+        day, file_format = parsed
+        if start <= day <= end and (day not in files or file_format == "parquet"):
+            files[day] = info
+    return sorted(files.items())
+
+
+def cache_locally(
+    files: List[pafs.FileInfo], filesystem: pafs.FileSystem, cache_dir: Path
+) -> List[str]:
+    """
+    Copy files to a local directory unless a copy of the same size is already there.
+
+    Parameters
+    ----------
+    files : List[pafs.FileInfo]
+        Files to cache
+    filesystem : pafs.FileSystem
+        Filesystem the files are on
+    cache_dir : Path
+        Local directory of the copies
+
+    Returns
+    -------
+    List[str]
+        Local paths of the copies, in the order of `files`
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    local: pafs.LocalFileSystem = pafs.LocalFileSystem()
+    paths: List[str] = []
+    for info in files:
+        path: Path = (cache_dir / info.base_name).resolve()
+        # Past days are only rewritten by reruns, which change the size in all but rare cases
+        if not path.exists() or path.stat().st_size != info.size:
+            pafs.copy_files(
+                info.path,
+                str(path),
+                source_filesystem=filesystem,
+                destination_filesystem=local,
+            )
+        paths.append(str(path))
+    return paths
+
+
+def read_csv_file(
+    path: str,
+    filesystem: pafs.FileSystem,
+    columns: Optional[List[str]],
+    symbols: Optional[List[str]],
+) -> pa.Table:
+    """
+    Read a legacy csv output file, projecting and filtering it like the Parquet files.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file within `filesystem`
+    filesystem : pafs.FileSystem
+        Filesystem the file is on
+    columns : Optional[List[str]]
+        Columns to keep, all but the pandas index if `None`
+    symbols : Optional[List[str]]
+        Symbols to keep, all if `None`
+
+    Returns
+    -------
+    pa.Table
+        Rows of the file
+    """
+    with filesystem.open_input_stream(path) as stream:
+        table: pa.Table = pacsv.read_csv(
+            stream,
+            convert_options=pacsv.ConvertOptions(
+                column_types=csv_column_types,
+                include_columns=(
+                    list(dict.fromkeys([*columns, "symbol"])) if columns else None
+                ),
+                include_missing_columns=True,
+                strings_can_be_null=True,
+            ),
+        )
+    # `to_csv` writes the index as an unnamed first column
+    table = table.drop_columns([name for name in table.column_names if name == ""])
+    if symbols:
+        table = table.filter(pc.is_in(table["symbol"], value_set=pa.array(symbols)))
+    return table.select(columns) if columns else table
+
+
+def load_kpis(
+    root: str,
+    start: date,
+    end: date,
+    symbols: Optional[List[str]] = None,
+    columns: Optional[List[str]] = None,
+    cache_dir: Optional[Path] = None,
+    dimension_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Load the daily outputs of a date range, reading only the requested columns and symbols.
+
+    Parameters
+    ----------
+    root : str
+        Full s3 url or local path of the prefix holding the `etf_kpis_YYYY_MM_DD` files, e.g.,
+        `s3://bucket/daily-kpis`
+    start : date
+        First day to load
+    end : date
+        Last day to load
+    symbols : Optional[List[str]], optional
+        Symbols to load, all if `None`
+    columns : Optional[List[str]], optional
+        Columns to load, all if `None`; columns missing from some days are null for those days
+    cache_dir : Optional[Path], optional
+        Local directory s3 objects are copied to and memory-mapped from, read in place if `None`
+    dimension_path : Optional[str], optional
+        Full s3 url or local path of the dimension table (see `src.dimension`) to rejoin static
+        attributes from, for days written with it
+
+    Returns
+    -------
+    pd.DataFrame
+        Rows sorted by date and symbol, with the nullable dtypes of the schema registry
+    """
+    filesystem, _ = resolve_filesystem(root)
+    listed: List[Tuple[date, pafs.FileInfo]] = list_daily_files(
+        root=root, start=start, end=end, symbols=symbols
+    )
+    infos: List[pafs.FileInfo] = [info for _, info in listed]
+    paths: List[str] = [info.path for info in infos]
+    if isinstance(filesystem, pafs.LocalFileSystem) or cache_dir is not None:
+        if cache_dir is not None and not isinstance(filesystem, pafs.LocalFileSystem):
+            paths = cache_locally(
+                files=infos, filesystem=filesystem, cache_dir=cache_dir
+            )
+        # Pages of a memory-mapped file are read on access, so skipped row groups are never read
+        filesystem = pafs.LocalFileSystem(use_mmap=True)
+
+    read_columns: Optional[List[str]] = columns
+    if dimension_path and columns:
+        from src.dimension import hash_column
+
+        read_columns = list(dict.fromkeys([*columns, "symbol", hash_column]))
+
+    tables: List[pa.Table] = []
+    parquet_paths: List[str] = [path for path in paths if path.endswith(".parquet")]
+    if parquet_paths:
+        dataset: ds.Dataset = ds.dataset(
+            parquet_paths, format="parquet", filesystem=filesystem
+        )
+        # Days written with other columns (e.g., before the dimension table) are unified, not dropped
+        dataset = ds.dataset(
+            parquet_paths,
+            schema=pa.unify_schemas(
+                [fragment.physical_schema for fragment in dataset.get_fragments()],
+                promote_options="permissive",
+            ),
+            format="parquet",
+            filesystem=filesystem,
+        )
+        tables.append(
+            dataset.to_table(
+                columns=[
+                    column for column in read_columns if column in dataset.schema.names
+                ]
+                if read_columns
+                else None,
+                filter=pc.field("symbol").isin(symbols) if symbols else None,
+            )
+        )
+    for path in paths:
+        if path.endswith(".csv"):
+            tables.append(
+                read_csv_file(
+                    path=path,
+                    filesystem=filesystem,
+                    columns=read_columns,
+                    symbols=symbols,
+                )
+            )
+    if not tables:
+        return pd.DataFrame(columns=columns or [column.name for column in kpi_columns])
+
+    data: pd.DataFrame = pa.concat_tables(
+        tables, promote_options="permissive"
+    ).to_pandas(types_mapper=pandas_dtypes.get)
+    if dimension_path:
+        from src.dimension import join_dimension, read_dimension
+
+        data = join_dimension(facts=data, dimension=read_dimension(dimension_path))
+    if columns:
+        data = data.reindex(columns=columns)
+    sort_keys: List[str] = [key for key in ("date", "symbol") if key in data.columns]
+    return data.sort_values(sort_keys, ignore_index=True) if sort_keys else data
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Load daily KPI outputs of a date range into a Parquet file or stdout"
+    )
+    parser.add_argument(
+        "--root", required=True, help="s3 url or local path of the daily-kpis prefix"
+    )
+    parser.add_argument("--start", required=True, help="First day as YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="Last day as YYYY-MM-DD")
+    parser.add_argument("--symbols", nargs="+")
+    parser.add_argument("--columns", nargs="+")
+    parser.add_argument("--cache-dir", type=Path)
+    parser.add_argument(
+        "--dimension", help="s3 url or local path of the dimension file"
+    )
+    parser.add_argument(
+        "--output", help="Parquet file to write, prints a summary if omitted"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="KPI Reader")
+    data: pd.DataFrame = load_kpis(
+        root=args.root,
+        start=datetime.strptime(args.start, "%Y-%m-%d").date(),
+        end=datetime.strptime(args.end, "%Y-%m-%d").date(),
+        symbols=args.symbols,
+        columns=args.columns,
+        cache_dir=args.cache_dir,
+        dimension_path=args.dimension,
+    )
+    logger.info(f"Loaded {len(data)} rows with columns {list(data.columns)}")
+    if args.output:
+        data.to_parquet(args.output, index=False)
+    else:
+        print(data)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+from dataclasses import dataclass
+from datetime import date, datetime, time
+from typing import Any, Dict, List, Optional, Self
+
+import pandas as pd
+import pyarrow as pa
+
+# Pandas dtype of each Arrow type used by the registry, `None` keeps the default conversion
+pandas_dtypes: Dict[pa.DataType, pd.api.extensions.ExtensionDtype] = {
+    pa.string(): pd.StringDtype(),
+    pa.float64(): pd.Float64Dtype(),
+}
+# Athena/Glue type of each Arrow type used by the registry
+athena_types: Dict[pa.DataType, str] = {
+    pa.string(): "string",
+    pa.float64(): "double",
+    pa.timestamp("ns"): "timestamp",
+}
+
+
+@dataclass(frozen=True)
+class Column(object):
+    """
+    Declaration of one output column.
+
+    Parameters
+    ----------
+    name : str
+        Name of the output column
+    source : Optional[str]
+        Key of the `info` dictionary the value is extracted from, `None` for columns set by the scraper
+    arrow_type : pa.DataType
+        Type of the column in Arrow and Parquet
+    nullable : bool
+        Whether the column may hold nulls; rows with a null in a non-nullable column are dropped
+    source_type : Optional[pa.DataType]
+        Type of the raw `info` values when it differs from `arrow_type`, e.g. epoch milliseconds
+    """
+
+    name: str
+    source: Optional[str]
+    arrow_type: pa.DataType
+    nullable: bool = True
+    source_type: Optional[pa.DataType] = None
+
+
+# Single source of truth for the output columns, in output order; adding a KPI is a one-line change
+kpi_columns: List[Column] = [
+    Column("symbol", "symbol", pa.string(), nullable=False),
+    Column(
+        "first_trade_date",
+        "firstTradeDateMilliseconds",
+        pa.timestamp("ns"),
+        source_type=pa.timestamp("ms"),
+    ),
+    Column("business_summary", "longBusinessSummary", pa.string()),
+    Column("previous_close", "previousClose", pa.float64()),
+    Column("nav_price", "navPrice", pa.float64()),
+    Column("dividend_yield", "dividendYield", pa.float64()),
+    Column("net_expense_ratio", "netExpenseRatio", pa.float64()),
+    Column("trailing_pe", "trailingPE", pa.float64()),
+    Column("volume", "volume", pa.float64()),
+    Column("average_volume", "averageVolume", pa.float64()),
+    Column("bid", "bid", pa.float64()),
+    Column("bid_size", "bidSize", pa.float64()),
+    Column("ask_size", "askSize", pa.float64()),
+    Column("ask", "ask", pa.float64()),
+    Column("category", "category", pa.string()),
+    Column("beta_three_year", "beta3Year", pa.float64()),
+    Column("ytd_return", "ytdReturn", pa.float64()),
+    Column("three_year_avg_return", "threeYearAverageReturn", pa.float64()),
+    Column("five_year_avg_return", "fiveYearAverageReturn", pa.float64()),
+    Column("date", None, pa.timestamp("ns"), nullable=False),
+]
+# Columns computed from the scraped ones by `src.derived`, appended after `kpi_columns` when enabled
+derived_columns: List[Column] = [
+    Column("bid_ask_spread", None, pa.float64()),
+    Column("relative_volume", None, pa.float64()),
+    Column("nav_premium", None, pa.float64()),
+    Column("change_5d", None, pa.float64()),
+    Column("change_20d", None, pa.float64()),
+    Column("change_60d", None, pa.float64()),
+]
+kpi_schema: pa.Schema = pa.schema(
+    [
+        pa.field(column.name, column.arrow_type, column.nullable)
+        for column in kpi_columns
+    ]
+)
+
+
+def athena_dtypes(columns: List[str]) -> Dict[str, str]:
+    """
+    Return the Athena/Glue type of each registered column among `columns`, for explicit Parquet schemas.
+
+    Parameters
+    ----------
+    columns : List[str]
+        Column names of the data being written
+
+    Returns
+    -------
+    Dict[str, str]
+        Mapping of column name to Athena/Glue type
+    """
+    return {
+        column.name: athena_types[column.arrow_type]
+        for column in [*kpi_columns, *derived_columns]
+        if column.name in columns
+    }
+
+
+def build_row(info: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extract the registered columns from a (merged) `info` dictionary.
+
+    Parameters
+    ----------
+    info : Dict[str, Any]
+        The `info` dictionary of a ticker
+
+    Returns
+    -------
+    Dict[str, Any]
+        Row keyed by output column, with `None` for fields missing from `info`
+    """
+    return {
+        column.name: info.get(column.source)
+        for column in kpi_columns
+        if column.source is not None
+    }
+
+
+def column_array(values: List[Any], column: Column) -> pa.Array:
+    """
+    Convert the raw values of a column to an Arrow array, nulling values that do not fit its type.
+
+    Parameters
+    ----------
+    values : List[Any]
+        Raw values, e.g. of one `info` key across tickers
+    column : Column
+        Registered column the values belong to
+
+    Returns
+    -------
+    pa.Array
+        Array of type `column.arrow_type`
+    """
+    source_type: pa.DataType = column.source_type or column.arrow_type
+    try:
+        return pa.array(values, type=source_type).cast(column.arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # A single malformed value, e.g. a string in a numeric field, must not abort the whole batch
+        pass
+    if pa.types.is_string(source_type):
+        return pa.array(
+            [
+                value if value is None or isinstance(value, str) else str(value)
+                for value in values
+            ],
+            type=source_type,
+        ).cast(column.arrow_type)
+    numeric: pd.Series = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+    if pa.types.is_floating(source_type):
+        return pa.array(numeric, type=source_type, from_pandas=True).cast(
+            column.arrow_type
+        )
+    # Integer sources, e.g. epoch milliseconds of timestamps
+    return (
+        pa.array(numeric.round().astype(pd.Int64Dtype()), type=pa.int64())
+        .cast(source_type)
+        .cast(column.arrow_type)
+    )
+
+
+class ColumnBuffers(object):
+    """
+    Typed columnar buffers that rows are appended to and converted to Arrow or pandas without a post-hoc cast.
+
+    Parameters
+    ----------
+    run_date : date
+        Value of the `date` column of every row
+    """
+
+    def __init__(self, run_date: date) -> None:
+        self.date: datetime = datetime.combine(run_date, time())
+        self.values: Dict[str, List[Any]] = {
+            column.name: [] for column in kpi_columns if column.source is not None
+        }
+        self.required: List[str] = [
+            column.name
+            for column in kpi_columns
+            if column.source is not None and not column.nullable
+        ]
+        self.dropped: int = 0
+
+    def __len__(self) -> int:
+        return len(next(iter(self.values.values())))
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict[str, Any]], run_date: date) -> Self:
+        """
+        Build buffers holding the given rows.
+
+        Parameters
+        ----------
+        rows : List[Dict[str, Any]]
+            Rows keyed by output column
+        run_date : date
+            Value of the `date` column of every row
+
+        Returns
+        -------
+        ColumnBuffers
+            Buffers holding the rows
+        """
+        buffers: Self = cls(run_date=run_date)
+        for row in rows:
+            buffers.append(row)
+        return buffers
+
+    def append(self, row: Dict[str, Any]) -> None:
+        """
+        Append a row keyed by output column, rows with a null in a non-nullable column are dropped.
+
+        Parameters
+        ----------
+        row : Dict[str, Any]
+            Row keyed by output column
+        """
+        if any(row.get(name) is None for name in self.required):
+            self.dropped += 1
+            return
+        for name, values in self.values.items():
+            values.append(row.get(name))
+
+    def clear(self) -> None:
+        """
+        Empty the buffers.
+        """
+        for values in self.values.values():
+            values.clear()
+
+    def to_table(self) -> pa.Table:
+        """
+        Convert the buffered rows to an Arrow table with `kpi_schema`.
+
+        Returns
+        -------
+        pa.Table
+            Table of the buffered rows
+        """
+        arrays: List[pa.Array] = []
+        for column in kpi_columns:
+            if column.source is None:
+                arrays.append(pa.array([self.date] * len(self), type=column.arrow_type))
+                continue
+            arrays.append(column_array(self.values[column.name], column))
+        return pa.Table.from_arrays(arrays, schema=kpi_schema)
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Convert the buffered rows to a DataFrame with nullable pandas dtypes.
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame of the buffered rows
+        """
+        return self.to_table().to_pandas(types_mapper=pandas_dtypes.get)
@@ -0,0 +1,414 @@
+import threading
+from collections.abc import Callable
+from functools import partial
+from logging import Logger
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from curl_cffi import CurlInfo, CurlOpt
+from curl_cffi import requests as curl_requests
+from curl_cffi.requests.session import HttpMethod
+from requests.adapters import HTTPAdapter
+
+from src.cassette import (
+    Cassette,
+    CassetteAdapter,
+    CassetteAsyncSession,
+    build_curl_response,
+    exchange_key,
+)
+from src.governance import R, RequestGovernor
+
+# Host name the governor keeps the limits of Yahoo Finance under; requests go to several
+# `queryN.finance.yahoo.com` hosts that share one rate limit upstream
+yahoo_host: str = "finance.yahoo.com"
+# Public endpoints of the cookie and crumb handshake, used when yfinance's own cannot be
+yahoo_cookie_url: str = "https://fc.yahoo.com"
+yahoo_crumb_url: str = "https://query1.finance.yahoo.com/v1/test/getcrumb"
+# Range of yfinance releases, from inclusive to exclusive, whose private cookie and crumb members of
+# `YfData` the helpers below were checked against; other releases take the public handshake
+yfinance_crumb_versions: Tuple[Tuple[int, ...], Tuple[int, ...]] = ((0, 2, 65), (0, 3))
+
+
+def curl_info(response: curl_requests.Response, info: CurlInfo) -> int:
+    """
+    Return a curl info of a response, or 0 if the session did not collect it.
+
+    `Response.infos` is keyed by `CurlInfo` at runtime, although `curl_cffi` annotates it as keyed
+    by `str`.
+    """
+    infos: Dict[Any, Any] = response.infos
+    return infos.get(info, 0)
+
+
+class ReuseCountingSession(curl_requests.Session):
+    """
+    `curl_cffi` session, as required by yfinance, that counts how many requests had to open a new
+    connection, and how many bytes and seconds its responses took.
+
+    With a governor, every request is sent through it, including the cookie, crumb, and retry
+    requests yfinance sends inside a single `Ticker.info`, so that the rate and concurrency limits
+    apply to actual HTTP requests.
+
+    `curl_cffi` keeps one curl handle, and thus one connection cache, per thread, so each worker
+    thread reuses its own keep-alive connections.
+
+    Parameters
+    ----------
+    compression : bool, optional
+        `False` to ask for uncompressed responses
+    cassette : Optional[Cassette], optional
+        Cassette the exchanges are recorded to or replayed from (see `src.cassette`), including
+        those of the async sessions it opens
+    governor : Optional[RequestGovernor], optional
+        Governor that rate limits and retries every request, or `None` to send them as is
+    host : str, optional
+        Host the governor keeps the limits of this session's requests under
+    **kwargs : Any
+        Keyword arguments of `curl_cffi.requests.Session`
+    """
+
+    def __init__(
+        self,
+        compression: bool = True,
+        cassette: Optional[Cassette] = None,
+        governor: Optional[RequestGovernor] = None,
+        host: str = yahoo_host,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(
+            curl_infos=[CurlInfo.NUM_CONNECTS, CurlInfo.SIZE_DOWNLOAD_T], **kwargs
+        )
+        self.compression: bool = compression
+        self.cassette: Optional[Cassette] = cassette
+        self.governor: Optional[RequestGovernor] = governor
+        self.host: str = host
+        self.requests_sent: int = 0
+        self.connections_opened: int = 0
+        # Response bytes as received, i.e., before decompression
+        self.bytes_received: int = 0
+        self.request_seconds: float = 0.0
+        self.counter_lock: threading.Lock = threading.Lock()
+
+    # Keyword arguments are passed through as is rather than repeating the parent's long signature
+    def request(  # type: ignore[override]
+        self, method: HttpMethod, url: str, **kwargs: Any
+    ) -> curl_requests.Response:
+        if not self.compression:
+            kwargs.setdefault("accept_encoding", None)
+        send: Callable[[], curl_requests.Response] = partial(
+            self.send_attempt, method, url, **kwargs
+        )
+        if self.governor is None:
+            return send()
+        return self.governor.call(host=self.host, request=send)
+
+    def send_attempt(
+        self, method: HttpMethod, url: str, **kwargs: Any
+    ) -> curl_requests.Response:
+        """
+        Send one attempt of a request, through the cassette if any, and count it.
+
+        Parameters
+        ----------
+        method : HttpMethod
+            HTTP method
+        url : str
+            Url of the request
+        **kwargs : Any
+            Keyword arguments of `curl_cffi.requests.Session.request`
+
+        Returns
+        -------
+        curl_requests.Response
+            The response, whatever its status code
+        """
+        response: curl_requests.Response = (
+            self.cassette.send(
+                key=exchange_key(
+                    method=method,
+                    url=url,
+                    params=kwargs.get("params"),
+                    body=kwargs.get("json") or kwargs.get("data"),
+                ),
+                send=partial(super().request, method, url, **kwargs),
+                build=partial(build_curl_response, url=url),
+            )
+            if self.cassette is not None
+            else super().request(method, url, **kwargs)
+        )
+        with self.counter_lock:
+            self.requests_sent += 1
+            self.connections_opened += curl_info(response, CurlInfo.NUM_CONNECTS)
+            self.bytes_received += curl_info(response, CurlInfo.SIZE_DOWNLOAD_T)
+            self.request_seconds += response.elapsed.total_seconds()
+        return response
+
+    def async_session(self, **kwargs: Any) -> curl_requests.AsyncSession:
+        """
+        Open an async session going through the same cassette as this session, if any.
+
+        Parameters
+        ----------
+        **kwargs : Any
+            Keyword arguments of `curl_cffi.requests.AsyncSession`
+
+        Returns
+        -------
+        curl_requests.AsyncSession
+            The async session
+        """
+        if self.cassette is not None:
+            return CassetteAsyncSession(cassette=self.cassette, **kwargs)
+        return curl_requests.AsyncSession(**kwargs)
+
+
+def govern_yahoo_call(
+    governor: RequestGovernor,
+    session: Optional[curl_requests.Session],
+    request: Callable[[], R],
+) -> R:
+    """
+    Send a call making Yahoo Finance requests through `governor`, unless `session` already sends
+    each of its requests through a governor, which nesting would count twice.
+
+    Parameters
+    ----------
+    governor : RequestGovernor
+        Governor that rate limits and retries the call
+    session : Optional[curl_requests.Session]
+        Session the call sends its requests with
+    request : Callable[[], R]
+        Function making the call
+
+    Returns
+    -------
+    R
+        Result of the call
+    """
+    if isinstance(session, ReuseCountingSession) and session.governor is not None:
+        return request()
+    return governor.call(host=yahoo_host, request=request)
+
+
+class HttpSessions(object):
+    """
+    Pooled keep-alive sessions shared by all upstream calls of a run: a `requests` session for
+    Alpha Vantage and a `curl_cffi` session injected into `yf.Tickers`.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    pool_size : int, optional
+        Maximum number of connections kept open per host, should be at least the number of worker threads
+    keep_alive : bool, optional
+        `False` to close every connection after its request, for comparison
+    compression : bool, optional
+        `False` to ask for uncompressed responses
+    cassette : Optional[Cassette], optional
+        Cassette the exchanges of both sessions are recorded to or replayed from, see `src.cassette`
+    governor : Optional[RequestGovernor], optional
+        Governor every request of the `curl_cffi` session is sent through, see `ReuseCountingSession`
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        compression: bool = True,
+        cassette: Optional[Cassette] = None,
+        governor: Optional[RequestGovernor] = None,
+    ) -> None:
+        self.logger: Logger = logger
+        self.http: requests.Session = requests.Session()
+        self.adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        if cassette is not None:
+            cassette_adapter: CassetteAdapter = CassetteAdapter(
+                cassette=cassette, adapter=self.adapter
+            )
+            self.http.mount("https://", cassette_adapter)
+            self.http.mount("http://", cassette_adapter)
+        else:
+            self.http.mount("https://", self.adapter)
+            self.http.mount("http://", self.adapter)
+
+        curl_options: Dict[CurlOpt, Any] = {CurlOpt.MAXCONNECTS: pool_size}
+        if keep_alive:
+            curl_options[CurlOpt.TCP_KEEPALIVE] = 1
+        else:
+            self.http.headers["Connection"] = "close"
+            curl_options[CurlOpt.FORBID_REUSE] = 1
+        if not compression:
+            self.http.headers["Accept-Encoding"] = "identity"
+        self.yahoo: ReuseCountingSession = ReuseCountingSession(
+            compression=compression,
+            cassette=cassette,
+            governor=governor,
+            impersonate="chrome",
+            curl_options=curl_options,
+        )
+
+    def log_stats(self) -> None:
+        """
+        Log how many requests each session sent and how many connections it had to open for them.
+        """
+        http_requests: int = 0
+        http_connections: int = 0
+        # One urllib3 connection pool per host, which counts the connections it created
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            http_requests += pools[key].num_requests
+            http_connections += pools[key].num_connections
+        for name, sent, opened in (
+            ("requests", http_requests, http_connections),
+            ("yfinance", self.yahoo.requests_sent, self.yahoo.connections_opened),
+        ):
+            reuse: float = 1 - opened / sent if sent else 0.0
+            self.logger.info(
+                f"Connection stats for the {name} session: {sent} requests over {opened} new connections ({reuse:.0%} reused)"
+            )
+        self.logger.info(
+            f"The yfinance session received {self.yahoo.bytes_received / 1024:,.0f} KiB in {self.yahoo.request_seconds:.1f}s of requests"
+        )
+
+    def close(self) -> None:
+        """
+        Close both sessions and their pooled connections.
+        """
+        self.http.close()
+        self.yahoo.close()
+
+
+def yfinance_crumb_supported() -> bool:
+    """
+    Return whether the installed yfinance keeps its cookie and crumb where `yahoo_crumb` reads them.
+
+    Returns
+    -------
+    bool
+        `True` if the release is in `yfinance_crumb_versions` and has the expected members
+    """
+    import re
+
+    import yfinance
+    from yfinance.data import YfData
+
+    version: Tuple[int, ...] = tuple(
+        int(part) for part in re.findall(r"\d+", yfinance.__version__)[:3]
+    )
+    low, high = yfinance_crumb_versions
+    return low <= version < high and all(
+        hasattr(YfData, name) for name in ("_get_cookie_and_crumb", "_set_session")
+    )
+
+
+def yahoo_crumb(
+    logger: Logger,
+    governor: RequestGovernor,
+    session: Optional[curl_requests.Session] = None,
+    refresh: bool = False,
+) -> Tuple[str, curl_requests.Session]:
+    """
+    Return a Yahoo Finance crumb and the session holding the cookie it is tied to.
+
+    The crumb yfinance holds is reused, so that its own requests and ours share one handshake. This
+    reads private members of yfinance's `YfData`, which is only done for the releases of
+    `yfinance_crumb_versions`; with any other release, the handshake is sent with `session`.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    governor : RequestGovernor
+        Governor that rate limits and retries the handshake
+    session : Optional[curl_requests.Session], optional
+        yfinance's session, yfinance's default session is used if `None`
+    refresh : bool, optional
+        `True` to get a new cookie and crumb instead of reusing the ones yfinance holds
+
+    Returns
+    -------
+    Tuple[str, curl_requests.Session]
+        The crumb and the session whose cookies go with it
+
+    Raises
+    ------
+    ValueError
+        If Yahoo Finance returned no crumb
+    """
+    crumb: Optional[str]
+    if yfinance_crumb_supported():
+        from yfinance.data import YfData
+
+        yf_data: YfData = YfData(session=session)
+        if refresh:
+            yf_data._cookie, yf_data._crumb = None, None
+        session = yf_data._session
+        # Fetches the cookie into yfinance's session unless yfinance already holds one
+        crumb, _ = govern_yahoo_call(
+            governor=governor, session=session, request=yf_data._get_cookie_and_crumb
+        )
+    else:
+        logger.warning(
+            "The installed yfinance is not one the crumb helpers were checked against, "
+            "sending the cookie and crumb handshake outside of yfinance"
+        )
+        handshake_session: curl_requests.Session = session or curl_requests.Session(
+            impersonate="chrome"
+        )
+
+        def handshake() -> str:
+            # Only sets the cookie, the page itself answers with an error status
+            handshake_session.get(yahoo_cookie_url, allow_redirects=True, timeout=30)
+            response: curl_requests.Response = handshake_session.get(
+                yahoo_crumb_url, allow_redirects=True, timeout=30
+            )
+            if response.status_code != 200:
+                raise ValueError(
+                    f"Yahoo Finance answered the crumb request with status {response.status_code}"
+                )
+            return response.text
+
+        session = handshake_session
+        crumb = govern_yahoo_call(governor=governor, session=session, request=handshake)
+    if not crumb or "<html>" in crumb:
+        raise ValueError(f"Yahoo Finance returned no crumb: {crumb!r}")
+    return crumb, session
+
+
+def seed_yahoo_crumb(
+    logger: Logger, session: Optional[curl_requests.Session], crumb: str
+) -> bool:
+    """
+    Make yfinance use `crumb` without a handshake, e.g., when its requests go to a stub or a replayed cassette.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    session : Optional[curl_requests.Session]
+        Session yfinance sends its requests with
+    crumb : str
+        Crumb to use
+
+    Returns
+    -------
+    bool
+        `True` if yfinance was seeded, `False` if the installed yfinance is not one of
+        `yfinance_crumb_versions`, which then sends the handshake on its first request
+    """
+    if not yfinance_crumb_supported():
+        logger.warning(
+            "The installed yfinance is not one the crumb helpers were checked against, "
+            "it will send its own cookie and crumb handshake"
+        )
+        return False
+    from yfinance.data import YfData
+
+    yf_data: YfData = YfData(session=session)
+    yf_data._cookie, yf_data._crumb = True, crumb
+    return True
@@ -0,0 +1,560 @@
+"""
+Deterministic sharding of the scraped symbols across parallel Fargate tasks.
+
+Each task is started with `SHARD_INDEX` and `SHARD_COUNT` container overrides (see
+`lambda/lambda_function.py`), scrapes only the symbols whose hash falls in its shard, and writes
+its rows to its own part file, followed by a done marker (shards without any rows only write the
+marker). Once every shard of the day is done, the task that finishes last commits the parts: they
+are merged into the day's regular output (a `daily-kpis/` object or the dataset partition) and deleted.
+
+All shards must scrape the same gainers, so only `snapshot_shard` requests the Alpha Vantage
+snapshot and shares it under the day's prefix; the other shards wait for it and never call Alpha
+Vantage. A relaunched designated shard reuses the shared snapshot instead of requesting a new one.
+
+A shard that crashes never writes its done marker, which leaves the day uncommitted (a hung
+shard is stopped by the task timeout, and writes what it has, see `src.deadline`). `status` lists
+the shards that are not done, which can be relaunched with `{"shards": [...]}` (see
+`lambda/lambda_function.py`), or given up on with `commit --allow-missing`.
+
+Layout
+------
+`s3://<bucket>/shards/etf_kpis_YYYY_MM_DD/part-III-of-NNN.(parquet|csv)` and `done-III-of-NNN`
+per shard, the shared `top_gainers_losers.json` snapshot, plus a `_COMMIT` marker, both created
+with a conditional write, so that only one of several tasks finishing at once commits.
+
+Usage
+-----
+python -m src.sharding status --bucket <bucket> --date 2024-06-28 --shard-count 4
+python -m src.sharding commit --bucket <bucket> --date 2024-06-28 --shard-count 4 --force
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import zlib
+from collections.abc import Callable
+from datetime import date, datetime
+from logging import Logger
+from typing import Any, Dict, List, Optional
+
+from src.utils import s3_client, setup_logger, split_s3_path, write_to_s3
+
+commit_marker_name: str = "_COMMIT"
+snapshot_file_name: str = "top_gainers_losers.json"
+# Shard that requests the Alpha Vantage snapshot of a sharded run, which the other shards only read
+snapshot_shard: int = 0
+
+
+def shard_of(symbol: str, shard_count: int) -> int:
+    """
+    Return the shard of a symbol, with a hash that is stable across processes and runs.
+
+    The hash is the one `src.dataset` buckets symbols with, so that with as many shards as
+    `SYMBOL_BUCKETS`, each shard fills exactly one bucket.
+
+    Parameters
+    ----------
+    symbol : str
+        Ticker symbol
+    shard_count : int
+        Number of shards
+
+    Returns
+    -------
+    int
+        Shard index in `[0, shard_count)`
+    """
+    return zlib.crc32(symbol.encode()) % shard_count
+
+
+def select_shard(symbols: List[str], shard_index: int, shard_count: int) -> List[str]:
+    """
+    Keep the symbols of one shard, in their original order.
+
+    Parameters
+    ----------
+    symbols : List[str]
+        Ticker symbols of the whole run
+    shard_index : int
+        Index of the shard to keep
+    shard_count : int
+        Number of shards, `1` keeps every symbol
+
+    Returns
+    -------
+    List[str]
+        Symbols of the shard
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} is not in [0, {shard_count})")
+    return [
+        symbol for symbol in symbols if shard_of(symbol, shard_count) == shard_index
+    ]
+
+
+def shard_prefix(s3_bucket: str, run_date: date) -> str:
+    """
+    Return the full s3 url of the prefix the part files of a day are written under.
+    """
+    return f"s3://{s3_bucket}/shards/etf_kpis_{run_date.strftime('%Y_%m_%d')}"
+
+
+def part_path(
+    s3_bucket: str, run_date: date, shard_index: int, shard_count: int
+) -> str:
+    """
+    Return the full s3 url of a shard's part file, excluding the file extension as `write_to_s3` expects.
+    """
+    return f"{shard_prefix(s3_bucket, run_date)}/part-{shard_index:03d}-of-{shard_count:03d}"
+
+
+def mark_shard_done(
+    s3_bucket: str, run_date: date, shard_index: int, shard_count: int
+) -> None:
+    """
+    Record that a shard has written its part, or that it had no rows to write.
+
+    Parameters
+    ----------
+    s3_bucket : str
+        Bucket of the run
+    run_date : date
+        Date of the run
+    shard_index : int
+        Index of the shard
+    shard_count : int
+        Number of shards
+
+    Returns
+    -------
+    None
+    """
+    bucket, key = split_s3_path(
+        f"{shard_prefix(s3_bucket, run_date)}/done-{shard_index:03d}-of-{shard_count:03d}"
+    )
+    s3_client().put_object(Bucket=bucket, Key=key, Body=b"")
+    return None
+
+
+def list_shard_files(
+    s3_bucket: str, run_date: date, shard_count: int, kind: str
+) -> List[str]:
+    """
+    Return the full s3 urls of the part files or done markers written so far for a day and shard count.
+
+    Parameters
+    ----------
+    s3_bucket : str
+        Bucket of the run
+    run_date : date
+        Date of the run
+    shard_count : int
+        Number of shards, files written with a different count are ignored
+    kind : str
+        `part` or `done`
+
+    Returns
+    -------
+    List[str]
+        Files in shard order
+    """
+    bucket, prefix = split_s3_path(f"{shard_prefix(s3_bucket, run_date)}/{kind}-")
+    suffix: str = f"-of-{shard_count:03d}"
+    parts: List[str] = []
+    for page in (
+        s3_client()
+        .get_paginator("list_objects_v2")
+        .paginate(Bucket=bucket, Prefix=prefix)
+    ):
+        for entry in page.get("Contents", []):
+            if entry["Key"].rsplit(".", 1)[0].endswith(suffix):
+                parts.append(f"s3://{bucket}/{entry['Key']}")
+    return sorted(parts)
+
+
+def missing_shards(s3_bucket: str, run_date: date, shard_count: int) -> List[int]:
+    """
+    Return the shards of a day that have not written their done marker yet.
+
+    Parameters
+    ----------
+    s3_bucket : str
+        Bucket of the run
+    run_date : date
+        Date of the run
+    shard_count : int
+        Number of shards
+
+    Returns
+    -------
+    List[int]
+        Indices of the shards that are not done
+    """
+    done: List[str] = list_shard_files(s3_bucket, run_date, shard_count, "done")
+    done_indices: List[int] = [
+        int(path.rsplit("/", 1)[-1].split("-")[1]) for path in done
+    ]
+    return [index for index in range(shard_count) if index not in done_indices]
+
+
+def put_if_absent(s3_path: str, body: bytes) -> bool:
+    """
+    Create an s3 object unless it exists, which only one concurrent caller can succeed at.
+
+    Parameters
+    ----------
+    s3_path : str
+        Full s3 url of the object
+    body : bytes
+        Content of the object
+
+    Returns
+    -------
+    bool
+        `True` if this caller created the object
+    """
+    from botocore.exceptions import ClientError
+
+    bucket, key = split_s3_path(s3_path)
+    try:
+        # S3 rejects the write with 412 if the key exists, atomically across writers
+        s3_client().put_object(Bucket=bucket, Key=key, Body=body, IfNoneMatch="*")
+    except ClientError as client_error:
+        if client_error.response["Error"]["Code"] in {
+            "PreconditionFailed",
+            "ConditionalRequestConflict",
+        }:
+            return False
+        raise
+    return True
+
+
+def claim_commit(s3_bucket: str, run_date: date) -> bool:
+    """
+    Create the commit marker of a day unless it exists, which only one concurrent caller can succeed at.
+
+    Parameters
+    ----------
+    s3_bucket : str
+        Bucket of the run
+    run_date : date
+        Date of the run
+
+    Returns
+    -------
+    bool
+        `True` if this caller created the marker and should commit
+    """
+    return put_if_absent(
+        s3_path=f"{shard_prefix(s3_bucket, run_date)}/{commit_marker_name}",
+        body=datetime.now().isoformat().encode(),
+    )
+
+
+def read_shared_snapshot(s3_bucket: str, run_date: date) -> Optional[Dict[str, Any]]:
+    """
+    Return the Alpha Vantage snapshot shared with the shards of a day, if it was shared yet.
+
+    Parameters
+    ----------
+    s3_bucket : str
+        Bucket of the run
+    run_date : date
+        Date of the run
+
+    Returns
+    -------
+    Optional[Dict[str, Any]]
+        The snapshot, or `None` if it does not exist
+    """
+    from botocore.exceptions import ClientError
+
+    bucket, key = split_s3_path(
+        f"{shard_prefix(s3_bucket, run_date)}/{snapshot_file_name}"
+    )
+    try:
+        body: bytes = s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+    except ClientError as client_error:
+        if client_error.response["Error"]["Code"] in {"404", "NoSuchKey"}:
+            return None
+        raise
+    return json.loads(body)
+
+
+def shared_gainers_losers(
+    logger: Logger,
+    s3_bucket: str,
+    run_date: date,
+    shard_index: int,
+    fetch: Callable[[], Dict[str, Any]],
+    timeout: float = 600.0,
+    poll_interval: float = 5.0,
+) -> Dict[str, Any]:
+    """
+    Return the Alpha Vantage snapshot every shard of a day scrapes the gainers of.
+
+    `snapshot_shard` fetches it, unless it already shared one, and shares it under the day's
+    prefix; the other shards wait for it to be shared.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    s3_bucket : str
+        Bucket of the run
+    run_date : date
+        Date of the run
+    shard_index : int
+        Index of the calling shard
+    fetch : Callable[[], Dict[str, Any]]
+        Function returning the snapshot from Alpha Vantage, only called by `snapshot_shard`
+    timeout : float, optional
+        Seconds the other shards wait for the snapshot to be shared
+    poll_interval : float, optional
+        Seconds between two checks for the snapshot
+
+    Returns
+    -------
+    Dict[str, Any]
+        The shared snapshot
+
+    Raises
+    ------
+    TimeoutError
+        If the snapshot was not shared within `timeout` seconds
+    """
+    shared: Optional[Dict[str, Any]] = read_shared_snapshot(s3_bucket, run_date)
+    if shared is not None:
+        logger.info(f"Reusing the Alpha Vantage snapshot shared on {run_date}")
+        return shared
+    if shard_index == snapshot_shard:
+        snapshot: Dict[str, Any] = fetch()
+        if put_if_absent(
+            s3_path=f"{shard_prefix(s3_bucket, run_date)}/{snapshot_file_name}",
+            body=json.dumps(snapshot).encode(),
+        ):
+            logger.info("Shared the Alpha Vantage snapshot with the other shards")
+            return snapshot
+        # Another launch of this shard shared one first, which the other shards may already use
+        return read_shared_snapshot(s3_bucket, run_date) or snapshot
+
+    logger.info(
+        f"Waiting up to {timeout:.0f}s for shard {snapshot_shard} to share the Alpha Vantage snapshot"
+    )
+    started: float = time.monotonic()
+    while time.monotonic() - started < timeout:
+        time.sleep(poll_interval)
+        shared = read_shared_snapshot(s3_bucket, run_date)
+        if shared is not None:
+            return shared
+    raise TimeoutError(
+        f"Shard {snapshot_shard} did not share the Alpha Vantage snapshot within {timeout:.0f}s"
+    )
+
+
+def commit_shards(
+    logger: Logger,
+    s3_bucket: str,
+    run_date: date,
+    shard_count: int,
+    s3_path: str,
+    parquet: bool = True,
+    dataset: bool = False,
+    bucket_count: int = 0,
+    force: bool = False,
+    dimension_path: Optional[str] = None,
+    cdc_root: Optional[str] = None,
+    snapshot_every: int = 7,
+    allow_missing: bool = False,
+) -> Optional[int]:
+    """
+    Merge the part files of a day into its regular output once all shards have written theirs.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    s3_bucket : str
+        Bucket of the run
+    run_date : date
+        Date of the run
+    shard_count : int
+        Number of shards the day was scraped with
+    s3_path : str
+        Full s3 url of the merged output, as passed to `write_to_s3`
+    parquet : bool, optional
+        `True` if the parts and the output are Parquet, `False` for csv
+    dataset : bool, optional
+        `True` to write the merged rows into the dataset rooted at `s3_path`
+    bucket_count : int, optional
+        Number of symbol buckets per day in dataset mode
+    force : bool, optional
+        `True` to commit even if the marker exists, e.g., after a commit that failed midway
+    dimension_path : Optional[str], optional
+        Full s3 url of the dimension table the static attributes of the merged rows are moved to
+        (see `src.dimension`), or `None` to keep them in the output
+    cdc_root : Optional[str], optional
+        Full s3 url of the CDC root the merged rows are written to as a snapshot or change set
+        (see `src.cdc`) instead of `s3_path`, or `None` to write them to `s3_path`
+    snapshot_every : int, optional
+        Days between full snapshots in CDC mode
+    allow_missing : bool, optional
+        `True` to commit the parts written so far even if some shards are not done, e.g., after
+        a shard crashed; the symbols of those shards are left out of the day
+
+    Returns
+    -------
+    Optional[int]
+        Number of bytes written, or `None` if parts are missing or another task is committing
+    """
+    done: List[str] = list_shard_files(s3_bucket, run_date, shard_count, "done")
+    if len(done) < shard_count and allow_missing:
+        logger.warning(
+            f"Committing without shards {missing_shards(s3_bucket, run_date, shard_count)}, which are not done"
+        )
+    elif len(done) < shard_count:
+        logger.info(
+            f"{len(done)} of {shard_count} shards are done, leaving the commit to the last one"
+        )
+        return None
+    if not claim_commit(s3_bucket, run_date) and not force:
+        logger.info("Another shard is committing the parts")
+        return None
+
+    import awswrangler as wr
+    import pandas as pd
+
+    parts: List[str] = list_shard_files(s3_bucket, run_date, shard_count, "part")
+    logger.info(f"Committing {len(parts)} parts to {s3_path}")
+    bytes_written: int = 0
+    rows: int = 0
+    if parts:
+        data: pd.DataFrame = (
+            wr.s3.read_parquet(path=parts, dtype_backend="numpy_nullable")
+            if parquet
+            else wr.s3.read_csv(path=parts, index_col=0)
+        )
+        data = data.sort_values("symbol").reset_index(drop=True)
+        rows = len(data)
+        if dimension_path:
+            from src.dimension import extract_dimension
+
+            data, _ = extract_dimension(
+                logger=logger,
+                data=data,
+                dimension_path=dimension_path,
+                run_date=run_date,
+                parquet=parquet,
+            )
+        if cdc_root:
+            from src.cdc import write_cdc
+
+            _, bytes_written = write_cdc(
+                logger=logger,
+                data=data,
+                root=cdc_root,
+                run_date=run_date,
+                snapshot_every=snapshot_every,
+            )
+        else:
+            bytes_written = write_to_s3(
+                data=data,
+                s3_path=s3_path,
+                parquet=parquet,
+                dataset=dataset,
+                bucket_count=bucket_count,
+                manifest=True,
+            )
+    # The commit marker goes last so that a failed cleanup is retried by a forced commit
+    wr.s3.delete_objects(
+        path=parts
+        + done
+        + [f"{shard_prefix(s3_bucket, run_date)}/{snapshot_file_name}"]
+    )
+    wr.s3.delete_objects(
+        path=f"{shard_prefix(s3_bucket, run_date)}/{commit_marker_name}"
+    )
+    logger.info(
+        f"Committed {rows} rows from {len(parts)} parts of {shard_count} shards"
+    )
+    return bytes_written
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Manage sharded scraper runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    commit = subparsers.add_parser(
+        "commit", help="Merge the part files of a day into its regular output"
+    )
+    commit.add_argument("--bucket", default=os.getenv("S3_BUCKET"))
+    commit.add_argument("--date", required=True, help="Date of the run as YYYY-MM-DD")
+    commit.add_argument("--shard-count", type=int, required=True)
+    commit.add_argument(
+        "--force",
+        action="store_true",
+        help="Commit even if the commit marker of the day exists",
+    )
+    commit.add_argument(
+        "--allow-missing",
+        action="store_true",
+        help="Commit the parts written so far even if some shards are not done",
+    )
+    status = subparsers.add_parser(
+        "status", help="List the shards of a day that are not done"
+    )
+    status.add_argument("--bucket", default=os.getenv("S3_BUCKET"))
+    status.add_argument("--date", required=True, help="Date of the run as YYYY-MM-DD")
+    status.add_argument("--shard-count", type=int, required=True)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="Shard Commit")
+    if not args.bucket:
+        logger.error("[ERROR] Pass --bucket or set the S3_BUCKET environment variable")
+        return 1
+    run_date: date = datetime.strptime(args.date, "%Y-%m-%d").date()
+    if args.command == "status":
+        missing: List[int] = missing_shards(args.bucket, run_date, args.shard_count)
+        if missing:
+            logger.info(
+                f"Shards {missing} of {args.shard_count} are not done, relaunch them with "
+                f'{{"shards": {missing}}} or commit without them with --allow-missing'
+            )
+        else:
+            logger.info(f"All {args.shard_count} shards are done")
+        return 0
+    # Same output settings as `main.py`
+    parquet: bool = os.getenv("PARQUET") == "True"
+    dataset: bool = os.getenv("DATASET") == "True"
+    committed: Optional[int] = commit_shards(
+        logger=logger,
+        s3_bucket=args.bucket,
+        run_date=run_date,
+        shard_count=args.shard_count,
+        s3_path=(
+            f"s3://{args.bucket}/kpis-dataset"
+            if dataset
+            else f"s3://{args.bucket}/daily-kpis/etf_kpis_{run_date.strftime('%Y_%m_%d')}"
+        ),
+        parquet=parquet or dataset,
+        dataset=dataset,
+        bucket_count=int(os.getenv("SYMBOL_BUCKETS", "0")),
+        force=args.force,
+        allow_missing=args.allow_missing,
+        dimension_path=(
+            f"s3://{args.bucket}/dimensions/symbol_attributes.parquet"
+            if os.getenv("DIMENSION_TABLE") == "True"
+            else None
+        ),
+        cdc_root=f"s3://{args.bucket}/cdc" if os.getenv("CDC") == "True" else None,
+        snapshot_every=int(os.getenv("CDC_SNAPSHOT_EVERY", "7")),
+    )
+    return 0 if committed is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
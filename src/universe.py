@@ -0,0 +1,393 @@
+"""
+Discovery of the actively listed ETF universe.
+
+The universe comes from Alpha Vantage's `LISTING_STATUS` CSV of every active US listing (or a
+local copy of it standing in for the API), which is streamed line by line and filtered to ETFs.
+The active ETFs are kept as a dated snapshot, and a manifest records which snapshot is current,
+its digest, and when the listing was last checked.
+
+Snapshots
+---------
+`etf_universe_YYYY_MM_DD.csv.gz` holds `symbol,name,exchange,ipoDate` of every active ETF, sorted
+by symbol. A new snapshot is only written, and the symbols added or removed logged, when the
+digest of the listing differs from the current one; `universe.json` is the manifest. Both live
+under `default_universe_location` and are synced with `s3_prefix` when set.
+
+Filters (e.g., exchanges or a symbol pattern) are applied when reading a snapshot, so that changing
+them never requires fetching the listing again.
+
+Usage
+-----
+python -m src.universe --listing-file listing_status.csv --exchange "NYSE ARCA" NASDAQ --limit 500
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from dataclasses import dataclass
+from datetime import date, timedelta
+from logging import Logger
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import requests
+
+from src.governance import RequestGovernor
+from src.utils import download_from_s3, setup_logger, trading_day, upload_to_s3
+
+listing_url: str = "https://www.alphavantage.co/query"
+listing_host: str = "www.alphavantage.co"
+default_universe_location: Path = Path.cwd() / ".cache" / "universe"
+manifest_file_name: str = "universe.json"
+# Columns kept in snapshots, the asset type and status are the same for every kept listing
+snapshot_columns: List[str] = ["symbol", "name", "exchange", "ipoDate"]
+
+
+@dataclass(frozen=True)
+class UniverseFilter(object):
+    """
+    Selection of the ETFs of the universe that are fed to the scraper.
+
+    Parameters
+    ----------
+    exchanges : Tuple[str, ...]
+        Exchanges to keep as spelled in the listing (e.g., `NYSE ARCA`, `NASDAQ`, `BATS`), all if empty
+    pattern : Optional[str]
+        Regular expression symbols must fully match, e.g., `[A-Z]{3,4}` to skip share classes
+    limit : int
+        Maximum number of symbols, in symbol order, `0` for no limit
+    """
+
+    exchanges: Tuple[str, ...] = ()
+    pattern: Optional[str] = None
+    limit: int = 0
+
+    def apply(self, records: Iterable[Dict[str, str]]) -> List[str]:
+        """
+        Return the symbols of the records passing the filter.
+
+        Parameters
+        ----------
+        records : Iterable[Dict[str, str]]
+            Snapshot records
+
+        Returns
+        -------
+        List[str]
+            Selected symbols
+        """
+        compiled: Optional[re.Pattern] = (
+            re.compile(self.pattern) if self.pattern else None
+        )
+        symbols: List[str] = []
+        for record in records:
+            if self.exchanges and record["exchange"] not in self.exchanges:
+                continue
+            if compiled and not compiled.fullmatch(record["symbol"]):
+                continue
+            symbols.append(record["symbol"])
+            if self.limit and len(symbols) >= self.limit:
+                break
+        return symbols
+
+
+def iter_active_etfs(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """
+    Parse the `LISTING_STATUS` CSV lazily and yield the active ETFs in compact form.
+
+    Parameters
+    ----------
+    lines : Iterable[str]
+        Lines of the CSV, including the header, e.g., an open file or a streamed response
+
+    Yields
+    ------
+    Dict[str, str]
+        Records keyed by `snapshot_columns`
+    """
+    reader: csv.DictReader = csv.DictReader(lines)
+    if reader.fieldnames is None or "assetType" not in reader.fieldnames:
+        # Invalid keys and rate limit notices come back as JSON with status code 200
+        raise ValueError(f"Unexpected listing header: {reader.fieldnames}")
+    for record in reader:
+        if record["assetType"] == "ETF" and record["status"] == "Active":
+            yield {column: record[column] or "" for column in snapshot_columns}
+
+
+def fetch_active_etfs(
+    logger: Logger,
+    listing_file: Optional[Path] = None,
+    governor: Optional[RequestGovernor] = None,
+    session: Optional[requests.Session] = None,
+) -> List[Dict[str, str]]:
+    """
+    Stream the listing from Alpha Vantage, or from a local file standing in for it, and keep the active ETFs.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    listing_file : Optional[Path], optional
+        Local `LISTING_STATUS` CSV to read instead of calling the API
+    governor : Optional[RequestGovernor], optional
+        Governor that rate limits and retries the request, a default one is used if `None`
+    session : Optional[requests.Session], optional
+        Pooled session to send the request with, a one-off connection is used if `None`
+
+    Returns
+    -------
+    List[Dict[str, str]]
+        Active ETFs sorted by symbol
+    """
+    records: List[Dict[str, str]]
+    if listing_file is not None:
+        logger.info(f"Reading the listing from {listing_file}")
+        with listing_file.open("r", newline="") as listing:
+            records = list(iter_active_etfs(listing))
+    else:
+        apikey: Optional[str] = os.getenv("API_KEY")
+        if not apikey:
+            logger.error("[ERROR] API_KEY environment variable is not set")
+            raise ValueError("API_KEY environment variable is required")
+        logger.info("Making request to Alpha Vantage API for the listing status")
+        governor = governor or RequestGovernor(logger=logger)
+        response: requests.Response = governor.call(
+            host=listing_host,
+            request=lambda: (session or requests).get(
+                f"{listing_url}?function=LISTING_STATUS&apikey={apikey}",
+                timeout=60,
+                stream=True,
+            ),
+        )
+        with response:
+            if response.status_code != 200:
+                raise requests.exceptions.RequestException(
+                    f"Listing request failed with status code {response.status_code}"
+                )
+            encoding: str = response.encoding or "utf-8"
+            records = list(
+                iter_active_etfs(
+                    line.decode(encoding) for line in response.iter_lines()
+                )
+            )
+    records.sort(key=lambda record: record["symbol"])
+    logger.info(f"Found {len(records)} active ETFs in the listing")
+    return records
+
+
+def snapshot_digest(records: List[Dict[str, str]]) -> str:
+    """
+    Return a digest of the records that changes whenever any kept column of any ETF changes.
+
+    Parameters
+    ----------
+    records : List[Dict[str, str]]
+        Records sorted by symbol
+
+    Returns
+    -------
+    str
+        Hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    for record in records:
+        digest.update(
+            ("\x1f".join(record[column] for column in snapshot_columns) + "\n").encode()
+        )
+    return digest.hexdigest()
+
+
+def read_snapshot(path: Path) -> List[Dict[str, str]]:
+    """
+    Read the records of a snapshot.
+
+    Parameters
+    ----------
+    path : Path
+        Local snapshot file
+
+    Returns
+    -------
+    List[Dict[str, str]]
+        Records sorted by symbol
+    """
+    with gzip.open(path, "rt", newline="") as snapshot:
+        return list(csv.DictReader(snapshot))
+
+
+def write_snapshot(records: List[Dict[str, str]], path: Path) -> None:
+    """
+    Write records to a snapshot, going through a temporary file so that a crash never leaves a truncated one.
+
+    Parameters
+    ----------
+    records : List[Dict[str, str]]
+        Records sorted by symbol
+    path : Path
+        Local snapshot file
+
+    Returns
+    -------
+    None
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path: Path = path.with_suffix(".tmp")
+    with gzip.open(tmp_path, "wt", newline="") as snapshot:
+        writer: csv.DictWriter = csv.DictWriter(snapshot, fieldnames=snapshot_columns)
+        writer.writeheader()
+        writer.writerows(records)
+    os.replace(tmp_path, path)
+    return None
+
+
+def discover_universe(
+    logger: Logger,
+    universe_filter: Optional[UniverseFilter] = None,
+    location: Path = default_universe_location,
+    s3_prefix: Optional[str] = None,
+    listing_file: Optional[Path] = None,
+    check_every: timedelta = timedelta(days=1),
+    refresh: bool = False,
+    governor: Optional[RequestGovernor] = None,
+    session: Optional[requests.Session] = None,
+) -> List[str]:
+    """
+    Return the symbols of the actively listed ETFs, checking the listing for changes at most once per `check_every`.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    universe_filter : Optional[UniverseFilter], optional
+        Selection of the symbols to return, all active ETFs if `None`
+    location : Path, optional
+        Local directory of the snapshots and the manifest
+    s3_prefix : Optional[str], optional
+        Full s3 url of the prefix snapshots and the manifest are synced with, or `None` to keep them local
+    listing_file : Optional[Path], optional
+        Local `LISTING_STATUS` CSV to read instead of calling the API
+    check_every : timedelta, optional
+        Minimum time between two checks of the listing
+    refresh : bool, optional
+        `True` to check the listing even if it was checked recently
+    governor : Optional[RequestGovernor], optional
+        Governor that rate limits and retries the listing request
+    session : Optional[requests.Session], optional
+        Pooled session to send the listing request with
+
+    Returns
+    -------
+    List[str]
+        Selected symbols in symbol order
+    """
+    universe_filter = universe_filter or UniverseFilter()
+    manifest_path: Path = location / manifest_file_name
+    if s3_prefix:
+        download_from_s3(
+            s3_path=f"{s3_prefix}/{manifest_file_name}", local_path=manifest_path
+        )
+    manifest: Dict[str, Any] = {}
+    if manifest_path.exists():
+        with manifest_path.open("r") as manifest_file:
+            manifest = json.load(manifest_file)
+
+    def snapshot_path(file_name: str) -> Path:
+        path: Path = location / file_name
+        if not path.exists() and s3_prefix:
+            download_from_s3(s3_path=f"{s3_prefix}/{file_name}", local_path=path)
+        return path
+
+    today: date = trading_day()
+    checked: Optional[date] = (
+        date.fromisoformat(manifest["checked"]) if manifest else None
+    )
+    if not refresh and checked is not None and today - checked < check_every:
+        records: List[Dict[str, str]] = read_snapshot(
+            snapshot_path(manifest["snapshot"])
+        )
+        logger.info(
+            f"Reusing universe snapshot {manifest['snapshot']} checked on {checked}"
+        )
+        return universe_filter.apply(records)
+
+    records = fetch_active_etfs(
+        logger=logger, listing_file=listing_file, governor=governor, session=session
+    )
+    digest: str = snapshot_digest(records)
+    if manifest and manifest["digest"] == digest:
+        logger.info(f"Listing unchanged since snapshot {manifest['snapshot']}")
+    else:
+        if manifest:
+            previous: List[Dict[str, str]] = read_snapshot(
+                snapshot_path(manifest["snapshot"])
+            )
+            previous_symbols: Set[str] = {record["symbol"] for record in previous}
+            current_symbols: Set[str] = {record["symbol"] for record in records}
+            added: List[str] = sorted(current_symbols - previous_symbols)
+            removed: List[str] = sorted(previous_symbols - current_symbols)
+            logger.info(
+                f"Listing changed since snapshot {manifest['snapshot']}: {len(added)} ETFs added "
+                f"{added[:10]}, {len(removed)} removed {removed[:10]}"
+            )
+        file_name: str = f"etf_universe_{today.strftime('%Y_%m_%d')}.csv.gz"
+        write_snapshot(records=records, path=location / file_name)
+        if s3_prefix:
+            upload_to_s3(
+                local_path=location / file_name, s3_path=f"{s3_prefix}/{file_name}"
+            )
+        manifest = {"snapshot": file_name, "digest": digest, "symbols": len(records)}
+        logger.info(f"Saved universe snapshot {file_name}")
+
+    manifest["checked"] = today.isoformat()
+    location.mkdir(parents=True, exist_ok=True)
+    with manifest_path.open("w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    if s3_prefix:
+        upload_to_s3(
+            local_path=manifest_path, s3_path=f"{s3_prefix}/{manifest_file_name}"
+        )
+    return universe_filter.apply(records)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Discover the actively listed ETF universe"
+    )
+    parser.add_argument(
+        "--listing-file",
+        type=Path,
+        help="Local LISTING_STATUS CSV to read instead of calling Alpha Vantage",
+    )
+    parser.add_argument("--location", type=Path, default=default_universe_location)
+    parser.add_argument("--s3-prefix")
+    parser.add_argument("--exchange", nargs="*", default=[])
+    parser.add_argument("--pattern")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--refresh", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args: argparse.Namespace = parse_args(argv)
+    logger: Logger = setup_logger(name="ETF Universe")
+    symbols: List[str] = discover_universe(
+        logger=logger,
+        universe_filter=UniverseFilter(
+            exchanges=tuple(args.exchange), pattern=args.pattern, limit=args.limit
+        ),
+        location=args.location,
+        s3_prefix=args.s3_prefix,
+        listing_file=args.listing_file,
+        refresh=args.refresh,
+    )
+    logger.info(f"Selected {len(symbols)} ETFs: {symbols[:20]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
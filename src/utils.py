@@ -1,11 +1,25 @@
 import logging
 import sys
 from collections.abc import Callable
-from functools import wraps
-from typing import ParamSpec, TypeVar, Union
+from datetime import date, datetime, timedelta
+from functools import cache, wraps
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    List,
+    Optional,
+    ParamSpec,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from zoneinfo import ZoneInfo
 
-import awswrangler as wr
-import pandas as pd
+# Heavy dependencies are imported by the functions that use them, so that importing this
+# module (and thus starting the scraper) does not load pandas, boto3, or awswrangler
+if TYPE_CHECKING:
+    import pandas as pd
 
 P = ParamSpec("P")  # Captures the parameter types of a callable
 R = TypeVar("R")  # Represents the return type of a callable
@@ -73,25 +87,197 @@ def setup_logger(name: str) -> logging.Logger:
     return logger
 
 
-def write_to_s3(data: pd.DataFrame, s3_path: str, parquet: bool = True) -> None:
+def split_s3_path(s3_path: str) -> Tuple[str, str]:
     """
-    Save the input data to s3 either as a parquet file or csv file.
+    Split a full s3 url into its bucket and key.
+
+    Parameters
+    ----------
+    s3_path : str
+        Full s3 url, e.g., `s3://bucket/prefix/object.json`
+
+    Returns
+    -------
+    Tuple[str, str]
+        Bucket and key
+    """
+    bucket, _, key = s3_path.removeprefix("s3://").partition("/")
+    return bucket, key
+
+
+@cache
+def s3_client() -> Any:
+    """
+    Return the boto3 s3 client shared by the object-level helpers, created on first use.
+
+    Returns
+    -------
+    Any
+        boto3 s3 client, which is thread-safe once created
+    """
+    import boto3
+
+    return boto3.client("s3")
+
+
+def write_to_s3(
+    data: "pd.DataFrame",
+    s3_path: str,
+    parquet: bool = True,
+    dataset: bool = False,
+    bucket_count: int = 0,
+    replace: bool = True,
+    manifest: bool = False,
+) -> int:
+    """
+    Save the input data to s3 either as a parquet file or csv file, or into the date-partitioned dataset.
 
     Parameters
     ----------
     data : pd.DataFrame
         Data Frame to be saved
     s3_path : str
-        Full s3 url, excluding the file extension
+        Full s3 url, excluding the file extension, or the dataset root if `dataset` is `True`
     parquet : bool, optional
-        `True` for parquet or `False` for csv
+        `True` for parquet or `False` for csv, ignored in dataset mode which is always parquet
+    dataset : bool, optional
+        `True` to write into the Hive-partitioned dataset rooted at `s3_path` (see `src.dataset`)
+    bucket_count : int, optional
+        Number of symbol buckets per day in dataset mode, `0` writes one file per day
+    replace : bool, optional
+        `False` to add files next to the existing ones of a partition in dataset mode instead of replacing them
+    manifest : bool, optional
+        `True` to record the written object in the manifest of its prefix (see `src.manifest`),
+        ignored in dataset mode
+
+    Returns
+    -------
+    int
+        Number of bytes written
+    """
+    if dataset:
+        # Imported here since `src.dataset` depends on this module
+        from src.dataset import resolve_filesystem, write_dataset
+
+        paths: List[str] = write_dataset(
+            data=data, root=s3_path, bucket_count=bucket_count, replace=replace
+        )
+        filesystem, _ = resolve_filesystem(s3_path)
+        return sum(info.size for info in filesystem.get_file_info(paths))
+    if not parquet:
+        # A single put of the rendered CSV, which needs neither awswrangler nor pyarrow
+        body: bytes = data.to_csv().encode("utf-8")
+        bucket, key = split_s3_path(f"{s3_path}.csv")
+        s3_client().put_object(Bucket=bucket, Key=key, Body=body)
+        if manifest:
+            from src.manifest import record_frame
+
+            record_frame(data=data, path=f"{s3_path}.csv", size=len(body))
+        return len(body)
+
+    import awswrangler as wr
+
+    from src.schema import athena_dtypes
+
+    # Pin the Parquet schema of registered columns instead of relying on inference
+    written_paths: List[str] = wr.s3.to_parquet(
+        df=data,
+        path=f"{s3_path}.parquet",
+        dtype=athena_dtypes(columns=data.columns.to_list()),
+    )["paths"]
+    size: int = sum(
+        size or 0 for size in wr.s3.size_objects(path=written_paths).values()
+    )
+    if manifest:
+        from src.manifest import record_frame
+
+        record_frame(data=data, path=f"{s3_path}.parquet", size=size)
+    return size
+
+
+def download_from_s3(s3_path: str, local_path: Path) -> bool:
+    """
+    Download an s3 object to a local file if the object exists.
+
+    Parameters
+    ----------
+    s3_path : str
+        Full s3 url of the object
+    local_path : Path
+        Local file to write to, parent directories are created as needed
+
+    Returns
+    -------
+    bool
+        `True` if the object existed and was downloaded, `False` otherwise
+    """
+    from botocore.exceptions import ClientError
+
+    bucket, key = split_s3_path(s3_path)
+    local_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        s3_client().download_file(Bucket=bucket, Key=key, Filename=str(local_path))
+    except ClientError as client_error:
+        # `download_file` looks the object up first, which fails with 404 if it does not exist
+        if client_error.response["Error"]["Code"] in {"404", "NoSuchKey"}:
+            return False
+        raise
+    return True
+
+
+def upload_to_s3(local_path: Path, s3_path: str) -> None:
+    """
+    Upload a local file to s3.
+
+    Parameters
+    ----------
+    local_path : Path
+        Local file to upload
+    s3_path : str
+        Full s3 url of the destination object
+
+    Returns
+    -------
+    None
+    """
+    bucket, key = split_s3_path(s3_path)
+    s3_client().upload_file(Filename=str(local_path), Bucket=bucket, Key=key)
+    return None
+
+
+def delete_from_s3(s3_path: str) -> None:
+    """
+    Delete an s3 object, doing nothing if it does not exist.
+
+    Parameters
+    ----------
+    s3_path : str
+        Full s3 url of the object
 
     Returns
     -------
     None
     """
-    if parquet:
-        wr.s3.to_parquet(df=data, path=f"{s3_path}.parquet")
-    else:
-        wr.s3.to_csv(df=data, path=f"{s3_path}.csv")
+    bucket, key = split_s3_path(s3_path)
+    # Deleting a key that does not exist succeeds, so no existence check is needed
+    s3_client().delete_object(Bucket=bucket, Key=key)
     return None
+
+
+def trading_day(now: Optional[datetime] = None) -> date:
+    """
+    Return the most recent weekday in US/Eastern time, which market data of the current run belongs to.
+
+    Parameters
+    ----------
+    now : Optional[datetime], optional
+        Point in time to resolve, defaults to the current time
+
+    Returns
+    -------
+    date
+        The trading day, with weekends rolled back to the preceding Friday
+    """
+    day: date = (now or datetime.now(tz=ZoneInfo("US/Eastern"))).date()
+    # Saturday and Sunday map to Friday; exchange holidays are not accounted for
+    return day - timedelta(days=max(day.weekday() - 4, 0))
@@ -0,0 +1,114 @@
+from datetime import date
+from types import TracebackType
+from typing import Any, Dict, Optional, Self, Type
+
+import pyarrow as pa
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from src.schema import ColumnBuffers, kpi_schema
+
+
+class ParquetStreamWriter(object):
+    """
+    Write rows to a Parquet file as they arrive, buffering at most one row group in memory.
+
+    Row groups are written to a temporary file next to `path`, which is only moved into place once
+    the writer is closed without an error, so that an interrupted run never leaves a truncated file
+    at the output path. The temporary file is only created once the first row group is flushed, so
+    that a run without any rows leaves no empty file behind.
+
+    Parameters
+    ----------
+    path : str
+        Full s3 url or local path of the output file, including the extension
+    run_date : date
+        Value of the `date` column of every row
+    row_group_size : int, optional
+        Number of rows buffered before they are flushed to the file as a row group
+    """
+
+    def __init__(self, path: str, run_date: date, row_group_size: int = 1_000) -> None:
+        self.row_group_size: int = row_group_size
+        self.rows_written: int = 0
+        self.bytes_written: int = 0
+        self.buffers: ColumnBuffers = ColumnBuffers(run_date=run_date)
+        self.path: str = path
+        directory, name = path.rsplit("/", 1) if "/" in path else (".", path)
+        # The leading underscore and the suffix keep listings of the output prefix from picking it up
+        self.tmp_path: str = f"{directory}/_{name}.tmp"
+        self.filesystem: Optional[pafs.FileSystem] = None
+        self.file_path: str = ""
+        self.tmp_file_path: str = ""
+        self.sink: Optional[pa.NativeFile] = None
+        self.writer: Optional[pq.ParquetWriter] = None
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        # `SystemExit` from SIGTERM counts as an error too, the rows written so far are incomplete
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def append(self, row: Dict[str, Any]) -> None:
+        """
+        Buffer a row keyed by output column, flushing a row group once `row_group_size` rows are buffered.
+
+        Parameters
+        ----------
+        row : Dict[str, Any]
+            Row keyed by output column, missing columns are written as nulls
+        """
+        self.buffers.append(row)
+        if len(self.buffers) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered rows to the temporary file as one row group.
+        """
+        if not len(self.buffers):
+            return
+        if self.writer is None:
+            self.filesystem, self.tmp_file_path = pafs.FileSystem.from_uri(
+                self.tmp_path
+            )
+            _, self.file_path = pafs.FileSystem.from_uri(self.path)
+            self.sink = self.filesystem.open_output_stream(self.tmp_file_path)
+            self.writer = pq.ParquetWriter(self.sink, kpi_schema)
+        self.writer.write_table(self.buffers.to_table())
+        self.rows_written += len(self.buffers)
+        self.buffers.clear()
+
+    def close(self) -> None:
+        """
+        Flush the remaining rows, finalize the file and move it to `path`, if any row was written.
+        """
+        self.flush()
+        if self.writer is None or self.sink is None or self.filesystem is None:
+            return
+        self.writer.close()
+        self.bytes_written = self.sink.tell()
+        self.sink.close()
+        self.filesystem.move(self.tmp_file_path, self.file_path)
+        self.writer = None
+
+    def abort(self) -> None:
+        """
+        Discard the buffered rows and delete the temporary file, leaving `path` untouched.
+        """
+        self.buffers.clear()
+        if self.writer is None or self.sink is None or self.filesystem is None:
+            return
+        self.writer.close()
+        self.sink.close()
+        self.filesystem.delete_file(self.tmp_file_path)
+        self.writer = None
@@ -0,0 +1,428 @@
+"""
+Field-projected async client of the Yahoo Finance endpoints, an alternative backend to `yf.Ticker.info`.
+
+`info` requests five quoteSummary modules, the full v7 quote, and a fundamentals time series per
+symbol, and flattens all of it into a dictionary of which the output keeps 19 fields. This client
+only requests what the output columns are sourced from:
+
+* the quote endpoint, projected with `fields=` to `quote_fields` and batched `batch_size` symbols per request,
+* the quoteSummary endpoint with only the modules of `summary_fields`, one request per symbol,
+
+sends all of them concurrently from one event loop, and parses the responses straight into the
+`info`-keyed dictionaries that `build_row` reads. Symbols it could not fetch completely are returned
+as `None`, so that the caller can fall back to yfinance for them.
+"""
+
+import asyncio
+import json
+import time
+from dataclasses import dataclass
+from logging import Logger
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from curl_cffi import CurlInfo
+from curl_cffi import requests as curl_requests
+
+from src.deadline import Deadline
+from src.governance import RequestGovernor
+from src.metrics import MetricsRecorder
+from src.session import ReuseCountingSession, curl_info, yahoo_crumb, yahoo_host
+
+quote_summary_url: str = "https://query2.finance.yahoo.com/v10/finance/quoteSummary"
+quote_url: str = "https://query1.finance.yahoo.com/v7/finance/quote"
+
+# Maps `info` keys to the keys of the quote endpoint that supply them
+quote_fields: Dict[str, str] = {
+    "symbol": "symbol",
+    "firstTradeDateMilliseconds": "firstTradeDateMilliseconds",
+    "previousClose": "regularMarketPreviousClose",
+    "navPrice": "navPrice",
+    "dividendYield": "dividendYield",
+    "netExpenseRatio": "netExpenseRatio",
+    "trailingPE": "trailingPE",
+    "ytdReturn": "ytdReturn",
+    "volume": "regularMarketVolume",
+    "averageVolume": "averageDailyVolume3Month",
+    "bid": "bid",
+    "bidSize": "bidSize",
+    "ask": "ask",
+    "askSize": "askSize",
+}
+# Maps `info` keys to the quoteSummary module and key that supply them
+summary_fields: Dict[str, Tuple[str, str]] = {
+    "longBusinessSummary": ("assetProfile", "longBusinessSummary"),
+    "category": ("defaultKeyStatistics", "category"),
+    "beta3Year": ("defaultKeyStatistics", "beta3Year"),
+    "threeYearAverageReturn": ("defaultKeyStatistics", "threeYearAverageReturn"),
+    "fiveYearAverageReturn": ("defaultKeyStatistics", "fiveYearAverageReturn"),
+}
+
+
+@dataclass
+class ProjectedFetchStats(object):
+    """
+    Counters of a projected fetch, for comparison with the `info` path.
+    """
+
+    requests: int = 0
+    bytes_received: int = 0
+    parse_seconds: float = 0.0
+
+
+def unwrap(value: Any) -> Any:
+    """
+    Return the raw value of a field, which Yahoo sometimes wraps as `{"raw": ..., "fmt": ...}`.
+
+    Strings are normalized the way yfinance normalizes `info`, so that both backends produce the same rows.
+    """
+    if isinstance(value, dict) and "raw" in value:
+        value = value["raw"]
+    if isinstance(value, str):
+        value = value.replace("\xa0", " ")
+    return value
+
+
+def parse_quotes(content: bytes, fields: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse a quote response into the requested fields of each symbol.
+
+    Parameters
+    ----------
+    content : bytes
+        Body of the response
+    fields : Dict[str, str]
+        Mapping of `info` key to quote key
+
+    Returns
+    -------
+    Dict[str, Dict[str, Any]]
+        Mapping of symbol to its fields keyed by `info` key, without missing fields
+    """
+    payload: Dict[str, Any] = json.loads(content)
+    return {
+        quote["symbol"]: {
+            info_key: unwrap(quote[quote_key])
+            for info_key, quote_key in fields.items()
+            if quote.get(quote_key) is not None
+        }
+        for quote in (payload.get("quoteResponse") or {}).get("result") or []
+    }
+
+
+def parse_quote_summary(
+    content: bytes, fields: Dict[str, Tuple[str, str]]
+) -> Dict[str, Any]:
+    """
+    Parse a quoteSummary response into the requested fields.
+
+    Parameters
+    ----------
+    content : bytes
+        Body of the response
+    fields : Dict[str, Tuple[str, str]]
+        Mapping of `info` key to module and key
+
+    Returns
+    -------
+    Dict[str, Any]
+        Fields keyed by `info` key, without missing fields
+    """
+    payload: Dict[str, Any] = json.loads(content)
+    results: List[Dict[str, Any]] = (payload.get("quoteSummary") or {}).get(
+        "result"
+    ) or []
+    if not results:
+        return {}
+    info: Dict[str, Any] = {}
+    for info_key, (module, key) in fields.items():
+        value: Any = unwrap((results[0].get(module) or {}).get(key))
+        if value is not None:
+            info[info_key] = value
+    return info
+
+
+class ProjectedYahooClient(object):
+    """
+    Sends projected Yahoo Finance requests from one event loop, at most `concurrency` at once.
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger instance to log information
+    governor : RequestGovernor
+        Governor that rate limits and retries the requests
+    session : curl_requests.AsyncSession
+        Session the requests are sent with, carrying yfinance's cookie
+    crumb : Optional[str]
+        yfinance's crumb, which Yahoo expects with the cookie
+    concurrency : int
+        Maximum number of requests in flight
+    deadline : Optional[Deadline], optional
+        Budget of the run, requests are failed without being sent once it is exhausted
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        governor: RequestGovernor,
+        session: curl_requests.AsyncSession,
+        crumb: Optional[str],
+        concurrency: int,
+        deadline: Optional[Deadline] = None,
+    ) -> None:
+        self.logger: Logger = logger
+        self.governor: RequestGovernor = governor
+        self.session: curl_requests.AsyncSession = session
+        self.crumb: Optional[str] = crumb
+        self.semaphore: asyncio.Semaphore = asyncio.Semaphore(concurrency)
+        self.deadline: Optional[Deadline] = deadline
+        self.stats: ProjectedFetchStats = ProjectedFetchStats()
+
+    async def get(self, url: str, params: Dict[str, str]) -> Optional[bytes]:
+        """
+        Send a governed GET request and return its body, or `None` if it failed.
+
+        Parameters
+        ----------
+        url : str
+            Url of the endpoint
+        params : Dict[str, str]
+            Query parameters, the crumb is added
+
+        Returns
+        -------
+        Optional[bytes]
+            Body of a successful response
+        """
+        if self.crumb is not None:
+            params = {**params, "crumb": self.crumb}
+        async with self.semaphore:
+            # The symbols are then left to the yfinance fallback, which records them as skipped
+            if self.deadline is not None and self.deadline.exhausted():
+                return None
+            try:
+                response: curl_requests.Response = await self.governor.call_async(
+                    host=yahoo_host,
+                    request=lambda: self.session.get(url, params=params, timeout=30),
+                )
+            except Exception as request_error:
+                self.logger.warning(
+                    f"Projected request to {url} failed: {request_error!r}"
+                )
+                return None
+        self.stats.requests += 1
+        self.stats.bytes_received += curl_info(response, CurlInfo.SIZE_DOWNLOAD_T)
+        if response.status_code != 200:
+            self.logger.warning(
+                f"Projected request to {url} failed with status code {response.status_code}"
+            )
+            return None
+        return response.content
+
+    async def fetch_quotes(
+        self, symbols: List[str], fields: Dict[str, str]
+    ) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Fetch the projected quote fields of a chunk of symbols.
+
+        Returns
+        -------
+        Optional[Dict[str, Dict[str, Any]]]
+            Mapping of symbol to its fields, or `None` if the request failed
+        """
+        content: Optional[bytes] = await self.get(
+            quote_url,
+            params={
+                "symbols": ",".join(symbols),
+                "fields": ",".join(sorted(set(fields.values()))),
+                "formatted": "false",
+            },
+        )
+        if content is None:
+            return None
+        start: float = time.perf_counter()
+        quotes: Dict[str, Dict[str, Any]] = parse_quotes(content=content, fields=fields)
+        self.stats.parse_seconds += time.perf_counter() - start
+        return quotes
+
+    async def fetch_summary(
+        self, symbol: str, fields: Dict[str, Tuple[str, str]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the quoteSummary modules of one symbol that `fields` are sourced from.
+
+        Returns
+        -------
+        Optional[Dict[str, Any]]
+            Fields keyed by `info` key, or `None` if the request failed
+        """
+        content: Optional[bytes] = await self.get(
+            f"{quote_summary_url}/{symbol}",
+            params={
+                "modules": ",".join(sorted({module for module, _ in fields.values()})),
+                "formatted": "false",
+                "symbol": symbol,
+            },
+        )
+        if content is None:
+            return None
+        start: float = time.perf_counter()
+        summary: Dict[str, Any] = parse_quote_summary(content=content, fields=fields)
+        self.stats.parse_seconds += time.perf_counter() - start
+        return summary
+
+    async def fetch(
+        self,
+        symbols: List[str],
+        projected_quote_fields: Dict[str, str],
+        projected_summary_fields: Dict[str, Tuple[str, str]],
+        batch_size: int,
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Fetch the projected fields of many symbols concurrently.
+
+        Returns
+        -------
+        Dict[str, Optional[Dict[str, Any]]]
+            Mapping of symbol to its `info`-keyed fields, `None` for symbols with a failed request
+        """
+        chunks: List[List[str]] = (
+            [
+                symbols[start : start + batch_size]
+                for start in range(0, len(symbols), batch_size)
+            ]
+            if projected_quote_fields
+            else []
+        )
+        summary_symbols: List[str] = symbols if projected_summary_fields else []
+        results: List[Any] = await asyncio.gather(
+            *(self.fetch_quotes(chunk, projected_quote_fields) for chunk in chunks),
+            *(
+                self.fetch_summary(symbol, projected_summary_fields)
+                for symbol in summary_symbols
+            ),
+        )
+        quotes: Dict[str, Optional[Dict[str, Any]]] = {}
+        for chunk, chunk_quotes in zip(chunks, results[: len(chunks)]):
+            for symbol in chunk:
+                # Symbols missing from a successful response are left to the fallback too
+                quotes[symbol] = (chunk_quotes or {}).get(symbol)
+        summaries: Dict[str, Optional[Dict[str, Any]]] = dict(
+            zip(summary_symbols, results[len(chunks) :])
+        )
+
+        infos: Dict[str, Optional[Dict[str, Any]]] = {}
+        for symbol in symbols:
+            quote: Optional[Dict[str, Any]] = quotes.get(symbol, {})
+            summary: Optional[Dict[str, Any]] = summaries.get(symbol, {})
+            infos[symbol] = (
+                None
+                if quote is None or summary is None
+                else {**summary, **quote, "symbol": symbol}
+            )
+        return infos
+
+
+def fetch_projected_infos(
+    symbols: List[str],
+    fields: Set[str],
+    logger: Logger,
+    governor: RequestGovernor,
+    session: Optional[curl_requests.Session] = None,
+    concurrency: int = 32,
+    batch_size: int = 100,
+    metrics: Optional[MetricsRecorder] = None,
+    deadline: Optional[Deadline] = None,
+) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Fetch the `info` fields of many symbols with projected requests sent concurrently from one event loop.
+
+    Parameters
+    ----------
+    symbols : List[str]
+        Ticker symbols
+    fields : Set[str]
+        `info` keys to fetch, keys supplied by neither `quote_fields` nor `summary_fields` are ignored
+    logger : Logger
+        Logger instance to log information
+    governor : RequestGovernor
+        Governor that rate limits and retries the requests
+    session : Optional[curl_requests.Session], optional
+        yfinance's session, whose cookie and crumb are reused, yfinance's default session is used if `None`
+    concurrency : int, optional
+        Maximum number of requests in flight
+    batch_size : int, optional
+        Number of symbols per quote request
+    metrics : Optional[MetricsRecorder], optional
+        Recorder of the requests sent (`ProjectedRequests`), bytes received (`ProjectedBytes`), and
+        parse time (`ProjectedParseTime`)
+    deadline : Optional[Deadline], optional
+        Budget of the run, symbols whose requests are no longer sent once it is exhausted are
+        returned as `None`
+
+    Returns
+    -------
+    Dict[str, Optional[Dict[str, Any]]]
+        Mapping of symbol to its fields keyed by `info` key, `None` for symbols to fall back to yfinance for
+    """
+    metrics = metrics or MetricsRecorder(enabled=False)
+    if not symbols:
+        return {}
+    try:
+        crumb, cookie_session = yahoo_crumb(
+            logger=logger, governor=governor, session=session
+        )
+    except Exception as crumb_error:
+        logger.warning(
+            f"Could not get a Yahoo Finance crumb, falling back to yfinance: {crumb_error!r}"
+        )
+        return {symbol: None for symbol in symbols}
+
+    async def fetch() -> Tuple[
+        Dict[str, Optional[Dict[str, Any]]], ProjectedFetchStats
+    ]:
+        # Sessions of `HttpSessions` open async sessions that go through their cassette, if any
+        async with (
+            cookie_session.async_session
+            if isinstance(cookie_session, ReuseCountingSession)
+            else curl_requests.AsyncSession
+        )(
+            impersonate="chrome",
+            cookies=cookie_session.cookies,
+            max_clients=concurrency,
+            curl_infos=[CurlInfo.SIZE_DOWNLOAD_T],
+        ) as async_session:
+            client: ProjectedYahooClient = ProjectedYahooClient(
+                logger=logger,
+                governor=governor,
+                session=async_session,
+                crumb=crumb,
+                concurrency=concurrency,
+                deadline=deadline,
+            )
+            infos: Dict[str, Optional[Dict[str, Any]]] = await client.fetch(
+                symbols=symbols,
+                projected_quote_fields={
+                    key: quote_key
+                    for key, quote_key in quote_fields.items()
+                    if key in fields
+                },
+                projected_summary_fields={
+                    key: source
+                    for key, source in summary_fields.items()
+                    if key in fields
+                },
+                batch_size=batch_size,
+            )
+            return infos, client.stats
+
+    infos, stats = asyncio.run(fetch())
+    metrics.count("ProjectedRequests", stats.requests)
+    metrics.count("ProjectedBytes", stats.bytes_received, unit="Bytes")
+    metrics.count("ProjectedParseTime", stats.parse_seconds * 1e3, unit="Milliseconds")
+    failed: int = sum(info is None for info in infos.values())
+    logger.info(
+        f"Fetched projected fields of {len(symbols) - failed} of {len(symbols)} tickers in {stats.requests} requests: "
+        f"{stats.bytes_received / len(symbols) / 1024:.1f} KiB and {stats.parse_seconds / len(symbols) * 1e3:.3f} ms of parsing per ticker"
+    )
+    return infos
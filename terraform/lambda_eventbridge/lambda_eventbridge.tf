@@ -19,6 +19,7 @@ resource "aws_lambda_function" "lambda_function" {
       ECS_CONTAINER_NAME  = data.terraform_remote_state.ecs_fargate.outputs.ecs_fargate_container_name
       ECS_TASK_DEFINITION = data.terraform_remote_state.ecs_fargate.outputs.ecs_fargate_task_definition_family
       SECURITY_GROUP      = data.terraform_remote_state.vpc.outputs.security_group_id
+      SHARD_COUNT         = var.shard_count
       SUBNET_1            = data.terraform_remote_state.vpc.outputs.public_subnet_ids[0]
       SUBNET_2            = data.terraform_remote_state.vpc.outputs.public_subnet_ids[1]
       env                 = var.env
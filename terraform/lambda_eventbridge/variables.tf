@@ -78,3 +78,9 @@ variable "env" {
   description = "Environment for the stack (e.g., dev, prod)"
   type        = string
 }
+
+variable "shard_count" {
+  description = "Number of ECS Fargate tasks the symbols are sharded across"
+  type        = number
+  default     = 1
+}
@@ -0,0 +1,25 @@
+import os
+from collections.abc import Iterator
+from typing import Any
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+# Clients are created offline against stubs, but boto3 still needs a region and credentials,
+# including for the ECS client `lambda_function` creates when it is imported
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+
+@pytest.fixture
+def s3_stub(monkeypatch: pytest.MonkeyPatch) -> Iterator[Stubber]:
+    """
+    Stub the s3 client shared by the object-level helpers of `src.sharding`.
+    """
+    client: Any = boto3.client("s3")
+    monkeypatch.setattr("src.sharding.s3_client", lambda: client)
+    with Stubber(client) as stubber:
+        yield stubber
+        stubber.assert_no_pending_responses()
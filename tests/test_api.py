@@ -0,0 +1,65 @@
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pytest
+
+import src.api
+from src.api import info_only_fields, iter_etf_and_stock_rows
+from src.cache import MetadataCache
+from src.schema import kpi_columns
+
+logger: logging.Logger = logging.getLogger("tests.api")
+gainers_losers: Dict[str, Any] = {
+    "top_gainers": [
+        {"ticker": ticker, "change_percentage": "10%"}
+        for ticker in ("AAA", "BBB", "CCC")
+    ]
+}
+
+
+def test_projected_fields_follow_the_batched_quotes_of_each_symbol(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    quoted: Set[str] = set()
+    projected_calls: List[Tuple[List[str], Set[str]]] = []
+
+    def fetch_batch_quotes(tickers: Any, **kwargs: Any) -> Dict[str, Dict[str, Any]]:
+        # One quote chunk failed, so only every other symbol has a quote
+        symbols: List[str] = sorted(tickers.tickers)
+        quoted.update(symbols[::2])
+        return {symbol: {"previousClose": 1.0} for symbol in quoted}
+
+    def fetch_projected_infos(
+        symbols: List[str], fields: Set[str], **kwargs: Any
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        projected_calls.append((symbols, fields))
+        return {symbol: {} for symbol in symbols}
+
+    monkeypatch.setattr(src.api, "fetch_batch_quotes", fetch_batch_quotes)
+    monkeypatch.setattr(src.api, "fetch_projected_infos", fetch_projected_infos)
+    monkeypatch.setattr(src.api, "configure_yfinance_cache", lambda: None)
+
+    list(
+        iter_etf_and_stock_rows(
+            logger=logger,
+            env="dev",
+            batch_size=2,
+            metadata_cache=MetadataCache(
+                logger=logger, path=tmp_path / "ticker_metadata.json"
+            ),
+            backend="async",
+            sample_seed=0,
+            gainers_losers=gainers_losers,
+        )
+    )
+
+    all_fields: Set[str] = {
+        column.source for column in kpi_columns if column.source is not None
+    }
+    fields_of: Dict[str, Set[str]] = {
+        symbol: fields for symbols, fields in projected_calls for symbol in symbols
+    }
+    assert quoted and set(fields_of) - quoted
+    for symbol, fields in fields_of.items():
+        assert fields == (info_only_fields if symbol in quoted else all_fields)
@@ -0,0 +1,66 @@
+import io
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pyarrow as pa
+import pytest
+
+import src.daemon
+from src.daemon import run_daemon
+from src.metrics import MetricsRecorder, parse_emf_lines
+
+logger: logging.Logger = logging.getLogger("tests.daemon")
+
+
+class FakePoller(object):
+    """
+    Poller returning the same quote on every tick.
+    """
+
+    def __init__(self) -> None:
+        self.symbols: List[str] = ["SPY"]
+        self.closed: bool = False
+
+    def poll(self) -> Dict[str, Dict[str, Any]]:
+        return {"SPY": {"symbol": "SPY", "regularMarketPrice": 500.0}}
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_failed_writes_skip_their_tick(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    write_tick = src.daemon.write_tick
+    attempts: List[int] = []
+
+    def flaky_write_tick(table: pa.Table, **kwargs: Any) -> Tuple[str, int]:
+        attempts.append(1)
+        if len(attempts) == 2:
+            raise OSError("transient s3 error")
+        return write_tick(table=table, **kwargs)
+
+    monkeypatch.setattr(src.daemon, "write_tick", flaky_write_tick)
+    poller: Any = FakePoller()
+    stream: io.StringIO = io.StringIO()
+
+    written: int = run_daemon(
+        logger=logger,
+        poller=poller,
+        output_root=str(tmp_path),
+        interval=0.01,
+        stop=threading.Event(),
+        metrics=MetricsRecorder(stream=stream),
+        max_ticks=3,
+    )
+
+    assert len(attempts) == 3
+    assert written == 2
+    assert len(list(tmp_path.rglob("*.parquet"))) == 2
+    assert poller.closed
+    metrics: Dict[str, List[float]] = parse_emf_lines(
+        iter(stream.getvalue().splitlines())
+    )
+    assert sum(metrics["TickWriteErrors"]) == 1
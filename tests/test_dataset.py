@@ -0,0 +1,105 @@
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from src.dataset import compact_month, compacted_file_name, write_dataset
+
+logger: logging.Logger = logging.getLogger("tests.dataset")
+
+
+def day_frame(day: int, symbols: List[str], price: float) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "symbol": symbols,
+            "date": [datetime(2024, 6, day)] * len(symbols),
+            "price": [price] * len(symbols),
+        }
+    )
+
+
+def read_month(root: Path) -> pd.DataFrame:
+    files: List[Path] = sorted((root / "year=2024" / "month=06").rglob("*.parquet"))
+    return (
+        pd.concat(
+            [pq.read_table(path, partitioning=None).to_pandas() for path in files],
+            ignore_index=True,
+        )
+        .sort_values(["symbol", "date"])
+        .reset_index(drop=True)
+    )
+
+
+@pytest.mark.parametrize("bucket_count", [0, 2])
+def test_compact_merges_daily_partitions(tmp_path: Path, bucket_count: int) -> None:
+    for day in (3, 4):
+        write_dataset(
+            data=day_frame(day, ["C", "A", "B"], 1.0),
+            root=str(tmp_path),
+            bucket_count=bucket_count,
+        )
+    path = compact_month(logger=logger, root=str(tmp_path), year=2024, month=6)
+
+    month_dir: Path = tmp_path / "year=2024" / "month=06"
+    assert path is not None and path.endswith(compacted_file_name)
+    assert [p.name for p in month_dir.rglob("*") if p.is_file()] == [
+        compacted_file_name
+    ]
+    compacted: pd.DataFrame = pq.read_table(
+        month_dir / compacted_file_name, partitioning=None
+    ).to_pandas()
+    assert compacted["symbol"].tolist() == ["A", "A", "B", "B", "C", "C"]
+
+
+def test_rewrite_after_compaction_replaces_the_day(tmp_path: Path) -> None:
+    write_dataset(data=day_frame(3, ["A", "B", "C"], 1.0), root=str(tmp_path))
+    write_dataset(data=day_frame(4, ["A", "B", "C"], 1.0), root=str(tmp_path))
+    compact_month(logger=logger, root=str(tmp_path), year=2024, month=6)
+
+    # C is no longer scraped, so its stale row of the rewritten day must go as well
+    write_dataset(data=day_frame(4, ["A", "B"], 2.0), root=str(tmp_path))
+
+    data: pd.DataFrame = read_month(tmp_path)
+    assert not data.duplicated(subset=["symbol", "date"]).any()
+    rewritten: pd.DataFrame = data[data["date"] == datetime(2024, 6, 4)]
+    assert rewritten["symbol"].tolist() == ["A", "B"]
+    assert rewritten["price"].tolist() == [2.0, 2.0]
+    assert len(data[data["date"] == datetime(2024, 6, 3)]) == 3
+
+    compact_month(logger=logger, root=str(tmp_path), year=2024, month=6)
+    pd.testing.assert_frame_equal(read_month(tmp_path), data, check_dtype=False)
+
+
+def test_rewrite_of_every_compacted_day_deletes_the_compacted_file(
+    tmp_path: Path,
+) -> None:
+    write_dataset(data=day_frame(3, ["A", "B"], 1.0), root=str(tmp_path))
+    compact_month(logger=logger, root=str(tmp_path), year=2024, month=6)
+    write_dataset(data=day_frame(3, ["A"], 2.0), root=str(tmp_path))
+
+    month_dir: Path = tmp_path / "year=2024" / "month=06"
+    assert not (month_dir / compacted_file_name).exists()
+    assert read_month(tmp_path)["price"].tolist() == [2.0]
+
+
+def test_add_mode_keeps_compacted_rows(tmp_path: Path) -> None:
+    write_dataset(data=day_frame(3, ["A"], 1.0), root=str(tmp_path))
+    compact_month(logger=logger, root=str(tmp_path), year=2024, month=6)
+    write_dataset(data=day_frame(3, ["B"], 1.0), root=str(tmp_path), replace=False)
+
+    assert read_month(tmp_path)["symbol"].tolist() == ["A", "B"]
+
+
+def test_compact_discards_a_leftover_temporary_file(tmp_path: Path) -> None:
+    write_dataset(data=day_frame(3, ["A"], 1.0), root=str(tmp_path))
+    month_dir: Path = tmp_path / "year=2024" / "month=06"
+    (month_dir / f"_{compacted_file_name}.tmp").write_text("partial")
+
+    compact_month(logger=logger, root=str(tmp_path), year=2024, month=6)
+
+    assert not (month_dir / f"_{compacted_file_name}.tmp").exists()
+    assert read_month(tmp_path)["symbol"].tolist() == ["A"]
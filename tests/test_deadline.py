@@ -0,0 +1,26 @@
+import logging
+
+import pytest
+
+from src.deadline import Deadline, max_reserve_fraction
+
+logger: logging.Logger = logging.getLogger("tests.deadline")
+
+
+def test_reserve_within_the_budget_is_kept() -> None:
+    deadline: Deadline = Deadline(logger=logger, budget=600, reserve=180, started=0)
+    assert deadline.reserve == 180
+
+
+def test_reserve_past_the_budget_is_clamped(caplog: pytest.LogCaptureFixture) -> None:
+    deadline: Deadline = Deadline(logger=logger, budget=120, reserve=180)
+    assert deadline.reserve == 120 * max_reserve_fraction
+    assert "clamping it to 60s" in caplog.text
+    # Fetching can still start instead of skipping every symbol
+    assert not deadline.exhausted()
+
+
+@pytest.mark.parametrize(("budget", "reserve"), [(0, 0), (-1, 0), (600, -1)])
+def test_invalid_budget_or_reserve_is_rejected(budget: float, reserve: float) -> None:
+    with pytest.raises(ValueError):
+        Deadline(logger=logger, budget=budget, reserve=reserve)
@@ -0,0 +1,150 @@
+from typing import Any, Dict, List, Optional
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+from lambda_function import (
+    EnvironmentConfig,
+    launch_shards,
+    parse_shard_indices,
+)
+
+env_config: EnvironmentConfig = EnvironmentConfig(
+    cluster_name="cluster",
+    task_definition="etf-kpis-scraper",
+    container_name="scraper",
+    subnet_1="subnet-1",
+    subnet_2="subnet-2",
+    security_group="sg-1",
+    assign_public_ip="DISABLED",
+    env="prod",
+    shard_count=3,
+)
+
+
+def expected_run_task(shard_index: int, shard_count: int) -> Dict[str, Any]:
+    return {
+        "cluster": "cluster",
+        "launchType": "FARGATE",
+        "count": 1,
+        "taskDefinition": "etf-kpis-scraper:7",
+        "networkConfiguration": {
+            "awsvpcConfiguration": {
+                "subnets": ["subnet-1", "subnet-2"],
+                "securityGroups": ["sg-1"],
+                "assignPublicIp": "DISABLED",
+            }
+        },
+        "overrides": {
+            "containerOverrides": [
+                {
+                    "name": "scraper",
+                    "environment": [
+                        {"name": "ENV", "value": "dev"},
+                        {"name": "SHARD_INDEX", "value": str(shard_index)},
+                        {"name": "SHARD_COUNT", "value": str(shard_count)},
+                    ],
+                }
+            ]
+        },
+    }
+
+
+def stubbed_launch(
+    responses: Dict[int, Optional[Dict[str, Any]]],
+    shard_count: int,
+    shard_indices: Optional[List[int]] = None,
+) -> Dict[str, Any]:
+    client: Any = boto3.client("ecs")
+    with Stubber(client) as stubber:
+        stubber.add_response(
+            "describe_task_definition",
+            {"taskDefinition": {"revision": 7}},
+            expected_params={"taskDefinition": "etf-kpis-scraper"},
+        )
+        # `None` stands for a shard whose `run_task` call raises
+        for shard_index, response in responses.items():
+            if response is None:
+                stubber.add_client_error(
+                    "run_task",
+                    service_error_code="ThrottlingException",
+                    service_message="Rate exceeded",
+                    expected_params=expected_run_task(shard_index, shard_count),
+                )
+            else:
+                stubber.add_response(
+                    "run_task",
+                    response,
+                    expected_params=expected_run_task(shard_index, shard_count),
+                )
+        result: Dict[str, Any] = launch_shards(
+            client=client,
+            env_config=env_config,
+            env="dev",
+            shard_count=shard_count,
+            shard_indices=shard_indices,
+        )
+        stubber.assert_no_pending_responses()
+    return result
+
+
+def started(shard_index: int) -> Dict[str, Any]:
+    return {"tasks": [{"taskArn": f"arn:task/{shard_index}"}], "failures": []}
+
+
+def test_launch_shards_runs_one_task_per_shard() -> None:
+    result: Dict[str, Any] = stubbed_launch(
+        {index: started(index) for index in range(3)}, shard_count=3
+    )
+
+    assert result == {
+        "launched": {0: "arn:task/0", 1: "arn:task/1", 2: "arn:task/2"},
+        "failed": {},
+    }
+
+
+def test_launch_shards_reports_failures_and_keeps_going() -> None:
+    result: Dict[str, Any] = stubbed_launch(
+        {
+            0: None,
+            1: {
+                "tasks": [],
+                "failures": [{"arn": "arn:instance", "reason": "RESOURCE:MEMORY"}],
+            },
+            2: started(2),
+        },
+        shard_count=3,
+    )
+
+    assert result["launched"] == {2: "arn:task/2"}
+    assert set(result["failed"]) == {0, 1}
+    assert "ThrottlingException" in result["failed"][0]
+    assert result["failed"][1] == "arn:instance RESOURCE:MEMORY"
+
+
+def test_launch_shards_relaunches_the_requested_shards() -> None:
+    result: Dict[str, Any] = stubbed_launch(
+        {1: started(1)}, shard_count=3, shard_indices=[1]
+    )
+
+    assert result["launched"] == {1: "arn:task/1"}
+
+
+@pytest.mark.parametrize(
+    ("shards", "expected"), [(None, None), ([2], [2]), ([0, 2], [0, 2])]
+)
+def test_parse_shard_indices(
+    shards: Optional[List[int]], expected: Optional[List[int]]
+) -> None:
+    assert parse_shard_indices(shards=shards, shard_count=3) == expected
+
+
+@pytest.mark.parametrize("shards", [[], [3], [-1], ["1"], [True], [1, 1], 1, "0"])
+def test_parse_shard_indices_rejects_invalid_shards(shards: Any) -> None:
+    with pytest.raises(ValueError):
+        parse_shard_indices(shards=shards, shard_count=3)
+
+
+def test_parse_shard_indices_rejects_an_invalid_shard_count() -> None:
+    with pytest.raises(ValueError):
+        parse_shard_indices(shards=None, shard_count=0)
@@ -0,0 +1,60 @@
+import os
+import signal
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+from src.metrics import parse_emf_lines
+
+root: Path = Path(__file__).resolve().parents[1]
+
+# Blocks the run once its configuration is read, before any upstream request, and tells the
+# test it got there so that SIGTERM arrives mid-run
+blocked_run: str = """
+import sys
+import time
+
+import main
+import src.governance
+
+def block(self, *args, **kwargs):
+    print("blocked", file=sys.stderr, flush=True)
+    time.sleep(60)
+
+src.governance.RequestGovernor.__init__ = block
+sys.exit(main.main())
+"""
+
+
+def test_sigterm_exits_through_system_exit_and_flushes_metrics() -> None:
+    env: Dict[str, str] = {
+        **os.environ,
+        "METRICS": "True",
+        "ENV": "test",
+        "S3_BUCKET": "bucket",
+        "PYTHONPATH": str(root),
+    }
+    process: subprocess.Popen = subprocess.Popen(
+        [sys.executable, "-c", blocked_run],
+        cwd=root,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert process.stderr is not None
+        assert process.stderr.readline().strip() == "blocked"
+        process.send_signal(signal.SIGTERM)
+        stdout, _ = process.communicate(timeout=30)
+    finally:
+        process.kill()
+
+    # Killed by the signal itself, the process would report -SIGTERM and print no metrics
+    assert process.returncode == 128 + signal.SIGTERM
+    lines: List[str] = stdout.splitlines()
+    assert any("Starting ETF KPIs scraper" in line for line in lines)
+    metrics: Dict[str, List[float]] = parse_emf_lines(iter(lines))
+    assert len(metrics["RunDuration"]) == 1
+    assert len(metrics["ImportsDuration"]) == 1
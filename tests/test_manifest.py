@@ -0,0 +1,73 @@
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from src.manifest import (
+    load_manifest,
+    manifest_file_name,
+    may_hold_symbols,
+    record_frame,
+    resolve_days,
+)
+from src.reader import list_daily_files
+
+
+def write_day(root: Path, day: int, symbols: List[str]) -> str:
+    data: pd.DataFrame = pd.DataFrame(
+        {
+            "symbol": symbols,
+            "date": [datetime(2024, 6, day)] * len(symbols),
+            "previous_close": [1.0] * len(symbols),
+        }
+    )
+    path: str = f"{root}/etf_kpis_2024_06_{day:02d}.parquet"
+    data.to_parquet(path, index=False)
+    record_frame(data=data, path=path, size=Path(path).stat().st_size)
+    return path
+
+
+def test_entries_do_not_grow_with_the_symbols(tmp_path: Path) -> None:
+    write_day(tmp_path, 3, ["SPY"])
+    write_day(tmp_path, 4, [f"SYM{index:05d}" for index in range(10_000)])
+
+    entries, _ = load_manifest(str(tmp_path))
+    sizes: List[int] = [len(str(entry)) for entry in entries.values()]
+    assert max(sizes) < 2 * min(sizes)
+    assert (tmp_path / manifest_file_name).stat().st_size < 1_000
+    entry: Dict[str, Any] = entries[f"{tmp_path}/etf_kpis_2024_06_04.parquet"]
+    assert entry["symbol_count"] == 10_000
+    assert entry["stats"]["symbol"] == ["SYM00000", "SYM09999"]
+
+
+def test_first_record_seeds_the_manifest_from_a_listing(tmp_path: Path) -> None:
+    pd.DataFrame({"symbol": ["QQQ"], "date": [datetime(2024, 6, 3)]}).to_parquet(
+        tmp_path / "etf_kpis_2024_06_03.parquet", index=False
+    )
+    write_day(tmp_path, 4, ["SPY"])
+
+    days: Optional[Dict[date, Dict[str, Any]]] = resolve_days(str(tmp_path))
+    assert days is not None
+    assert list(days) == [date(2024, 6, 3), date(2024, 6, 4)]
+
+
+def test_reader_prunes_days_by_symbol_range(tmp_path: Path) -> None:
+    write_day(tmp_path, 3, ["AAA", "ABC"])
+    write_day(tmp_path, 4, ["SPY", "VOO"])
+
+    days: List[date] = [
+        day
+        for day, _ in list_daily_files(
+            str(tmp_path), date(2024, 6, 1), date(2024, 6, 30), symbols=["TLT"]
+        )
+    ]
+    assert days == [date(2024, 6, 4)]
+
+
+def test_entries_listing_symbols_are_still_pruned_by_them() -> None:
+    entry: Dict[str, Any] = {"symbols": ["AAA", "SPY"], "stats": {}}
+
+    assert may_hold_symbols(entry=entry, symbols=["SPY"])
+    assert not may_hold_symbols(entry=entry, symbols=["QQQ"])
+    assert not may_hold_symbols(entry={"stats": {}}, symbols=["SPY"])
@@ -0,0 +1,86 @@
+import io
+import json
+from typing import Any, Dict, List
+
+import pytest
+
+from src.metrics import MetricsRecorder, max_values_per_metric, parse_emf_lines
+
+
+def emitted(stream: io.StringIO) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_flush_writes_emf_lines() -> None:
+    stream: io.StringIO = io.StringIO()
+    recorder: MetricsRecorder = MetricsRecorder(
+        dimensions={"Environment": "test"}, stream=stream
+    )
+    recorder.observe("FetchLatency", 12.3456)
+    recorder.count("TickersFailed")
+    recorder.count("TickersFailed", 2)
+    recorder.flush()
+
+    (document,) = emitted(stream)
+    directive: Dict[str, Any] = document["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == "ETFKPIsScraper"
+    assert directive["Dimensions"] == [["Environment"]]
+    assert {metric["Name"]: metric["Unit"] for metric in directive["Metrics"]} == {
+        "FetchLatency": "Milliseconds",
+        "TickersFailed": "Count",
+    }
+    assert document["Environment"] == "test"
+    assert document["FetchLatency"] == 12.346
+    assert document["TickersFailed"] == 3
+
+
+def test_flush_spreads_values_over_lines_and_resets() -> None:
+    stream: io.StringIO = io.StringIO()
+    recorder: MetricsRecorder = MetricsRecorder(stream=stream)
+    for value in range(max_values_per_metric + 1):
+        recorder.observe("FetchLatency", value)
+    recorder.flush()
+    recorder.flush()
+
+    documents: List[Dict[str, Any]] = emitted(stream)
+    assert len(documents) == 2
+    assert len(documents[0]["FetchLatency"]) == max_values_per_metric
+    assert documents[1]["FetchLatency"] == max_values_per_metric
+
+
+def test_stage_times_and_counts_errors() -> None:
+    stream: io.StringIO = io.StringIO()
+    recorder: MetricsRecorder = MetricsRecorder(stream=stream)
+    with pytest.raises(ValueError):
+        with recorder.stage("Write"):
+            raise ValueError("boom")
+    recorder.flush()
+
+    (document,) = emitted(stream)
+    assert document["WriteErrors"] == 1
+    assert document["WriteDuration"] >= 0
+
+
+def test_disabled_recorder_emits_nothing() -> None:
+    stream: io.StringIO = io.StringIO()
+    recorder: MetricsRecorder = MetricsRecorder(enabled=False, stream=stream)
+    with recorder.stage("Write"):
+        recorder.count("TickersFailed")
+    recorder.flush()
+
+    assert emitted(stream) == []
+
+
+def test_parse_emf_lines_skips_log_lines() -> None:
+    stream: io.StringIO = io.StringIO()
+    recorder: MetricsRecorder = MetricsRecorder(stream=stream)
+    recorder.observe("FetchLatency", 1.0)
+    recorder.observe("FetchLatency", 2.0)
+    recorder.flush()
+    stdout: List[str] = [
+        "2024-06-28 10:00:00 INFO ETF KPIs Scraper: Starting ETF KPIs scraper",
+        "{not json",
+        *stream.getvalue().splitlines(),
+    ]
+
+    assert parse_emf_lines(iter(stdout)) == {"FetchLatency": [1.0, 2.0]}
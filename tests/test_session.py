@@ -0,0 +1,98 @@
+import logging
+from typing import Any, List
+
+import pytest
+import yfinance
+from curl_cffi import requests as curl_requests
+from yfinance.data import YfData
+
+import src.session
+from src.governance import RequestGovernor
+from src.session import (
+    ReuseCountingSession,
+    seed_yahoo_crumb,
+    yahoo_cookie_url,
+    yahoo_crumb,
+    yahoo_crumb_url,
+    yfinance_crumb_supported,
+)
+
+logger: logging.Logger = logging.getLogger("tests.session")
+
+
+class FakeResponse(object):
+    def __init__(self, text: str, status_code: int) -> None:
+        self.text: str = text
+        self.status_code: int = status_code
+
+
+class FakeSession(object):
+    """
+    Session answering the public cookie and crumb handshake.
+    """
+
+    def __init__(self, crumb: str) -> None:
+        self.crumb: str = crumb
+        self.urls: List[str] = []
+
+    def get(self, url: str, **kwargs: Any) -> FakeResponse:
+        self.urls.append(url)
+        if url == yahoo_crumb_url:
+            return FakeResponse(text=self.crumb, status_code=200)
+        return FakeResponse(text="Not Found", status_code=404)
+
+
+@pytest.fixture
+def governor() -> RequestGovernor:
+    return RequestGovernor(logger=logger, rate=1_000, max_concurrency=1)
+
+
+@pytest.fixture
+def unsupported_yfinance(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(src.session, "yfinance_crumb_versions", ((0, 0), (0, 0)))
+
+
+def test_installed_yfinance_is_supported() -> None:
+    # Fails once a yfinance release outside `yfinance_crumb_versions` is locked, which then needs checking
+    assert yfinance_crumb_supported(), yfinance.__version__
+
+
+def test_seeded_crumb_is_reused_without_a_handshake(governor: RequestGovernor) -> None:
+    session: ReuseCountingSession = ReuseCountingSession(impersonate="chrome")
+    assert seed_yahoo_crumb(logger=logger, session=session, crumb="seeded")
+
+    crumb, cookie_session = yahoo_crumb(
+        logger=logger, governor=governor, session=session
+    )
+
+    assert (crumb, cookie_session) == ("seeded", session)
+    assert session.requests_sent == 0
+
+
+@pytest.mark.usefixtures("unsupported_yfinance")
+def test_unsupported_yfinance_falls_back_to_the_public_handshake(
+    governor: RequestGovernor,
+) -> None:
+    session: Any = FakeSession(crumb="public")
+
+    crumb, cookie_session = yahoo_crumb(
+        logger=logger, governor=governor, session=session
+    )
+
+    assert (crumb, cookie_session) == ("public", session)
+    assert session.urls == [yahoo_cookie_url, yahoo_crumb_url]
+    assert not seed_yahoo_crumb(logger=logger, session=session, crumb="seeded")
+
+
+@pytest.mark.usefixtures("unsupported_yfinance")
+def test_missing_crumb_raises(governor: RequestGovernor) -> None:
+    session: Any = FakeSession(crumb="<html>Too Many Requests</html>")
+
+    with pytest.raises(ValueError):
+        yahoo_crumb(logger=logger, governor=governor, session=session)
+
+
+def teardown_module() -> None:
+    # `YfData` is a process-wide singleton, which must not keep the seeded crumb
+    yf_data: YfData = YfData(session=curl_requests.Session(impersonate="chrome"))
+    yf_data._cookie, yf_data._crumb = None, None
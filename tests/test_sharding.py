@@ -0,0 +1,233 @@
+import io
+import json
+import logging
+from datetime import date
+from typing import Any, Dict, List
+
+import pytest
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+
+from src.sharding import (
+    claim_commit,
+    commit_shards,
+    missing_shards,
+    put_if_absent,
+    select_shard,
+    shard_of,
+    shared_gainers_losers,
+    snapshot_shard,
+)
+
+logger: logging.Logger = logging.getLogger("tests.sharding")
+bucket: str = "bucket"
+run_date: date = date(2024, 6, 28)
+prefix: str = "shards/etf_kpis_2024_06_28"
+snapshot: Dict[str, Any] = {"top_gainers": [{"ticker": "SPY"}]}
+
+
+def add_snapshot_missing(stubber: Stubber) -> None:
+    stubber.add_client_error(
+        "get_object",
+        service_error_code="NoSuchKey",
+        http_status_code=404,
+        expected_params={"Bucket": bucket, "Key": f"{prefix}/top_gainers_losers.json"},
+    )
+
+
+def add_snapshot(stubber: Stubber, content: Dict[str, Any]) -> None:
+    body: bytes = json.dumps(content).encode()
+    stubber.add_response(
+        "get_object",
+        {"Body": StreamingBody(io.BytesIO(body), len(body))},
+        expected_params={"Bucket": bucket, "Key": f"{prefix}/top_gainers_losers.json"},
+    )
+
+
+def add_put_if_absent(stubber: Stubber, key: str, created: bool) -> None:
+    expected: Dict[str, Any] = {
+        "Bucket": bucket,
+        "Key": key,
+        "Body": ANY,
+        "IfNoneMatch": "*",
+    }
+    if created:
+        stubber.add_response("put_object", {}, expected_params=expected)
+    else:
+        stubber.add_client_error(
+            "put_object",
+            service_error_code="PreconditionFailed",
+            http_status_code=412,
+            expected_params=expected,
+        )
+
+
+def test_shards_partition_the_symbols() -> None:
+    symbols: List[str] = [f"S{index}" for index in range(100)]
+    shards: List[List[str]] = [select_shard(symbols, index, 4) for index in range(4)]
+
+    assert sorted(sum(shards, [])) == sorted(symbols)
+    assert all(shard_of(symbol, 4) == shard_of(symbol, 4) for symbol in symbols)
+    with pytest.raises(ValueError):
+        select_shard(symbols, 4, 4)
+
+
+def test_claim_commit_succeeds_once(s3_stub: Stubber) -> None:
+    add_put_if_absent(s3_stub, f"{prefix}/_COMMIT", created=True)
+    add_put_if_absent(s3_stub, f"{prefix}/_COMMIT", created=False)
+
+    assert claim_commit(bucket, run_date)
+    assert not claim_commit(bucket, run_date)
+
+
+def test_put_if_absent_raises_other_errors(s3_stub: Stubber) -> None:
+    s3_stub.add_client_error(
+        "put_object", service_error_code="AccessDenied", http_status_code=403
+    )
+
+    with pytest.raises(Exception, match="AccessDenied"):
+        put_if_absent(f"s3://{bucket}/{prefix}/_COMMIT", b"")
+
+
+def test_snapshot_shard_fetches_and_shares(s3_stub: Stubber) -> None:
+    add_snapshot_missing(s3_stub)
+    add_put_if_absent(s3_stub, f"{prefix}/top_gainers_losers.json", created=True)
+    calls: List[int] = []
+
+    def fetch() -> Dict[str, Any]:
+        calls.append(1)
+        return snapshot
+
+    shared: Dict[str, Any] = shared_gainers_losers(
+        logger=logger,
+        s3_bucket=bucket,
+        run_date=run_date,
+        shard_index=snapshot_shard,
+        fetch=fetch,
+    )
+
+    assert shared == snapshot
+    assert calls == [1]
+
+
+def test_relaunched_snapshot_shard_reuses_the_shared_snapshot(
+    s3_stub: Stubber,
+) -> None:
+    add_snapshot(s3_stub, snapshot)
+
+    def fetch() -> Dict[str, Any]:
+        raise AssertionError("Alpha Vantage must not be called again")
+
+    assert (
+        shared_gainers_losers(
+            logger=logger,
+            s3_bucket=bucket,
+            run_date=run_date,
+            shard_index=snapshot_shard,
+            fetch=fetch,
+        )
+        == snapshot
+    )
+
+
+def test_snapshot_shard_losing_the_race_returns_the_winner(s3_stub: Stubber) -> None:
+    winner: Dict[str, Any] = {"top_gainers": [{"ticker": "QQQ"}]}
+    add_snapshot_missing(s3_stub)
+    add_put_if_absent(s3_stub, f"{prefix}/top_gainers_losers.json", created=False)
+    add_snapshot(s3_stub, winner)
+
+    assert (
+        shared_gainers_losers(
+            logger=logger,
+            s3_bucket=bucket,
+            run_date=run_date,
+            shard_index=snapshot_shard,
+            fetch=lambda: snapshot,
+        )
+        == winner
+    )
+
+
+def test_other_shards_wait_for_the_snapshot(s3_stub: Stubber) -> None:
+    add_snapshot_missing(s3_stub)
+    add_snapshot_missing(s3_stub)
+    add_snapshot(s3_stub, snapshot)
+
+    def fetch() -> Dict[str, Any]:
+        raise AssertionError("Only the snapshot shard calls Alpha Vantage")
+
+    assert (
+        shared_gainers_losers(
+            logger=logger,
+            s3_bucket=bucket,
+            run_date=run_date,
+            shard_index=snapshot_shard + 1,
+            fetch=fetch,
+            poll_interval=0,
+        )
+        == snapshot
+    )
+
+
+def test_other_shards_time_out_without_a_snapshot(s3_stub: Stubber) -> None:
+    add_snapshot_missing(s3_stub)
+
+    with pytest.raises(TimeoutError):
+        shared_gainers_losers(
+            logger=logger,
+            s3_bucket=bucket,
+            run_date=run_date,
+            shard_index=snapshot_shard + 1,
+            fetch=lambda: snapshot,
+            timeout=0,
+        )
+
+
+def add_done_listing(stubber: Stubber, done: List[int], shard_count: int) -> None:
+    stubber.add_response(
+        "list_objects_v2",
+        {
+            "Contents": [
+                {"Key": f"{prefix}/done-{index:03d}-of-{shard_count:03d}"}
+                for index in done
+            ]
+        },
+        expected_params={"Bucket": bucket, "Prefix": f"{prefix}/done-"},
+    )
+
+
+def test_missing_shards(s3_stub: Stubber) -> None:
+    add_done_listing(s3_stub, done=[0, 2], shard_count=4)
+
+    assert missing_shards(bucket, run_date, 4) == [1, 3]
+
+
+def test_commit_waits_for_every_shard(s3_stub: Stubber) -> None:
+    add_done_listing(s3_stub, done=[0, 1], shard_count=3)
+
+    assert (
+        commit_shards(
+            logger=logger,
+            s3_bucket=bucket,
+            run_date=run_date,
+            shard_count=3,
+            s3_path=f"s3://{bucket}/daily-kpis/etf_kpis_2024_06_28",
+        )
+        is None
+    )
+
+
+def test_commit_is_left_to_the_shard_that_claims_it(s3_stub: Stubber) -> None:
+    add_done_listing(s3_stub, done=[0, 1], shard_count=2)
+    add_put_if_absent(s3_stub, f"{prefix}/_COMMIT", created=False)
+
+    assert (
+        commit_shards(
+            logger=logger,
+            s3_bucket=bucket,
+            run_date=run_date,
+            shard_count=2,
+            s3_path=f"s3://{bucket}/daily-kpis/etf_kpis_2024_06_28",
+        )
+        is None
+    )
@@ -0,0 +1,47 @@
+from datetime import date
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from src.writer import ParquetStreamWriter
+
+
+def write_rows(path: Path, rows: int, fail: BaseException | None = None) -> None:
+    with ParquetStreamWriter(
+        path=str(path), run_date=date(2024, 6, 28), row_group_size=2
+    ) as writer:
+        for index in range(rows):
+            writer.append({"symbol": f"S{index}"})
+        if fail is not None:
+            raise fail
+
+
+def test_close_moves_the_file_into_place(tmp_path: Path) -> None:
+    output: Path = tmp_path / "etf_kpis_2024_06_28.parquet"
+    write_rows(output, rows=5)
+
+    assert [path.name for path in tmp_path.iterdir()] == [output.name]
+    table: pa.Table = pq.read_table(output)
+    assert table.column("symbol").to_pylist() == [f"S{index}" for index in range(5)]
+    assert pq.ParquetFile(output).metadata.num_row_groups == 3
+
+
+def test_run_without_rows_leaves_no_file(tmp_path: Path) -> None:
+    write_rows(tmp_path / "etf_kpis_2024_06_28.parquet", rows=0)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("error", [RuntimeError("upstream"), SystemExit(143)])
+def test_interrupted_run_leaves_no_file(tmp_path: Path, error: BaseException) -> None:
+    output: Path = tmp_path / "etf_kpis_2024_06_28.parquet"
+    output.write_bytes(b"previous run")
+
+    with pytest.raises(type(error)):
+        write_rows(output, rows=5, fail=error)
+
+    # Neither a truncated file at the output path nor the temporary file is left behind
+    assert [path.name for path in tmp_path.iterdir()] == [output.name]
+    assert output.read_bytes() == b"previous run"